@@ -0,0 +1,60 @@
+; Benchmark of the simulator.
+;
+; The program repeatedly copies a string as in memcpy.asm and uppercases the
+; copy as in upcase.asm, executing a couple of million instructions. It runs on
+; CP/M and returns to the operating system when done. Run it with:
+;
+; sim80 -v bench.com
+
+
+TPA         equ     100h
+REPEAT      equ     10000               ; Number of iterations
+LOWERA      equ     61h                 ; ASCII lowercase a
+PASTZ       equ     7bh                 ; ASCII lowercase z + 1
+OFFSET      equ     32                  ; lowercase-uppercase offset
+LEN         equ     17                  ; String length
+
+
+            org     TPA
+
+            lxi     b, REPEAT           ; Iteration counter
+
+outer:      push    b
+            lxi     h, source           ; Source string
+            lxi     d, dest             ; Destination
+            mvi     c, LEN              ; Length counter
+
+copy:       mov     a, m                ; Load from source
+            stax    d                   ; Copy to destination
+            inx     h                   ; Next source character
+            inx     d                   ; Next destination memory cell
+            dcr     c                   ; Decrement counter
+            jnz     copy
+
+            lxi     h, dest             ; Uppercase the copy
+            mvi     c, LEN
+
+upcase:     mov     a, m
+            cpi     LOWERA              ; < a?
+            jc      skip                ; Yes, skip to next character
+            cpi     PASTZ               ; > z?
+            jnc     skip                ; Yes, skip to next character
+            sui     OFFSET              ; Subtract offset to get uppercase
+            mov     m, a
+skip:       inx     h
+            dcr     c
+            jnz     upcase
+
+            pop     b
+            dcx     b                   ; Decrement iteration counter
+            mov     a, b
+            ora     c                   ; bc == 0?
+            jnz     outer               ; No
+
+            ret
+
+
+source:     db      'Hello from sim80!'
+dest:       ds      17
+
+            end
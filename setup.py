@@ -29,10 +29,22 @@ setup(
     ],
     python_requires='>=3.6',
     packages=['suite8080'],
+    extras_require={
+        'numpy': ['numpy']
+    },
     entry_points={
         'console_scripts': [
             'asm80=suite8080.asm80:main',
-            'dis80=suite8080.dis80:main'
+            'dis80=suite8080.dis80:main',
+            'find80=suite8080.find80:main',
+            'diff80=suite8080.diff80:main',
+            'sim80=suite8080.sim80:main',
+            'cpm80=suite8080.cpm80:main',
+            'prof80=suite8080.prof80:main',
+            'test80=suite8080.test80:main',
+            'trace80=suite8080.trace80:main',
+            'dbg80=suite8080.dbg80:main',
+            'cov80=suite8080.cov80:main'
         ]
     }
 )
\ No newline at end of file
@@ -0,0 +1,211 @@
+"""Intel 8080 arithmetic and logic with precomputed flag tables.
+
+The tables hold the results and flags of the ALU operations for all the
+operand values, so that a simulator or an analysis tool gets them with a
+lookup rather than computing the flags bit by bit. The reference functions
+compute the same values bit by bit and are the specification the tables are
+tested against."""
+
+from array import array
+
+# Flag bits of the PSW (program status word) register F.
+SIGN = 0x80
+ZERO = 0x40
+AUX_CARRY = 0x10
+PARITY = 0x04
+CARRY = 0x01
+
+
+# Reference implementations. They take the operand values and return the 8-bit
+# result and the new flags, following the 8080 behavior. For example,
+# subtraction is performed as the addition of the two's complement, which sets
+# the auxiliary carry in a way that differs from the Z80.
+
+def reference_szp(value):
+    """Return the sign, zero, and parity flags of an 8-bit result."""
+    ones = 0
+    for bit in range(8):
+        ones += value >> bit & 1
+    flags = SIGN if value & 0x80 else 0
+    if value == 0:
+        flags |= ZERO
+    if ones % 2 == 0:
+        flags |= PARITY
+    return flags
+
+
+def reference_add(a, value, carry):
+    """Add value and carry to a."""
+    total = a + value + carry
+    result = total & 0xff
+    flags = reference_szp(result)
+    if (a & 0x0f) + (value & 0x0f) + carry > 0x0f:
+        flags |= AUX_CARRY
+    if total > 0xff:
+        flags |= CARRY
+    return result, flags
+
+
+def reference_sub(a, value, borrow):
+    """Subtract value and borrow from a."""
+    difference = a - value - borrow
+    result = difference & 0xff
+    flags = reference_szp(result)
+    if (a & 0x0f) + (~value & 0x0f) + (1 - borrow) > 0x0f:
+        flags |= AUX_CARRY
+    if difference < 0:
+        flags |= CARRY
+    return result, flags
+
+
+def reference_and(a, value):
+    """And value with a. The auxiliary carry is the or of bit 3 of the operands."""
+    result = a & value
+    flags = reference_szp(result)
+    if (a | value) & 0x08:
+        flags |= AUX_CARRY
+    return result, flags
+
+
+def reference_xor(a, value):
+    """Exclusive or value with a."""
+    result = a ^ value
+    return result, reference_szp(result)
+
+
+def reference_or(a, value):
+    """Or value with a."""
+    result = a | value
+    return result, reference_szp(result)
+
+
+def reference_inr(value, flags):
+    """Increment value, preserving the carry in flags."""
+    result = (value + 1) & 0xff
+    new_flags = reference_szp(result) | (flags & CARRY)
+    if (value & 0x0f) == 0x0f:
+        new_flags |= AUX_CARRY
+    return result, new_flags
+
+
+def reference_dcr(value, flags):
+    """Decrement value, preserving the carry in flags."""
+    result = (value - 1) & 0xff
+    new_flags = reference_szp(result) | (flags & CARRY)
+    if (value & 0x0f) != 0:
+        new_flags |= AUX_CARRY
+    return result, new_flags
+
+
+def reference_daa(a, flags):
+    """Decimal adjust a."""
+    correction = 0
+    carry = flags & CARRY
+    if (a & 0x0f) > 9 or flags & AUX_CARRY:
+        correction |= 0x06
+    if (a >> 4) > 9 or ((a >> 4) >= 9 and (a & 0x0f) > 9) or carry:
+        correction |= 0x60
+        carry = CARRY
+    result, new_flags = reference_add(a, correction, 0)
+    return result, (new_flags & ~CARRY) | carry
+
+
+# Tables. SZP, INR_FLAGS, and DCR_FLAGS are indexed by an 8-bit result and hold
+# flags. ADD and SUB are indexed by carry << 16 | a << 8 | value, and DAA by
+# (flags & (AUX_CARRY | CARRY)) << 8 | a. Their entries hold result << 8 | flags.
+# The auxiliary carry of the sums is bit 4 of a ^ value ^ sum, the carry into
+# bit 4.
+
+SZP = bytes((value & SIGN) | (0 if value else ZERO) | (0 if bin(value).count('1') & 1 else PARITY)
+            for value in range(0x100))
+
+INR_FLAGS = bytes(SZP[result] | (0 if result & 0x0f else AUX_CARRY) for result in range(0x100))
+
+DCR_FLAGS = bytes(SZP[result] | (0 if result & 0x0f == 0x0f else AUX_CARRY)
+                  for result in range(0x100))
+
+
+def add_entry(a, value, carry):
+    """Return the ADD table entry of the operands."""
+    total = a + value + carry
+    result = total & 0xff
+    return result << 8 | SZP[result] | (a ^ value ^ total) & AUX_CARRY | total >> 8
+
+
+def sub_entry(a, value, borrow):
+    """Return the SUB table entry of the operands.
+
+    The 8080 subtracts by adding the complement of value and the complement
+    of borrow, and the carry flag is the complement of the carry out."""
+    total = a + (value ^ 0xff) + (borrow ^ 1)
+    result = total & 0xff
+    return result << 8 | SZP[result] | (a ^ value ^ 0xff ^ total) & AUX_CARRY | (total >> 8) ^ CARRY
+
+
+ADD = array('H', (add_entry(index >> 8 & 0xff, index & 0xff, index >> 16)
+                  for index in range(0x20000)))
+
+SUB = array('H', (sub_entry(index >> 8 & 0xff, index & 0xff, index >> 16)
+                  for index in range(0x20000)))
+
+
+def daa_entry(a, flags):
+    """Return the DAA table entry of a and the auxiliary carry and carry in flags."""
+    low = 0x06 if (a & 0x0f) > 9 or flags & AUX_CARRY else 0
+    high = 0x60 if a > 0x99 or flags & CARRY else 0
+    entry = ADD[a << 8 | (low | high)]
+    return entry & ~CARRY | (CARRY if high else 0)
+
+
+DAA = array('H', (daa_entry(index & 0xff, index >> 8) for index in range(0x1200)))
+
+
+# Table-based operations, with the same arguments and return values as the
+# reference functions.
+
+def add(a, value, carry=0):
+    """Add value and carry to a."""
+    entry = ADD[carry << 16 | a << 8 | value]
+    return entry >> 8, entry & 0xff
+
+
+def sub(a, value, borrow=0):
+    """Subtract value and borrow from a."""
+    entry = SUB[borrow << 16 | a << 8 | value]
+    return entry >> 8, entry & 0xff
+
+
+def ana(a, value):
+    """And value with a."""
+    result = a & value
+    return result, SZP[result] | ((a | value) & 0x08) << 1
+
+
+def xra(a, value):
+    """Exclusive or value with a."""
+    result = a ^ value
+    return result, SZP[result]
+
+
+def ora(a, value):
+    """Or value with a."""
+    result = a | value
+    return result, SZP[result]
+
+
+def inr(value, flags):
+    """Increment value, preserving the carry in flags."""
+    result = value + 1 & 0xff
+    return result, INR_FLAGS[result] | flags & CARRY
+
+
+def dcr(value, flags):
+    """Decrement value, preserving the carry in flags."""
+    result = value - 1 & 0xff
+    return result, DCR_FLAGS[result] | flags & CARRY
+
+
+def daa(a, flags):
+    """Decimal adjust a."""
+    entry = DAA[(flags & (AUX_CARRY | CARRY)) << 8 | a]
+    return entry >> 8, entry & 0xff
@@ -27,6 +27,32 @@ comment = ''
 # Symbol table: {'label1': <address1>, 'label2': <address2>, ...}
 symbol_table = {}
 
+# Cross-references: {'label1': [(<line1>, 'kind1'), (<line2>, 'kind2'), ...], ...}
+#
+# The kind is the way the instruction at the line uses the label, e.g. call.
+references = {}
+
+# Cross-reference kinds by mnemonic. Other uses of labels have kind operand.
+REFERENCE_KINDS = {
+    'call': 'call', 'cnz': 'call', 'cz': 'call', 'cnc': 'call', 'cc': 'call',
+    'cpo': 'call', 'cpe': 'call', 'cp': 'call', 'cm': 'call',
+    'jmp': 'jump', 'jnz': 'jump', 'jz': 'jump', 'jnc': 'jump', 'jc': 'jump',
+    'jpo': 'jump', 'jpe': 'jump', 'jp': 'jump', 'jm': 'jump',
+    'lda': 'load', 'lhld': 'load',
+    'sta': 'store', 'shld': 'store',
+    'lxi': 'pointer',
+}
+
+
+# Address to source line map: [(<address1>, <size1>, <line1>), ...]
+#
+# Each entry holds the address and size of the code of an instruction, and the
+# number of its source line. Data directives aren't listed.
+line_map = []
+
+# Directives generating data rather than code.
+DATA_DIRECTIVES = ('db', 'dw', 'ds')
+
 
 # Immediate operand type, 8-bit or 16-bit. An enum would be overkill and verbose.
 IMMEDIATE8=8
@@ -39,7 +65,17 @@ OUTFILE = 'program'
 
 def assemble(lines):
     """Assemble source lines."""
-    global lineno, source_pass
+    global lineno, address, source_pass, output, symbol_table, references, line_map
+
+    # Start from a clean state so that more programs can be assembled in turn.
+    address = 0
+    output = b''
+    symbol_table = {}
+    references = {}
+    line_map = []
+    # Addresses of the source lines, indexed by line number. Pass 2 doesn't
+    # track the addresses, so pass 1 saves them for the line map.
+    line_addresses = {}
 
     # The end Assembly directive raises StopIteration, which we catch and do
     # nothing so that instuction parsing and processing ends and execution can
@@ -47,6 +83,7 @@ def assemble(lines):
     source_pass = 1
     try:
         for lineno, line in enumerate(lines):
+            line_addresses[lineno] = address
             parse(line)
             process_instruction()
     except StopIteration:
@@ -56,7 +93,11 @@ def assemble(lines):
     try:
         for lineno, line in enumerate(lines):
             parse(line)
+            size = len(output)
             process_instruction()
+            size = len(output) - size
+            if size and mnemonic not in DATA_DIRECTIVES:
+                line_map.append((line_addresses[lineno], size, lineno + 1))
     except StopIteration:
         pass
 
@@ -189,10 +230,21 @@ def parse_db(line):
     """
     db_label = db_directive = db_arguments = ''
 
-    # The separator argument of .partition() is case-sensitive.
-    left1, sep1, right1 = line.partition('db')
-    if sep1 == '':
-        left1, sep1, right1 = line.partition('DB')
+    # The directive must be a whole word, so that labels or operands containing
+    # the same letters, such as dbuf or 0dbh, aren't mistaken for it. The search
+    # is case-sensitive.
+    left1 = sep1 = right1 = ''
+    for directive in ('db', 'DB'):
+        index = line.find(directive)
+        while index >= 0:
+            before = line[index - 1] if index > 0 else ' '
+            after = line[index + 2:index + 3] or ' '
+            if (before.isspace() or before == ':') and after.isspace():
+                left1, sep1, right1 = line[:index], directive, line[index + 2:]
+                break
+            index = line.find(directive, index + 1)
+        if sep1:
+            break
     # No db directive found.
     if sep1 == '':
         return db_label, db_directive, db_arguments
@@ -442,6 +494,13 @@ def add_label():
     symbol_table[symbol] = address
 
 
+def add_reference(symbol):
+    """Add to the cross-references the use of symbol at the current line."""
+    kind = REFERENCE_KINDS.get(mnemonic, 'operand')
+    # List indexes start at 0 but humans count lines starting at 1.
+    references.setdefault(symbol, []).append((lineno + 1, kind))
+
+
 # nop: 0x00
 def nop():
     check_operands(operand1 == operand2 == '')
@@ -1047,6 +1106,7 @@ def db():
                 if symbol not in symbol_table:
                     report_error(f'undefined label "{argument}"')
                 value = symbol_table[symbol]
+                add_reference(symbol)
                 value_size = 1 if (0 <= value <= 255) else 2
                 output += value.to_bytes(value_size, byteorder='little')
                 address += value_size
@@ -1260,6 +1320,7 @@ def immediate_operand(operand_type=IMMEDIATE8):
         if operand not in symbol_table:
             report_error(f'undefined label "{operand}"')
         number = symbol_table[operand]
+        add_reference(operand)
 
     if source_pass == 2:
         operand_size = 1 if operand_type == IMMEDIATE8  else 2
@@ -1278,8 +1339,10 @@ def address16():
         # Valid addresses are non-negative, so a negative address is an appropriate
         # default for a label not in the symbol table.
         number = symbol_table.get(operand1.lower(), -1)
-        if source_pass == 2 and number < 0:
-            report_error(f'undefined label "{operand1}"')
+        if source_pass == 2:
+            if number < 0:
+                report_error(f'undefined label "{operand1}"')
+            add_reference(operand1.lower())
 
     if source_pass == 2:
         output += number.to_bytes(2, byteorder='little')
@@ -1313,6 +1376,10 @@ def main():
                         help=f'output file, {OUTFILE + ".com"} if input is - and -o not supplied')
     parser.add_argument('-s', '--symtab', action='store_true',
                         help='save symbol table')
+    parser.add_argument('-x', '--xref', action='store_true',
+                        help='save cross-references of the symbols')
+    parser.add_argument('-m', '--map', action='store_true',
+                        help='save the map of the instruction addresses to the source lines')
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='increase output verbosity')
     args = parser.parse_args()
@@ -1327,22 +1394,36 @@ def main():
     if args.filename == '-':
         outfile = args.outfile if args.outfile else OUTFILE + '.com'
         symfile = Path(args.outfile).stem + '.sym' if args.outfile else OUTFILE + '.sym'
+        xrffile = Path(args.outfile).stem + '.xrf' if args.outfile else OUTFILE + '.xrf'
+        mapfile = Path(args.outfile).stem + '.map' if args.outfile else OUTFILE + '.map'
     elif args.outfile:
         outfile = Path(args.outfile)
         symfile = Path(args.outfile).stem + '.sym'
+        xrffile = Path(args.outfile).stem + '.xrf'
+        mapfile = Path(args.outfile).stem + '.map'
     else:
         outfile = Path(infile.stem + '.com')
         symfile = Path(infile.stem + '.sym')
+        xrffile = Path(infile.stem + '.xrf')
+        mapfile = Path(infile.stem + '.map')
 
     assemble(lines)
     bytes_written = write_binary_file(outfile, output)
     if args.symtab:
         symbol_count = write_symbol_table(symbol_table, symfile)
+    if args.xref:
+        xref_count = write_cross_references(symbol_table, references, xrffile)
+    if args.map:
+        map_count = write_line_map(line_map, mapfile)
 
     if args.verbose:
         print(f'{bytes_written} bytes written')
         if args.symtab:
             print(f'{symbol_count} symbols written')
+        if args.xref:
+            print(f'{xref_count} cross-referenced symbols written')
+        if args.map:
+            print(f'{map_count} source lines mapped')
 
 
 def write_binary_file(filename, binary_data):
@@ -1372,5 +1453,41 @@ def write_symbol_table(table, filename):
     return symbol_count
 
 
+def write_cross_references(table, xrefs, filename):
+    """Save cross-references to filename and return the number of symbols written.
+
+    Each line of the text file holds a symbol, its address, and the source lines
+    using it along with the kind of use, e.g. ``12:call``. The symbols are sorted
+    and those never used are listed too. No file is created if the table is
+    empty."""
+    symbol_count = len(table)
+    if symbol_count == 0:
+        return symbol_count
+
+    with open(filename, 'w', encoding='utf-8') as file:
+        for symbol in sorted(table):
+            uses = ' '.join(f'{line}:{kind}' for line, kind in xrefs.get(symbol, []))
+            print(f'{symbol[:16].upper():16} {table[symbol]:04X} {uses}'.rstrip(), file=file)
+
+    return symbol_count
+
+
+def write_line_map(entries, filename):
+    """Save the address to source line map to filename and return the number of entries written.
+
+    Each line of the text file holds the hex address and the decimal size of
+    the code of an instruction, and the number of its source line, e.g.
+    ``0100 3 12``. No file is created if the map is empty."""
+    entry_count = len(entries)
+    if entry_count == 0:
+        return entry_count
+
+    with open(filename, 'w', encoding='utf-8') as file:
+        for address, size, line in entries:
+            print(f'{address:04X} {size} {line}', file=file)
+
+    return entry_count
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,227 @@
+"""A code coverage tool for Intel 8080 programs mapping the executed instructions to source lines."""
+
+import argparse
+import html
+from pathlib import Path
+import sys
+
+from suite8080 import cpm80
+from suite8080 import dis80
+from suite8080 import sim80
+
+# A coverage bitmap holds one byte for each address, 1 if an instruction
+# starting there was executed and 0 otherwise.
+BITMAP_SIZE = sim80.MEMORY_SIZE
+
+HTML_HEAD = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Coverage of {name}</title>
+<style>
+pre {{ margin: 0; }}
+.covered {{ background: #cfc; }}
+.missed {{ background: #fcc; }}
+</style>
+</head>
+<body>
+<h1>Coverage of {name}</h1>
+<p>{summary}</p>
+'''
+
+HTML_TAIL = '''</body>
+</html>
+'''
+
+
+def run(cpu, bitmap, limit=None):
+    """Run cpu until hlt or limit instructions, marking in bitmap the addresses of the executed instructions.
+
+    Return the number of executed instructions. The program runs on the block
+    engine, which reports the instructions each block ran only when they're
+    more than before, so the instructions of a block are marked only once."""
+    memory = cpu.memory
+    sizes = dis80.SIZES
+
+    def mark(start, count):
+        address = start
+        for _ in range(count):
+            bitmap[address] = 1
+            address = address + sizes[memory[address]] & 0xffff
+
+    return cpu.run_blocks(limit, mark)
+
+
+def read_bitmap(filename):
+    """Return the coverage bitmap in filename.
+
+    Raise ValueError if the file isn't a bitmap."""
+    bitmap = Path(filename).read_bytes()
+    if len(bitmap) != BITMAP_SIZE:
+        raise ValueError(f'not a coverage bitmap, {len(bitmap)} bytes')
+    return bitmap
+
+
+def merge_bitmaps(bitmaps):
+    """Return the bytewise OR of the coverage bitmaps.
+
+    The bitmaps are converted to integers, so the OR runs at C speed over the
+    whole bitmap rather than one byte at a time."""
+    merged = 0
+    for bitmap in bitmaps:
+        merged |= int.from_bytes(bitmap, 'little')
+    return merged.to_bytes(BITMAP_SIZE, 'little')
+
+
+def read_line_map(filename):
+    """Return the list of (address, size, line) entries of the asm80 line map in filename.
+
+    Raise ValueError if the file is malformed."""
+    entries = []
+    with open(filename, encoding='utf-8') as file:
+        for line_number, text in enumerate(file, 1):
+            fields = text.split()
+            if not fields:
+                continue
+            try:
+                address, size, line = fields
+                entries.append((int(address, 16), int(size), int(line)))
+            except ValueError:
+                raise ValueError(f'line {line_number}: malformed map entry') from None
+    return entries
+
+
+def line_coverage(entries, bitmap):
+    """Return a dictionary mapping the source lines of the map entries to True if executed.
+
+    A line is executed if an instruction starting at one of its addresses is
+    marked in bitmap."""
+    coverage = {}
+    for address, size, line in entries:
+        end = min(address + size, BITMAP_SIZE)
+        coverage[line] = coverage.get(line, False) or any(bitmap[address:end])
+    return coverage
+
+
+def summary(coverage):
+    """Return the text summarizing the coverage of the source lines."""
+    total = len(coverage)
+    covered = sum(coverage.values())
+    percent = 100 * covered / total if total else 100
+    return f'{covered} of {total} lines covered ({percent:.1f}%)'
+
+
+def write_text(file, source_lines, coverage):
+    """Write to file the source listing annotated with the coverage, followed by the summary.
+
+    Each line starts with + if executed, - if not executed, and a space if it
+    holds no instruction."""
+    for line, text in enumerate(source_lines, 1):
+        executed = coverage.get(line)
+        marker = ' ' if executed is None else '+' if executed else '-'
+        print(f'{marker} {line:5d}  {text}', file=file)
+    print(summary(coverage), file=file)
+
+
+def write_html(file, name, source_lines, coverage):
+    """Write to file an HTML page of the source listing named name annotated with the coverage."""
+    file.write(HTML_HEAD.format(name=html.escape(name), summary=summary(coverage)))
+    for line, text in enumerate(source_lines, 1):
+        executed = coverage.get(line)
+        attribute = '' if executed is None else ' class="covered"' if executed else ' class="missed"'
+        file.write(f'<pre{attribute}>{line:5d}  {html.escape(text)}</pre>\n')
+    file.write(HTML_TAIL)
+
+
+def write_lcov(file, name, coverage):
+    """Write to file the coverage of the source file name in LCOV tracefile format."""
+    print('TN:', file=file)
+    print(f'SF:{name}', file=file)
+    for line in sorted(coverage):
+        print(f'DA:{line},{int(coverage[line])}', file=file)
+    print(f'LF:{len(coverage)}', file=file)
+    print(f'LH:{sum(coverage.values())}', file=file)
+    print('end_of_record', file=file)
+
+
+def report(args, parser):
+    """Merge the bitmap files in args and write the coverage reports of the source file."""
+    if not args.arguments:
+        parser.error('bitmap files required with --report')
+    map_file = args.map or Path(args.filename).stem + '.map'
+    try:
+        source_lines = Path(args.filename).read_text(encoding='utf-8').splitlines()
+        entries = read_line_map(map_file)
+        bitmap = merge_bitmaps(read_bitmap(filename) for filename in args.arguments)
+        if args.outfile:
+            Path(args.outfile).write_bytes(bitmap)
+        coverage = line_coverage(entries, bitmap)
+        write_text(sys.stdout, source_lines, coverage)
+        if args.html:
+            with open(args.html, 'w', encoding='utf-8') as file:
+                write_html(file, args.filename, source_lines, coverage)
+        if args.lcov:
+            with open(args.lcov, 'w', encoding='utf-8') as file:
+                write_lcov(file, args.filename, coverage)
+    except (OSError, ValueError) as error:
+        print(f'cov80> {error}', file=sys.stderr)
+        sys.exit(1)
+
+
+def main():
+    """Parse the command line, and record the coverage of the program or report the coverage of the source file."""
+    cov80_description = f'Intel 8080 code coverage tool / Suite8080'
+    parser = argparse.ArgumentParser(description=cov80_description)
+    parser.add_argument('filename', help='program file, or source file with --report')
+    parser.add_argument('arguments', nargs='*',
+                        help='command line arguments of a CP/M program, or bitmap files with --report')
+    parser.add_argument('-o', '--outfile',
+                        help='coverage bitmap file, the program name with the .cov extension if not supplied, '
+                             'or merged bitmap file with --report')
+    parser.add_argument('-r', '--report', action='store_true',
+                        help='report the coverage of the source file from the bitmap files')
+    parser.add_argument('-m', '--map',
+                        help='asm80 line map file, the source name with the .map extension if not supplied')
+    parser.add_argument('--html', help='HTML report file')
+    parser.add_argument('--lcov', help='LCOV tracefile')
+    parser.add_argument('--org', type=dis80.number, default=sim80.ORG,
+                        help=f'load and start address, {sim80.ORG:04x}h if not supplied')
+    parser.add_argument('-n', '--limit', type=int,
+                        help='maximum number of instructions to execute')
+    parser.add_argument('-c', '--cpm', action='store_true',
+                        help='run the program in the cpm80 CP/M environment')
+    parser.add_argument('-d', '--directory', default='.',
+                        help='host directory holding the files of drive A: with --cpm, the current directory if not supplied')
+    args = parser.parse_args()
+
+    if args.report:
+        report(args, parser)
+        return
+
+    cpu = cpm80.load_cpu(parser, args)
+
+    bitmap = bytearray(BITMAP_SIZE)
+    failure = None
+    try:
+        run(cpu, bitmap, args.limit)
+    except ValueError as error:
+        failure = f'{cpu.pc:04x}: {error}'
+    finally:
+        if args.cpm:
+            cpu.flush()
+            cpu.close_files()
+
+    # The coverage up to a failure is still worth saving.
+    outfile = args.outfile or Path(args.filename).stem + '.cov'
+    try:
+        Path(outfile).write_bytes(bitmap)
+    except OSError as error:
+        print(f'cov80> {error}', file=sys.stderr)
+        sys.exit(1)
+    if failure:
+        print(f'cov80> {failure}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
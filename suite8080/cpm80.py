@@ -0,0 +1,918 @@
+"""A CP/M environment for running .com programs on the Intel 8080 simulator."""
+
+import argparse
+import mmap
+from pathlib import Path
+import sys
+
+from suite8080 import sim80
+
+# Memory layout of the CP/M environment. The BDOS and BIOS entry points hold
+# hlt instructions, which the environment traps to run the operating system
+# functions in Python.
+WARM_BOOT = 0x0000
+BDOS_CALL = 0x0005
+FCB1 = 0x005c
+FCB2 = 0x006c
+DEFAULT_DMA = 0x0080
+TPA = sim80.ORG
+BDOS = 0xfe00
+BIOS = 0xff00
+
+HLT = 0x76
+JMP = 0xc3
+
+# The disk parameter headers, disk parameter blocks, and sector translation
+# tables of the mounted disk images are allocated in the free memory between
+# the BDOS and BIOS entry points.
+DISK_TABLES = BDOS + 0x10
+DISK_TABLES_END = BIOS
+DPH_SIZE = 16
+DPB_SIZE = 15
+DRIVES = 16
+# Value of the bytes of unused sectors, which also marks free directory entries.
+EMPTY = 0xe5
+# Results of the BIOS read and write functions.
+DISK_OK = 0
+DISK_ERROR = 1
+
+# Names of the BIOS jump table entries, in order. Each entry is 3 bytes long.
+BIOS_ENTRIES = ('boot', 'wboot', 'const', 'conin', 'conout', 'list', 'punch', 'reader',
+                'home', 'seldsk', 'settrk', 'setsec', 'setdma', 'read', 'write',
+                'listst', 'sectran')
+
+# Names of the supported BDOS functions, indexed by the function number in C.
+BDOS_FUNCTIONS = {
+    0: 'system_reset',
+    1: 'console_input',
+    2: 'console_output',
+    6: 'direct_console_io',
+    9: 'print_string',
+    10: 'read_console_buffer',
+    11: 'console_status',
+    12: 'version',
+    13: 'reset_disk_system',
+    14: 'select_disk',
+    15: 'open_file',
+    16: 'close_file',
+    17: 'search_first',
+    18: 'search_next',
+    19: 'delete_file',
+    20: 'read_sequential',
+    21: 'write_sequential',
+    22: 'make_file',
+    23: 'rename_file',
+    24: 'login_vector',
+    25: 'current_disk',
+    26: 'set_dma',
+    32: 'user_code',
+    33: 'read_random',
+    34: 'write_random',
+    35: 'file_size',
+    36: 'set_random_record',
+}
+
+# CP/M 2.2.
+VERSION = 0x0022
+
+RECORD_SIZE = 128
+RECORDS_PER_EXTENT = 128
+EXTENTS_PER_MODULE = 32
+# The end of text files is marked by a ^Z character.
+EOF = 0x1a
+# Return code of the BDOS functions that fail.
+FAILURE = 0xff
+# Console output is flushed when the buffer holds this many bytes.
+BUFFER_SIZE = 4096
+
+# Offsets of the fields of a file control block.
+FCB_DRIVE = 0
+FCB_NAME = 1
+FCB_EXTENT = 12
+FCB_MODULE = 14
+FCB_RECORD_COUNT = 15
+FCB_CURRENT_RECORD = 32
+FCB_RANDOM_RECORD = 33
+FCB_SIZE = 36
+NAME_SIZE = 8
+TYPE_SIZE = 3
+DIRECTORY_ENTRY_SIZE = 32
+
+
+def fcb_name(text):
+    """Return the 11-byte name and type of an FCB from a file name such as a:name.ext."""
+    name, _, file_type = text.upper().rpartition(':')[2].partition('.')
+
+    def field(value, size):
+        if '*' in value:
+            value = value[:value.index('*')].ljust(size, '?')
+        return value[:size].ljust(size).encode('ascii', 'replace')
+
+    return field(name, NAME_SIZE) + field(file_type, TYPE_SIZE)
+
+
+# Table clearing the attribute bits of the characters of FCB names.
+NAME_MASK = bytes(byte & 0x7f for byte in range(256))
+
+
+def host_name(name):
+    """Return the host file name of an 11-byte FCB name, e.g. b'FILE    TXT' -> 'FILE.TXT'."""
+    text = bytes(byte & 0x7f for byte in name).decode('ascii', 'replace')
+    base = text[:NAME_SIZE].rstrip()
+    file_type = text[NAME_SIZE:].rstrip()
+    return f'{base}.{file_type}' if file_type else base
+
+
+class HostFile:
+    """A host file opened for a CP/M file, with its path and size."""
+
+    __slots__ = ('path', 'file', 'size')
+
+    def __init__(self, path, file, size):
+        self.path = path
+        self.file = file
+        self.size = size
+
+
+class Geometry:
+    """The geometry of a CP/M disk in 128-byte sectors, and its file system parameters.
+
+    The physical sectors of a track are numbered from 1, and skew is the
+    distance between the physical sectors of consecutive logical sectors. The
+    first reserved_tracks tracks hold the system rather than files."""
+
+    __slots__ = ('tracks', 'sectors', 'skew', 'reserved_tracks', 'block_size', 'directory_entries')
+
+    def __init__(self, tracks, sectors, skew=1, reserved_tracks=0, block_size=1024,
+                 directory_entries=64):
+        self.tracks = tracks
+        self.sectors = sectors
+        self.skew = skew
+        self.reserved_tracks = reserved_tracks
+        self.block_size = block_size
+        self.directory_entries = directory_entries
+        if (block_size not in (1024, 2048, 4096, 8192, 16384) or not 0 < skew < sectors
+                or not 0 < directory_entries <= block_size * 16 // DIRECTORY_ENTRY_SIZE
+                or self.blocks() < 1 or self.blocks() > 0x10000
+                or self.blocks() > 256 and block_size == 1024):
+            raise ValueError('invalid disk geometry')
+
+    def key(self):
+        """Return the tuple of the geometry parameters."""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def size(self):
+        """Return the size in bytes of a disk image."""
+        return self.tracks * self.sectors * RECORD_SIZE
+
+    def blocks(self):
+        """Return the number of allocation blocks of the non-reserved tracks."""
+        return (self.tracks - self.reserved_tracks) * self.sectors * RECORD_SIZE // self.block_size
+
+    def translation_table(self):
+        """Return the physical sector of each logical sector, as the CP/M DISKDEF macro does."""
+        table = bytearray()
+        used = set()
+        sector = 0
+        for logical in range(self.sectors):
+            while sector in used:
+                sector = (sector + 1) % self.sectors
+            table.append(sector + 1)
+            used.add(sector)
+            sector = (sector + self.skew) % self.sectors
+        return bytes(table)
+
+    def parameter_block(self):
+        """Return the 15-byte disk parameter block (DPB) of the CP/M 2.2 BIOS."""
+        records = self.block_size // RECORD_SIZE
+        last_block = self.blocks() - 1
+        extent_mask = self.block_size // (1024 if last_block < 256 else 2048) - 1
+        directory_blocks = -(-self.directory_entries * DIRECTORY_ENTRY_SIZE // self.block_size)
+        allocation = (0xffff << (16 - directory_blocks)) & 0xffff
+        return b''.join([
+            self.sectors.to_bytes(2, 'little'),
+            bytes([records.bit_length() - 1, records - 1, extent_mask]),
+            last_block.to_bytes(2, 'little'),
+            (self.directory_entries - 1).to_bytes(2, 'little'),
+            allocation.to_bytes(2, 'big'),
+            (self.directory_entries // 4).to_bytes(2, 'little'),
+            self.reserved_tracks.to_bytes(2, 'little'),
+        ])
+
+
+# Disk geometries by name. The IBM 3740 8" single sided single density format
+# is the standard CP/M distribution format.
+GEOMETRIES = {
+    'ibm-3740': Geometry(77, 26, 6, 2, 1024, 64),
+    'hd-4mb': Geometry(256, 128, 1, 1, 4096, 512),
+}
+
+
+def create_image(filename, geometry):
+    """Create an empty disk image of geometry in filename."""
+    with open(filename, 'wb') as file:
+        file.write(bytes([EMPTY]) * geometry.size())
+
+
+class Disk:
+    """A disk drive backed by a memory mapped host disk image file.
+
+    The sectors are transferred between the image and the CPU memory as
+    slices of memoryviews, without loading the image or copying them."""
+
+    __slots__ = ('filename', 'geometry', 'read_only', 'file', 'image', 'view', 'dph')
+
+    def __init__(self, filename, geometry, read_only=False):
+        self.filename = filename
+        self.geometry = geometry
+        self.read_only = read_only
+        self.file = open(filename, 'rb' if read_only else 'r+b')
+        try:
+            size = Path(filename).stat().st_size
+            if size != geometry.size():
+                raise ValueError(f'{filename}: image of {size} bytes, {geometry.size()} expected')
+            self.image = mmap.mmap(self.file.fileno(), 0,
+                                   access=mmap.ACCESS_READ if read_only else mmap.ACCESS_WRITE)
+        except (OSError, ValueError):
+            self.file.close()
+            raise
+        self.view = memoryview(self.image)
+        # Address of the disk parameter header in memory.
+        self.dph = 0
+
+    def offset(self, track, sector):
+        """Return the image offset of the physical sector of track, or None if out of range."""
+        geometry = self.geometry
+        if track >= geometry.tracks or not 1 <= sector <= geometry.sectors:
+            return None
+        return (track * geometry.sectors + sector - 1) * RECORD_SIZE
+
+    def close(self):
+        """Write back the changes and unmap the image."""
+        self.view.release()
+        if not self.read_only:
+            self.image.flush()
+        self.image.close()
+        self.file.close()
+
+
+class CPM(sim80.CPU):
+    """An Intel 8080 CPU running a CP/M 2.2 environment.
+
+    The BDOS and the console functions of the BIOS are implemented in Python.
+    The files of the current drive are the files of a host directory, and
+    the console is a pair of binary host streams. The disk functions of the
+    BIOS access the disk images mounted with mount()."""
+
+    __slots__ = ('directory', 'console_in', 'console_out', 'output', 'dma',
+                 'files', 'search_results', 'disks', 'disk', 'track', 'sector',
+                 'disk_tables', 'disk_tables_top')
+
+    SNAPSHOT_FIELDS = sim80.CPU.SNAPSHOT_FIELDS + ('dma', 'disk', 'track', 'sector')
+
+    def __init__(self, directory='.', console_in=None, console_out=None):
+        super().__init__()
+        self.directory = Path(directory)
+        self.console_in = console_in if console_in is not None else sys.stdin.buffer
+        self.console_out = console_out if console_out is not None else sys.stdout.buffer
+        self.output = bytearray()
+        self.dma = DEFAULT_DMA
+        # Open host files, HostFile instances indexed by the 11-byte FCB name
+        # without attribute bits, so that the directory isn't scanned again.
+        self.files = {}
+        self.search_results = []
+        # Mounted disk images indexed by drive number, and the drive, track,
+        # and physical sector the BIOS read and write functions access.
+        self.disks = {}
+        self.disk = 0
+        self.track = 0
+        self.sector = 1
+        # Addresses of the disk tables indexed by drive number or geometry key.
+        self.disk_tables = {}
+        self.disk_tables_top = DISK_TABLES
+        # The hlt handler traps the calls to the BDOS and BIOS entry points.
+        self.handlers[HLT] = type(self).trap
+
+        memory = self.memory
+        memory[WARM_BOOT:WARM_BOOT + 3] = bytes([JMP]) + (BIOS + 3).to_bytes(2, 'little')
+        memory[BDOS_CALL:BDOS_CALL + 3] = bytes([JMP]) + BDOS.to_bytes(2, 'little')
+        memory[BDOS] = HLT
+        for entry in range(len(BIOS_ENTRIES)):
+            memory[BIOS + 3 * entry] = HLT
+
+    def load_program(self, filename, arguments=()):
+        """Load the .com program in filename at 0100h with the command line arguments."""
+        self.load_command(Path(filename).read_bytes(), arguments)
+
+    def load_command(self, program, arguments=()):
+        """Load the bytes of a .com program at 0100h with the command line arguments.
+
+        As the CP/M CCP does, store the command tail at 0080h and the first two
+        arguments as file names in the default FCBs, and set up the stack so
+        that a ret warm boots."""
+        self.load(program, TPA)
+        tail = ''.join(' ' + argument for argument in arguments).upper().encode('ascii', 'replace')
+        tail = tail[:RECORD_SIZE - 1]
+        self.memory[DEFAULT_DMA] = len(tail)
+        self.memory[DEFAULT_DMA + 1:DEFAULT_DMA + 1 + len(tail)] = tail
+        for fcb, argument in zip((FCB1, FCB2), list(arguments) + ['', '']):
+            self.memory[fcb:fcb + FCB2 - FCB1] = bytes(FCB2 - FCB1)
+            self.memory[fcb + FCB_NAME:fcb + FCB_EXTENT] = fcb_name(argument)
+            if argument[1:2] == ':':
+                self.memory[fcb + FCB_DRIVE] = ord(argument[0].upper()) - ord('A') + 1
+        self.pc = TPA
+        self.sp = BDOS - 2
+        self.memory[self.sp:self.sp + 2] = WARM_BOOT.to_bytes(2, 'little')
+
+    def trap(self, memory, pc):
+        """Handle hlt: run the BDOS and BIOS functions, or halt elsewhere."""
+        address = pc - 1 & 0xffff
+        if address == BDOS:
+            function = BDOS_FUNCTIONS.get(self.c)
+            if function is None:
+                self.pc = address
+                raise ValueError(f'unsupported BDOS function {self.c}')
+            getattr(self, 'bdos_' + function)()
+        elif BIOS <= address < BIOS + 3 * len(BIOS_ENTRIES) and (address - BIOS) % 3 == 0:
+            entry = BIOS_ENTRIES[(address - BIOS) // 3]
+            bios_function = getattr(self, 'bios_' + entry, None)
+            if bios_function is None:
+                self.pc = address
+                raise ValueError(f'unsupported BIOS function {entry}')
+            bios_function()
+        else:
+            return sim80.HANDLERS[HLT](self, memory, pc)
+
+        if self.halted:
+            self.pc = address
+            raise sim80.Halt
+        # Return to the caller.
+        sp = self.sp
+        self.sp = sp + 2 & 0xffff
+        return memory[sp] | memory[sp + 1 & 0xffff] << 8
+
+    def set_result(self, value):
+        """Return value from a BDOS function in HL, with a copy in BA."""
+        self.l = self.a = value & 0xff
+        self.h = self.b = value >> 8
+
+    def flush(self):
+        """Write the buffered console output to the host."""
+        if self.output:
+            self.console_out.write(self.output)
+            self.console_out.flush()
+            self.output.clear()
+
+    def write_console(self, data):
+        """Buffer data for console output."""
+        self.output += data
+        if len(self.output) >= BUFFER_SIZE:
+            self.flush()
+
+    def read_console(self):
+        """Return the next console input character, or ^Z at the end of the input."""
+        self.flush()
+        data = self.console_in.read(1)
+        return data[0] if data else EOF
+
+    def close_files(self):
+        """Close all the open host files."""
+        for host_file in self.files.values():
+            host_file.file.close()
+        self.files.clear()
+
+    def mount(self, drive, filename, geometry=GEOMETRIES['ibm-3740'], read_only=False):
+        """Mount the disk image in filename on drive, 0 for A: to 15 for P:.
+
+        Set up the disk parameter header of the drive in memory, sharing the
+        parameter block and translation table with the drives of the same
+        geometry."""
+        if not 0 <= drive < DRIVES:
+            raise ValueError(f'invalid drive {drive}')
+        disk = Disk(filename, geometry, read_only)
+        try:
+            dph = self.disk_tables.get(drive) or self.allocate_disk_table(DPH_SIZE)
+            tables = self.disk_tables.get(geometry.key())
+            if tables is None:
+                translation_table = geometry.translation_table()
+                xlt = self.allocate_disk_table(len(translation_table))
+                dpb = self.allocate_disk_table(DPB_SIZE)
+                self.load(translation_table, xlt)
+                self.load(geometry.parameter_block(), dpb)
+                tables = self.disk_tables[geometry.key()] = xlt, dpb
+        except ValueError:
+            disk.close()
+            raise
+        self.disk_tables[drive] = dph
+        xlt, dpb = tables
+        # The directory buffer, checksum vector, and allocation vector are
+        # used by a BDOS running on the CPU, not by the one in Python.
+        self.load(xlt.to_bytes(2, 'little') + bytes(6) + bytes(2) + dpb.to_bytes(2, 'little')
+                  + bytes(4), dph)
+        disk.dph = dph
+        self.unmount(drive)
+        self.disks[drive] = disk
+
+    def allocate_disk_table(self, size):
+        """Return the address of size bytes of memory for disk tables."""
+        address = self.disk_tables_top
+        if address + size > DISK_TABLES_END:
+            raise ValueError('no memory left for the disk tables')
+        self.disk_tables_top += size
+        return address
+
+    def unmount(self, drive):
+        """Unmount the disk image of drive, if any."""
+        disk = self.disks.pop(drive, None)
+        if disk is not None:
+            disk.close()
+
+    def close_disks(self):
+        """Unmount all the disk images."""
+        for drive in list(self.disks):
+            self.unmount(drive)
+
+    def restore(self, snapshot):
+        """Restore snapshot, flushing the console and closing the host files."""
+        self.flush()
+        self.close_files()
+        self.search_results = []
+        super().restore(snapshot)
+
+    # BIOS functions.
+
+    def bios_boot(self):
+        self.halted = True
+
+    def bios_wboot(self):
+        self.halted = True
+
+    def bios_const(self):
+        self.a = self.console_status()
+
+    def bios_conin(self):
+        self.a = self.read_console() & 0x7f
+
+    def bios_conout(self):
+        self.write_console(bytes([self.c]))
+
+    def bios_list(self):
+        pass
+
+    def bios_punch(self):
+        pass
+
+    def bios_reader(self):
+        self.a = EOF
+
+    def bios_home(self):
+        self.track = 0
+
+    def bios_seldsk(self):
+        disk = self.disks.get(self.c)
+        dph = disk.dph if disk is not None else 0
+        if disk is not None:
+            self.disk = self.c
+        self.h = dph >> 8
+        self.l = dph & 0xff
+
+    def bios_settrk(self):
+        self.track = self.b << 8 | self.c
+
+    def bios_setsec(self):
+        self.sector = self.b << 8 | self.c
+
+    def bios_setdma(self):
+        self.dma = self.b << 8 | self.c
+
+    def bios_read(self):
+        self.a = self.transfer_sector(False)
+
+    def bios_write(self):
+        self.a = self.transfer_sector(True)
+
+    def bios_listst(self):
+        self.a = FAILURE
+
+    def bios_sectran(self):
+        sector = self.b << 8 | self.c
+        table = self.d << 8 | self.e
+        physical = self.memory[table + sector & 0xffff] if table else sector + 1
+        self.h = physical >> 8
+        self.l = physical & 0xff
+
+    def transfer_sector(self, write):
+        """Copy the selected sector from the disk image to the DMA buffer, or back if write.
+
+        Return the result of the BIOS read and write functions."""
+        disk = self.disks.get(self.disk)
+        if disk is None or (write and disk.read_only):
+            return DISK_ERROR
+        offset = disk.offset(self.track, self.sector)
+        dma = self.dma
+        if offset is None or dma + RECORD_SIZE > sim80.MEMORY_SIZE:
+            return DISK_ERROR
+        if write:
+            with memoryview(self.memory) as memory:
+                disk.view[offset:offset + RECORD_SIZE] = memory[dma:dma + RECORD_SIZE]
+        else:
+            self.memory[dma:dma + RECORD_SIZE] = disk.view[offset:offset + RECORD_SIZE]
+            self.invalidate(dma, RECORD_SIZE)
+        return DISK_OK
+
+    # BDOS console functions.
+
+    def console_status(self):
+        """Return 0ffh if a console input character is ready, 0 otherwise."""
+        peek = getattr(self.console_in, 'peek', None)
+        if peek is None:
+            return FAILURE
+        self.flush()
+        return FAILURE if peek(1) else 0
+
+    # 0: system reset
+    def bdos_system_reset(self):
+        self.halted = True
+
+    # 1: console input
+    def bdos_console_input(self):
+        character = self.read_console()
+        self.write_console(bytes([character]))
+        self.set_result(character)
+
+    # 2: console output
+    def bdos_console_output(self):
+        self.write_console(bytes([self.e]))
+
+    # 6: direct console io
+    def bdos_direct_console_io(self):
+        if self.e == 0xff:
+            self.set_result(self.read_console() if self.console_status() else 0)
+        else:
+            self.write_console(bytes([self.e]))
+
+    # 9: print string
+    def bdos_print_string(self):
+        address = self.d << 8 | self.e
+        end = self.memory.find(b'$', address)
+        self.write_console(self.memory[address:end if end != -1 else len(self.memory)])
+
+    # 10: read console buffer
+    def bdos_read_console_buffer(self):
+        address = self.d << 8 | self.e
+        size = self.memory[address]
+        line = bytearray()
+        while len(line) < size:
+            character = self.read_console()
+            if character in (0x0a, 0x0d) or (character == EOF and not line):
+                break
+            line.append(character)
+        self.write_console(bytes(line) + b'\r\n')
+        self.memory[address + 1] = len(line)
+        self.load(line, address + 2)
+
+    # 11: console status
+    def bdos_console_status(self):
+        self.set_result(self.console_status())
+
+    # 12: version
+    def bdos_version(self):
+        self.set_result(VERSION)
+
+    # BDOS disk functions. There is a single drive, A:, mapped to a host
+    # directory, and a single user area.
+
+    # 13: reset disk system
+    def bdos_reset_disk_system(self):
+        self.dma = DEFAULT_DMA
+        self.set_result(0)
+
+    # 14: select disk
+    def bdos_select_disk(self):
+        self.set_result(0)
+
+    # 24: login vector
+    def bdos_login_vector(self):
+        self.set_result(0x0001)
+
+    # 25: current disk
+    def bdos_current_disk(self):
+        self.set_result(0)
+
+    # 26: set dma
+    def bdos_set_dma(self):
+        self.dma = self.d << 8 | self.e
+
+    # 32: user code
+    def bdos_user_code(self):
+        self.set_result(0)
+
+    def fcb(self):
+        """Return the address of the FCB in DE."""
+        return self.d << 8 | self.e
+
+    def host_files(self, pattern):
+        """Return the sorted names of the host files matching an 11-byte FCB name, where ? matches any character."""
+        names = []
+        for path in sorted(self.directory.iterdir()):
+            base, _, file_type = path.name.partition('.')
+            if not path.is_file() or len(base) > NAME_SIZE or len(file_type) > TYPE_SIZE:
+                continue
+            name = fcb_name(path.name)
+            if all(wanted & 0x7f in (actual, ord('?')) for wanted, actual in zip(pattern, name)):
+                names.append(path.name)
+        return names
+
+    def host_path(self, fcb):
+        """Return the host path of the file named in the FCB, matching existing files case-insensitively."""
+        name = host_name(self.memory[fcb + FCB_NAME:fcb + FCB_EXTENT])
+        for path in self.directory.iterdir():
+            if path.name.upper() == name:
+                return path
+        return self.directory / name.lower()
+
+    def fcb_key(self, fcb):
+        """Return the key of the open host file of the FCB, its 11-byte name without attribute bits."""
+        return bytes(self.memory[fcb + FCB_NAME:fcb + FCB_EXTENT]).translate(NAME_MASK)
+
+    def open_host_file(self, fcb):
+        """Return the HostFile of the FCB, opening it if needed, or None if it doesn't exist."""
+        key = self.fcb_key(fcb)
+        host_file = self.files.get(key)
+        if host_file is None:
+            path = self.host_path(fcb)
+            if not path.is_file():
+                return None
+            try:
+                file = open(path, 'r+b')
+            except PermissionError:
+                file = open(path, 'rb')
+            host_file = self.files[key] = HostFile(path, file, path.stat().st_size)
+        return host_file
+
+    def close_host_file(self, name):
+        """Close the open host files named name."""
+        for key, host_file in list(self.files.items()):
+            if host_file.path.name == name:
+                host_file.file.close()
+                del self.files[key]
+
+    def record_position(self, fcb):
+        """Return the sequential record number of the FCB."""
+        memory = self.memory
+        extent = memory[fcb + FCB_MODULE] * EXTENTS_PER_MODULE + (memory[fcb + FCB_EXTENT] & 0x1f)
+        return extent * RECORDS_PER_EXTENT + (memory[fcb + FCB_CURRENT_RECORD] & 0x7f)
+
+    def set_record_position(self, fcb, record):
+        """Set the sequential record number of the FCB."""
+        memory = self.memory
+        extent, memory[fcb + FCB_CURRENT_RECORD] = divmod(record, RECORDS_PER_EXTENT)
+        memory[fcb + FCB_MODULE], memory[fcb + FCB_EXTENT] = divmod(extent, EXTENTS_PER_MODULE)
+        self.update_record_count(fcb)
+
+    def update_record_count(self, fcb):
+        """Set the record count of the current extent of the FCB from the size of its file."""
+        memory = self.memory
+        host_file = self.files.get(self.fcb_key(fcb))
+        if host_file is not None:
+            extent = memory[fcb + FCB_MODULE] * EXTENTS_PER_MODULE + (memory[fcb + FCB_EXTENT] & 0x1f)
+            records = -(-host_file.size // RECORD_SIZE) - extent * RECORDS_PER_EXTENT
+            memory[fcb + FCB_RECORD_COUNT] = max(0, min(records, RECORDS_PER_EXTENT))
+
+    def read_record(self, fcb, record):
+        """Read a record of the FCB's file into the DMA buffer, and return the BDOS result."""
+        host_file = self.open_host_file(fcb)
+        if host_file is None:
+            return FAILURE
+        file = host_file.file
+        file.seek(record * RECORD_SIZE)
+        data = file.read(RECORD_SIZE)
+        if not data:
+            return 1
+        self.load(data.ljust(RECORD_SIZE, bytes([EOF])), self.dma)
+        return 0
+
+    def write_record(self, fcb, record):
+        """Write the DMA buffer to a record of the FCB's file, and return the BDOS result."""
+        host_file = self.open_host_file(fcb)
+        if host_file is None:
+            return FAILURE
+        file = host_file.file
+        position = record * RECORD_SIZE
+        if host_file.size < position:
+            file.seek(host_file.size)
+            file.write(bytes(position - host_file.size))
+        file.seek(position)
+        file.write(self.memory[self.dma:self.dma + RECORD_SIZE])
+        host_file.size = max(host_file.size, position + RECORD_SIZE)
+        return 0
+
+    # 15: open file
+    def bdos_open_file(self):
+        fcb = self.fcb()
+        if self.open_host_file(fcb) is None:
+            self.set_result(FAILURE)
+            return
+        self.update_record_count(fcb)
+        self.set_result(0)
+
+    # 16: close file
+    def bdos_close_file(self):
+        host_file = self.files.pop(self.fcb_key(self.fcb()), None)
+        if host_file is not None:
+            host_file.file.close()
+        self.set_result(0)
+
+    # 22: make file
+    def bdos_make_file(self):
+        fcb = self.fcb()
+        path = self.host_path(fcb)
+        self.close_host_file(path.name)
+        self.files[self.fcb_key(fcb)] = HostFile(path, open(path, 'w+b'), 0)
+        self.set_record_position(fcb, 0)
+        self.set_result(0)
+
+    # 19: delete file
+    def bdos_delete_file(self):
+        fcb = self.fcb()
+        names = self.host_files(self.memory[fcb + FCB_NAME:fcb + FCB_EXTENT])
+        for name in names:
+            self.close_host_file(name)
+            (self.directory / name).unlink()
+        self.set_result(0 if names else FAILURE)
+
+    # 23: rename file
+    def bdos_rename_file(self):
+        fcb = self.fcb()
+        path = self.host_path(fcb)
+        if not path.is_file():
+            self.set_result(FAILURE)
+            return
+        self.close_host_file(path.name)
+        new_name = host_name(self.memory[fcb + 16 + FCB_NAME:fcb + 16 + FCB_EXTENT]).lower()
+        path.rename(self.directory / new_name)
+        self.set_result(0)
+
+    # 17: search first
+    def bdos_search_first(self):
+        fcb = self.fcb()
+        self.search_results = self.host_files(self.memory[fcb + FCB_NAME:fcb + FCB_EXTENT])
+        self.bdos_search_next()
+
+    # 18: search next
+    def bdos_search_next(self):
+        if not self.search_results:
+            self.set_result(FAILURE)
+            return
+        name = self.search_results.pop(0)
+        entry = bytearray(DIRECTORY_ENTRY_SIZE)
+        entry[FCB_NAME:FCB_EXTENT] = fcb_name(name)
+        records = -(-(self.directory / name).stat().st_size // RECORD_SIZE)
+        entry[FCB_RECORD_COUNT] = min(records, RECORDS_PER_EXTENT)
+        self.load(bytes(entry).ljust(RECORD_SIZE, b'\xe5'), self.dma)
+        self.set_result(0)
+
+    # 20: read sequential
+    def bdos_read_sequential(self):
+        fcb = self.fcb()
+        record = self.record_position(fcb)
+        result = self.read_record(fcb, record)
+        if result == 0:
+            self.set_record_position(fcb, record + 1)
+        self.set_result(result)
+
+    # 21: write sequential
+    def bdos_write_sequential(self):
+        fcb = self.fcb()
+        record = self.record_position(fcb)
+        result = self.write_record(fcb, record)
+        if result == 0:
+            self.set_record_position(fcb, record + 1)
+        self.set_result(result)
+
+    def random_record(self, fcb):
+        """Return the random record number of the FCB, or None if out of range."""
+        memory = self.memory
+        if memory[fcb + FCB_RANDOM_RECORD + 2]:
+            return None
+        return memory[fcb + FCB_RANDOM_RECORD] | memory[fcb + FCB_RANDOM_RECORD + 1] << 8
+
+    # 33: read random
+    def bdos_read_random(self):
+        fcb = self.fcb()
+        record = self.random_record(fcb)
+        if record is None:
+            self.set_result(6)
+            return
+        result = self.read_record(fcb, record)
+        if result == 0:
+            self.set_record_position(fcb, record)
+        self.set_result(result)
+
+    # 34: write random
+    def bdos_write_random(self):
+        fcb = self.fcb()
+        record = self.random_record(fcb)
+        if record is None:
+            self.set_result(6)
+            return
+        result = self.write_record(fcb, record)
+        if result == 0:
+            self.set_record_position(fcb, record)
+        self.set_result(result)
+
+    # 35: file size
+    def bdos_file_size(self):
+        fcb = self.fcb()
+        host_file = self.files.get(self.fcb_key(fcb))
+        if host_file is not None:
+            size = host_file.size
+        else:
+            path = self.host_path(fcb)
+            if not path.is_file():
+                self.set_result(FAILURE)
+                return
+            size = path.stat().st_size
+        records = -(-size // RECORD_SIZE)
+        self.memory[fcb + FCB_RANDOM_RECORD:fcb + FCB_SIZE] = records.to_bytes(3, 'little')
+        self.set_result(0)
+
+    # 36: set random record
+    def bdos_set_random_record(self):
+        fcb = self.fcb()
+        record = self.record_position(fcb)
+        self.memory[fcb + FCB_RANDOM_RECORD:fcb + FCB_SIZE] = record.to_bytes(3, 'little')
+
+
+def load_cpu(parser, args):
+    """Return a CPU with the program in args.filename loaded and ready to run.
+
+    With args.cpm, the CPU is a CPM on args.directory running the program with
+    args.arguments. Otherwise it's a plain CPU with the program loaded at
+    args.org, and program arguments are an error. The errors are reported with
+    parser.error() like the ones of the command line."""
+    if args.arguments and not args.cpm:
+        parser.error('program arguments allowed only with --cpm')
+    try:
+        if args.cpm:
+            cpu = CPM(args.directory)
+            cpu.load_program(args.filename, args.arguments)
+        else:
+            cpu = sim80.load_program(args.filename, args.org)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    return cpu
+
+
+def main():
+    """Parse the command line and run the CP/M program in the input file."""
+    cpm80_description = f'CP/M environment for the Intel 8080 simulator / Suite8080'
+    parser = argparse.ArgumentParser(description=cpm80_description)
+    parser.add_argument('filename', help='.com program file')
+    parser.add_argument('arguments', nargs='*', help='command line arguments of the program')
+    parser.add_argument('-d', '--directory', default='.',
+                        help='host directory holding the files of drive A:, the current directory if not supplied')
+    parser.add_argument('--disk', action='append', default=[],
+                        help='disk image mounted for the BIOS disk functions, on drives A:, B:, ... in order')
+    parser.add_argument('--geometry', choices=GEOMETRIES, default='ibm-3740',
+                        help='geometry of the disk images, ibm-3740 if not supplied')
+    parser.add_argument('--read-only', action='store_true',
+                        help='mount the disk images read-only')
+    parser.add_argument('-n', '--limit', type=int,
+                        help='maximum number of instructions to execute')
+    parser.add_argument('-i', '--interpret', action='store_true',
+                        help='interpret one instruction at a time rather than translating blocks')
+    args = parser.parse_args()
+
+    if len(args.disk) > DRIVES:
+        parser.error(f'at most {DRIVES} disk images allowed')
+    cpu = CPM(args.directory)
+    try:
+        for drive, image in enumerate(args.disk):
+            cpu.mount(drive, image, GEOMETRIES[args.geometry], args.read_only)
+        cpu.load_program(args.filename, args.arguments)
+    except (OSError, ValueError) as error:
+        cpu.close_disks()
+        parser.error(str(error))
+
+    try:
+        if args.interpret:
+            cpu.run(args.limit)
+        else:
+            cpu.run_blocks(args.limit)
+    except ValueError as error:
+        cpu.flush()
+        print(f'cpm80> {cpu.pc:04x}: {error}', file=sys.stderr)
+        sys.exit(1)
+    finally:
+        cpu.flush()
+        cpu.close_files()
+        cpu.close_disks()
+
+    if not cpu.halted:
+        print(f'cpm80> instruction limit reached at {cpu.pc:04x}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+"""An interactive debugger for Intel 8080 programs running on the simulator."""
+
+import argparse
+import cmd
+import sys
+
+from suite8080 import cpm80
+from suite8080 import dis80
+from suite8080 import prof80
+from suite8080 import sim80
+
+# Default number of instructions disassembled and of bytes dumped.
+DISASSEMBLY_LINES = 10
+DUMP_SIZE = 64
+DUMP_LINE_SIZE = 16
+
+PAGES = sim80.MEMORY_SIZE // sim80.PAGE_SIZE
+PAGE_SHIFT = 8
+
+# Flag bits and their letters, in the order of the bits of F.
+FLAG_LETTERS = ((sim80.SIGN, 's'), (sim80.ZERO, 'z'), (sim80.AUX_CARRY, 'a'),
+                (sim80.PARITY, 'p'), (sim80.CARRY, 'c'))
+
+
+def store_kind(mnemonic):
+    """Return where the instruction with mnemonic writes memory, or None if it doesn't."""
+    if mnemonic in ('inr m', 'dcr m', 'mvi m,') or mnemonic.startswith('mov m,'):
+        return 'hl'
+    if mnemonic in ('stax b', 'stax d', 'sta', 'shld', 'xthl'):
+        return mnemonic
+    if mnemonic.startswith('push'):
+        return 'stack'
+    return None
+
+
+# Where the opcodes write memory: the address in HL, BC, or DE, the direct
+# address, or the stack. Calls and restarts push the return address.
+STORES = {opcode: store_kind(mnemonic) for opcode, (mnemonic, size) in enumerate(dis80.instructions)
+          if store_kind(mnemonic)}
+STORES.update({opcode: 'stack' for opcode in prof80.CALLS})
+
+
+def written_addresses(cpu, opcode):
+    """Return the addresses the instruction at cpu.pc may write, or None if any.
+
+    The instructions left to replaced handlers, such as the traps of cpm80,
+    and to device methods may write anywhere."""
+    if opcode in sim80.UNTRANSLATED or cpu.handlers[opcode] is not sim80.HANDLERS[opcode]:
+        return None
+    kind = STORES.get(opcode)
+    if kind is None:
+        return ()
+    memory = cpu.memory
+    if kind == 'hl':
+        return (cpu.h << 8 | cpu.l,)
+    if kind == 'stax b':
+        return (cpu.b << 8 | cpu.c,)
+    if kind == 'stax d':
+        return (cpu.d << 8 | cpu.e,)
+    if kind == 'stack':
+        return (cpu.sp - 1 & 0xffff, cpu.sp - 2 & 0xffff)
+    if kind == 'xthl':
+        return (cpu.sp, cpu.sp + 1 & 0xffff)
+    address = memory[cpu.pc + 1 & 0xffff] | memory[cpu.pc + 2 & 0xffff] << 8
+    if kind == 'sta':
+        return (address,)
+    return (address, address + 1 & 0xffff)
+
+
+def format_registers(cpu):
+    """Return the text of the registers and flags of cpu."""
+    flags = ''.join(letter if cpu.f & bit else '-' for bit, letter in FLAG_LETTERS)
+    registers = ' '.join(f'{name}={getattr(cpu, name):02x}' for name in ('a', 'b', 'c', 'd', 'e', 'h', 'l'))
+    return (f'pc={cpu.pc:04x} sp={cpu.sp:04x} {registers} f={cpu.f:02x} [{flags}] '
+            f'ie={int(cpu.interrupts_enabled)} cycles={cpu.cycles}')
+
+
+def format_memory(memory, address, size):
+    """Return the lines of a hex and ASCII dump of size bytes of memory at address."""
+    lines = []
+    for start in range(address, address + size, DUMP_LINE_SIZE):
+        data = bytes(memory[(start + offset) & 0xffff]
+                     for offset in range(min(DUMP_LINE_SIZE, address + size - start)))
+        text = ''.join(chr(byte) if 0x20 <= byte < 0x7f else '.' for byte in data)
+        values = ' '.join(f'{byte:02x}' for byte in data)
+        lines.append(f'{start & 0xffff:04x}  {values:<{DUMP_LINE_SIZE * 3}} {text}')
+    return lines
+
+
+class Debugger(cmd.Cmd):
+    """The command interpreter of the debugger of a CPU.
+
+    Breakpoints are flags in a bytearray indexed by address, and watched
+    addresses are tracked by a bitmap of their pages. If there are neither,
+    the program runs on the block engine at full speed, otherwise on a
+    checked loop that executes one instruction at a time."""
+
+    intro = 'dbg80 Intel 8080 debugger, type help for the list of commands'
+    prompt = '(dbg80) '
+
+    def __init__(self, cpu, stdin=None, stdout=None):
+        super().__init__(stdin=stdin, stdout=stdout)
+        if stdin is not None:
+            self.use_rawinput = False
+        self.cpu = cpu
+        self.breakpoints = bytearray(sim80.MEMORY_SIZE)
+        # The last values of the watched addresses, and the pages holding them.
+        self.watchpoints = {}
+        self.watch_pages = bytearray(PAGES)
+        # The address of the next disassembly and memory dump.
+        self.next_disassembly = cpu.pc
+        self.next_dump = cpu.pc
+
+    def output(self, text=''):
+        """Print text to the output of the debugger."""
+        print(text, file=self.stdout)
+
+    def address(self, text):
+        """Return the address of text, a symbol or a number in asm80 syntax."""
+        for address, name in dis80.symbol_table.items():
+            if name.lower() == text.lower():
+                return address
+        try:
+            address = dis80.number(text)
+        except ValueError:
+            address = sim80.MEMORY_SIZE
+        if address >= sim80.MEMORY_SIZE:
+            raise ValueError(f'invalid address {text}')
+        return address
+
+    def location(self, address):
+        """Return the text of address, followed by its symbol if any."""
+        name = dis80.symbol_table.get(address)
+        return f'{address:04x} ({name})' if name else f'{address:04x}'
+
+    def arguments(self, arg, default_address, default_count):
+        """Return the address and count in the arguments of a command, or the defaults."""
+        fields = arg.split()
+        if len(fields) > 2:
+            raise ValueError('too many arguments')
+        address = self.address(fields[0]) if fields else default_address
+        number = dis80.number(fields[1]) if len(fields) > 1 else default_count
+        return address, number
+
+    def onecmd(self, line):
+        """Run the command in line, reporting invalid arguments rather than stopping."""
+        try:
+            return super().onecmd(line)
+        except ValueError as error:
+            self.output(f'*** {error}')
+            return False
+
+    def disassemble(self, address, count):
+        """Print count instructions from address, and return the address following them."""
+        memory = self.cpu.memory
+        for _ in range(count):
+            opcode = memory[address]
+            size = dis80.SIZES[opcode]
+            operand = memory[address + 1 & 0xffff]
+            if size == 3:
+                operand |= memory[address + 2 & 0xffff] << 8
+            *label, line = dis80.format_instruction(address, opcode, operand).rstrip().split('\n')
+            marker = '=>' if address == self.cpu.pc else ' *' if self.breakpoints[address] else '  '
+            for text in label:
+                self.output(text)
+            self.output(f'{marker} {line}')
+            address = address + size & 0xffff
+        return address
+
+    def report_stop(self, reason):
+        """Print why execution stopped, if not at the end of a step, and the next instruction."""
+        if reason:
+            self.output(reason)
+        self.next_disassembly = self.disassemble(self.cpu.pc, 1)
+
+    def checked(self):
+        """Return whether the checked loop must run, i.e. there are breakpoints or watchpoints."""
+        return bool(self.watchpoints) or self.breakpoints.find(1) != -1
+
+    def changed_watchpoints(self):
+        """Return the text of the watched addresses whose value changed, and update them."""
+        memory = self.cpu.memory
+        changes = []
+        for address, value in self.watchpoints.items():
+            if memory[address] != value:
+                changes.append(f'{self.location(address)}: {value:02x} -> {memory[address]:02x}')
+                self.watchpoints[address] = memory[address]
+        return changes
+
+    def execute(self, limit=None, target=None):
+        """Run the CPU on the checked loop, and return why it stopped, or None at the limit.
+
+        The loop stops at the breakpoints, except the one it starts from, when
+        a watched address changes value, and at the (pc, sp) pair of target."""
+        cpu = self.cpu
+        memory = cpu.memory
+        breakpoints = self.breakpoints
+        watch_pages = self.watch_pages
+        limit = sys.maxsize if limit is None else limit
+        executed = 0
+        while executed < limit:
+            if cpu.halted and not cpu.wake():
+                return 'program halted'
+            pc = cpu.pc
+            if executed and breakpoints[pc]:
+                return f'breakpoint at {self.location(pc)}'
+            if executed and (pc, cpu.sp) == target:
+                return None
+            opcode = memory[pc]
+            check = False
+            if self.watchpoints:
+                addresses = written_addresses(cpu, opcode)
+                check = addresses is None or any(watch_pages[address >> PAGE_SHIFT]
+                                                 for address in addresses)
+            cpu.step()
+            executed += 1
+            if check:
+                changes = self.changed_watchpoints()
+                if changes:
+                    return 'watchpoint ' + ', '.join(changes)
+            if cpu.halted:
+                return 'program halted'
+        return None
+
+    def resume(self, limit=None, target=None, step=False):
+        """Run the program, on the block engine if nothing is checked, and report where it stopped."""
+        cpu = self.cpu
+        reason = None
+        try:
+            if step or target is not None or self.checked():
+                reason = self.execute(limit, target)
+            else:
+                cpu.run_blocks(limit)
+                reason = 'program halted' if cpu.halted else None
+            if reason is None and not step and target is None:
+                reason = 'instruction limit reached'
+        except ValueError as error:
+            reason = f'error: {error}'
+        except KeyboardInterrupt:
+            reason = 'interrupted'
+        finally:
+            if isinstance(cpu, cpm80.CPM):
+                cpu.flush()
+        self.report_stop(reason)
+
+    def do_break(self, arg):
+        """break [ADDRESS]: set a breakpoint at ADDRESS, or list the breakpoints."""
+        if arg:
+            self.breakpoints[self.address(arg)] = 1
+            return
+        address = self.breakpoints.find(1)
+        while address != -1:
+            self.output(f'breakpoint at {self.location(address)}')
+            address = self.breakpoints.find(1, address + 1)
+
+    def do_watch(self, arg):
+        """watch [ADDRESS [SIZE]]: stop when any of SIZE bytes at ADDRESS changes, or list the watchpoints."""
+        if not arg:
+            for address, value in sorted(self.watchpoints.items()):
+                self.output(f'watchpoint at {self.location(address)} = {value:02x}')
+            return
+        address, size = self.arguments(arg, None, 1)
+        for offset in range(size):
+            watched = address + offset & 0xffff
+            self.watchpoints[watched] = self.cpu.memory[watched]
+            self.watch_pages[watched >> PAGE_SHIFT] = 1
+
+    def do_delete(self, arg):
+        """delete [ADDRESS]: delete the breakpoint and watchpoint at ADDRESS, or all of them."""
+        if arg:
+            address = self.address(arg)
+            self.breakpoints[address] = 0
+            self.watchpoints.pop(address, None)
+        else:
+            self.breakpoints[:] = bytes(sim80.MEMORY_SIZE)
+            self.watchpoints.clear()
+        self.watch_pages[:] = bytes(PAGES)
+        for address in self.watchpoints:
+            self.watch_pages[address >> PAGE_SHIFT] = 1
+
+    def do_step(self, arg):
+        """step [COUNT]: execute COUNT instructions, 1 if not supplied."""
+        self.resume(dis80.number(arg) if arg else 1, step=True)
+
+    def do_next(self, arg):
+        """next: execute the next instruction, running any subroutine it calls up to its return."""
+        cpu = self.cpu
+        opcode = cpu.memory[cpu.pc]
+        if opcode in prof80.CALLS:
+            self.resume(target=(cpu.pc + dis80.SIZES[opcode] & 0xffff, cpu.sp))
+        else:
+            self.resume(1, step=True)
+
+    def do_continue(self, arg):
+        """continue [LIMIT]: run until a breakpoint, a watchpoint, hlt, or LIMIT instructions."""
+        self.resume(dis80.number(arg) if arg else None)
+
+    def do_regs(self, arg):
+        """regs: print the registers, the flags, and the cycle count."""
+        self.output(format_registers(self.cpu))
+
+    def do_mem(self, arg):
+        """mem [ADDRESS [SIZE]]: dump SIZE bytes of memory at ADDRESS, continuing the last dump if not supplied."""
+        address, size = self.arguments(arg, self.next_dump, DUMP_SIZE)
+        for line in format_memory(self.cpu.memory, address, size):
+            self.output(line)
+        self.next_dump = address + size & 0xffff
+
+    def do_disassemble(self, arg):
+        """disassemble [ADDRESS [COUNT]]: disassemble COUNT instructions at ADDRESS, continuing if not supplied."""
+        address, count = self.arguments(arg, self.next_disassembly, DISASSEMBLY_LINES)
+        self.next_disassembly = self.disassemble(address, count)
+
+    def do_symbols(self, arg):
+        """symbols [FILE]: load the symbol table in the .sym FILE, or list the symbols."""
+        if not arg:
+            for address, name in sorted(dis80.symbol_table.items()):
+                self.output(f'{address:04x} {name}')
+            return
+        try:
+            dis80.symbol_table = dis80.read_symbol_table(arg)
+        except OSError as error:
+            self.output(f'*** {error}')
+        except SystemExit:
+            # read_symbol_table() reports malformed files by printing and exiting.
+            pass
+
+    def do_quit(self, arg):
+        """quit: exit the debugger."""
+        return True
+
+    def do_EOF(self, arg):
+        """Exit the debugger at the end of the input."""
+        self.output()
+        return True
+
+    do_b = do_break
+    do_c = do_continue
+    do_s = do_step
+    do_n = do_next
+    do_q = do_quit
+
+
+def main():
+    """Parse the command line, load the program, and start the debugger."""
+    dbg80_description = f'Intel 8080 debugger / Suite8080'
+    parser = argparse.ArgumentParser(description=dbg80_description)
+    parser.add_argument('filename', help='program file')
+    parser.add_argument('arguments', nargs='*', help='command line arguments of a CP/M program')
+    parser.add_argument('-s', '--symbols',
+                        help='symbol table file in .sym format')
+    parser.add_argument('--org', type=dis80.number, default=sim80.ORG,
+                        help=f'load and start address, {sim80.ORG:04x}h if not supplied')
+    parser.add_argument('-c', '--cpm', action='store_true',
+                        help='run the program in the cpm80 CP/M environment')
+    parser.add_argument('-d', '--directory', default='.',
+                        help='host directory holding the files of drive A: with --cpm, the current directory if not supplied')
+    args = parser.parse_args()
+
+    if args.symbols:
+        dis80.symbol_table = dis80.read_symbol_table(args.symbols)
+    cpu = cpm80.load_cpu(parser, args)
+
+    try:
+        Debugger(cpu).cmdloop()
+    finally:
+        if args.cpm:
+            cpu.flush()
+            cpu.close_files()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""An Intel 8080 instruction-level binary diff."""
+
+import argparse
+import bisect
+import difflib
+from pathlib import Path
+import sys
+
+from suite8080 import dis80
+
+# Placeholder for 16-bit operands referencing an address within the program.
+LOCAL = 'local'
+
+# Longest range without unique keys matched with difflib, whose time grows with
+# the product of the lengths of the ranges.
+SHORT_RANGE = 256
+
+# Maximum number of inserted and deleted keys of a longer range matched with the
+# Myers diff, whose time grows with the product of the length and this number.
+MAX_EDITS = 500
+
+
+def decode_file(filename, org=dis80.CPM_ENTRY, follow=False):
+    """Return the list of instructions decoded from filename, whose first byte is at org."""
+    dis80.program = Path(filename).read_bytes()
+    if follow:
+        return list(dis80.trace(org=org))
+    return list(dis80.disassemble(org=org))
+
+
+def normalize(decoded, org=dis80.CPM_ENTRY):
+    """Return the comparison keys of the decoded instructions.
+
+    The 16-bit operands referencing an address within the program, such as jump
+    and call targets, are replaced by a placeholder. This way an instruction
+    inserted or removed elsewhere, which shifts the addresses that follow it,
+    changes only the instruction itself. The placeholders are checked for
+    changed targets once the instructions are aligned."""
+    if not decoded:
+        return []
+    last_address = decoded[-1][0]
+    keys = []
+
+    for address, opcode, operand in decoded:
+        if opcode is not None and dis80.SIZES[opcode] == 3 and org <= operand <= last_address:
+            keys.append((opcode, LOCAL))
+        else:
+            keys.append((opcode, operand))
+    return keys
+
+
+def unique_pairs(keys1, lo1, hi1, keys2, lo2, hi2):
+    """Return the (i, j) index pairs of the keys occurring once in both ranges, ordered by i."""
+    counts1 = {}
+    for i in range(lo1, hi1):
+        key = keys1[i]
+        counts1[key] = i if key not in counts1 else None
+    counts2 = {}
+    for j in range(lo2, hi2):
+        key = keys2[j]
+        if key in counts1 and counts1[key] is not None:
+            counts2[key] = j if key not in counts2 else None
+
+    return sorted((counts1[key], j) for key, j in counts2.items() if j is not None)
+
+
+def longest_increasing(pairs):
+    """Return the longest subsequence of the (i, j) pairs with increasing j.
+
+    Patience sorting finds it in O(n log n) time."""
+    tails = []
+    tail_indexes = []
+    previous = [None] * len(pairs)
+
+    for index, (i, j) in enumerate(pairs):
+        position = bisect.bisect_left(tails, j)
+        if position == len(tails):
+            tails.append(j)
+            tail_indexes.append(index)
+        else:
+            tails[position] = j
+            tail_indexes[position] = index
+        previous[index] = tail_indexes[position - 1] if position else None
+
+    sequence = []
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        sequence.append(pairs[index])
+        index = previous[index]
+    return sequence[::-1]
+
+
+def myers(keys1, lo1, hi1, keys2, lo2, hi2, max_edits=MAX_EDITS):
+    """Return the (i, j) index pairs of the matching keys within the ranges, ordered by i.
+
+    This is the Myers O(ND) diff, which is fast if the ranges differ by few
+    keys however long and repetitive they are. Return None if they differ by
+    more than max_edits inserted and deleted keys."""
+    size1 = hi1 - lo1
+    size2 = hi2 - lo2
+    # Furthest x reached on each diagonal k = x - y, and its value before each
+    # round for backtracking.
+    furthest = {1: 0}
+    history = []
+    for edits in range(max_edits + 1):
+        history.append(furthest.copy())
+        for k in range(-edits, edits + 1, 2):
+            if k == -edits or (k != edits and furthest[k - 1] < furthest[k + 1]):
+                x = furthest[k + 1]
+            else:
+                x = furthest[k - 1] + 1
+            y = x - k
+            while x < size1 and y < size2 and keys1[lo1 + x] == keys2[lo2 + y]:
+                x += 1
+                y += 1
+            furthest[k] = x
+            if x >= size1 and y >= size2:
+                break
+        else:
+            continue
+        break
+    else:
+        return None
+
+    # Walk the edit path back from the end, collecting the diagonal moves.
+    pairs = []
+    x, y = size1, size2
+    for edits in range(len(history) - 1, -1, -1):
+        furthest = history[edits]
+        k = x - y
+        if k == -edits or (k != edits and furthest[k - 1] < furthest[k + 1]):
+            previous_k = k + 1
+        else:
+            previous_k = k - 1
+        previous_x = furthest[previous_k]
+        previous_y = previous_x - previous_k
+        while x > previous_x and y > previous_y:
+            x -= 1
+            y -= 1
+            pairs.append((lo1 + x, lo2 + y))
+        x, y = previous_x, previous_y
+    return pairs[::-1]
+
+
+def match(keys1, lo1, hi1, keys2, lo2, hi2, blocks):
+    """Append to blocks the (i, j) index pairs of the matching keys within the ranges.
+
+    This is a patience diff: the keys occurring once in both ranges anchor the
+    alignment, and the ranges between anchors are matched recursively. The
+    short ranges with no such keys fall back to difflib, and the long ones,
+    such as zero-filled or repetitive code, to the Myers diff. If the latter
+    finds too many differences, the keys of the range are left unmatched."""
+    # Common prefix and suffix.
+    while lo1 < hi1 and lo2 < hi2 and keys1[lo1] == keys2[lo2]:
+        blocks.append((lo1, lo2))
+        lo1 += 1
+        lo2 += 1
+    suffix = []
+    while lo1 < hi1 and lo2 < hi2 and keys1[hi1 - 1] == keys2[hi2 - 1]:
+        hi1 -= 1
+        hi2 -= 1
+        suffix.append((hi1, hi2))
+
+    if lo1 < hi1 and lo2 < hi2:
+        anchors = longest_increasing(unique_pairs(keys1, lo1, hi1, keys2, lo2, hi2))
+        if anchors:
+            for i, j in anchors:
+                match(keys1, lo1, i, keys2, lo2, j, blocks)
+                blocks.append((i, j))
+                lo1, lo2 = i + 1, j + 1
+            match(keys1, lo1, hi1, keys2, lo2, hi2, blocks)
+        elif hi1 - lo1 <= SHORT_RANGE and hi2 - lo2 <= SHORT_RANGE:
+            matcher = difflib.SequenceMatcher(None, keys1[lo1:hi1], keys2[lo2:hi2], autojunk=False)
+            for i, j, size in matcher.get_matching_blocks():
+                blocks.extend((lo1 + i + k, lo2 + j + k) for k in range(size))
+        else:
+            blocks.extend(myers(keys1, lo1, hi1, keys2, lo2, hi2) or ())
+
+    blocks.extend(reversed(suffix))
+
+
+def check_targets(decoded1, decoded2, keys1, keys2, blocks, org1, org2):
+    """Return the (i, j) index pairs of blocks whose local operands reference the same targets.
+
+    The operands of the aligned instructions whose keys hold the placeholder
+    for addresses within the program must differ by the address shift at the
+    target, i.e. the difference between the addresses of the last aligned
+    instructions at or before it. As a run of identical instructions may be
+    aligned with any shift, an operand may also reference another instruction
+    of the run holding the expected target."""
+    addresses1 = [decoded1[i][0] for i, j in blocks]
+    shifts = [decoded2[j][0] - decoded1[i][0] for i, j in blocks]
+    indexes2 = None
+    checked = []
+    for i, j in blocks:
+        if keys1[i][1] == LOCAL:
+            target = decoded1[i][2]
+            position = bisect.bisect_right(addresses1, target) - 1
+            expected = target + (shifts[position] if position >= 0 else org2 - org1)
+            operand = decoded2[j][2]
+            if operand != expected:
+                if indexes2 is None:
+                    indexes2 = {address: index for index, (address, opcode, operand)
+                                in enumerate(decoded2)}
+                low = indexes2.get(min(operand, expected))
+                high = indexes2.get(max(operand, expected))
+                if low is None or high is None or len(set(keys2[low:high + 1])) > 1:
+                    continue
+        checked.append((i, j))
+    return checked
+
+
+def diff(decoded1, decoded2, org1=dis80.CPM_ENTRY, org2=dis80.CPM_ENTRY):
+    """Align the decoded instructions and return the list of differences.
+
+    The differences are (tag, i1, i2, j1, j2) tuples with the same meaning as
+    the ones of ``difflib.SequenceMatcher.get_opcodes()``, except the equal
+    ranges are left out."""
+    keys1 = normalize(decoded1, org1)
+    keys2 = normalize(decoded2, org2)
+    blocks = []
+    match(keys1, 0, len(keys1), keys2, 0, len(keys2), blocks)
+    blocks = check_targets(decoded1, decoded2, keys1, keys2, blocks, org1, org2)
+    blocks.append((len(keys1), len(keys2)))
+
+    differences = []
+    i1 = j1 = 0
+    for i2, j2 in blocks:
+        if i1 < i2 and j1 < j2:
+            differences.append(('replace', i1, i2, j1, j2))
+        elif i1 < i2:
+            differences.append(('delete', i1, i2, j1, j2))
+        elif j1 < j2:
+            differences.append(('insert', i1, i2, j1, j2))
+        i1, j1 = i2 + 1, j2 + 1
+    return differences
+
+
+def write_diff(file, decoded1, decoded2, differences):
+    """Write the differences to file in a format similar to a unified diff.
+
+    Each hunk starts with a header holding the address and number of
+    instructions of each side, followed by the listing lines removed from the
+    first program and added in the second. Return the number of hunks."""
+    for tag, i1, i2, j1, j2 in differences:
+        address1 = decoded1[i1][0] if i1 < len(decoded1) else None
+        address2 = decoded2[j1][0] if j1 < len(decoded2) else None
+        header1 = '----' if address1 is None else f'{address1:04x}'
+        header2 = '----' if address2 is None else f'{address2:04x}'
+        lines = [f'@@ -{header1},{i2 - i1} +{header2},{j2 - j1} @@\n']
+        lines.extend('-' + dis80.format_instruction(*instruction)
+                     for instruction in decoded1[i1:i2])
+        lines.extend('+' + dis80.format_instruction(*instruction)
+                     for instruction in decoded2[j1:j2])
+        file.write(''.join(lines))
+    return len(differences)
+
+
+def main():
+    """Parse the command line and compare the input files."""
+    diff80_description = f'Intel 8080 instruction-level binary diff / Suite8080'
+    parser = argparse.ArgumentParser(description=diff80_description)
+    parser.add_argument('filename1', help='first input file')
+    parser.add_argument('filename2', help='second input file')
+    parser.add_argument('--org', type=dis80.number, default=dis80.CPM_ENTRY,
+                        help=f'address of the first byte of the files, {dis80.CPM_ENTRY:04x}h if not supplied')
+    parser.add_argument('-f', '--follow', action='store_true',
+                        help='follow jumps and calls from the entry points, comparing unreached bytes as data')
+    args = parser.parse_args()
+
+    decoded1 = decode_file(args.filename1, args.org, args.follow)
+    decoded2 = decode_file(args.filename2, args.org, args.follow)
+    differences = diff(decoded1, decoded2, args.org, args.org)
+    write_diff(sys.stdout, decoded1, decoded2, differences)
+
+    sys.exit(1 if differences else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,18 @@
 """An Intel 8080 disassembler."""
 
 import argparse
+import array
+import bisect
+import concurrent.futures
+import csv
+import io
+import json
+import mmap
+from pathlib import Path
+import re
+import sys
+
+from suite8080 import asm80
 
 # Offsets of the fields within the tuple holding an instruction table entry.
 MNEMONIC = 0
@@ -23,7 +35,7 @@ instructions = [
    ('mvi b,',   2),
    ('rlc',      1),
    ('nop',      1),
-   ('dad',      1),
+   ('dad b',    1),
    ('ldax b',   1),
    ('dcx b',    1),
    ('inr c',    1),
@@ -48,7 +60,7 @@ instructions = [
    ('rar',      1),
    ('nop',      1),
    ('lxi h,',   3),
-   ('shld ',    3),
+   ('shld',     3),
    ('inx h',    1),
    ('inr h',    1),
    ('dcr h',    1),
@@ -272,61 +284,1020 @@ instructions = [
    ('rst 7',    1)
 ]
 
+# Instruction sizes indexed by opcode. Indexing bytes is faster than unpacking
+# the tuples of the instruction table in the decoding loops.
+SIZES = bytes(size for mnemonic, size in instructions)
+
+
+def listing_template(opcode):
+    """Return the format string of the listing line of opcode.
+
+    The fields that don't depend on the address or operand are rendered once in
+    advance. The format arguments are the address, the operand bytes in program
+    order, and the symbolic form of a 16-bit operand."""
+    mnemonic, size = instructions[opcode]
+    if size == 1:
+        return '{0:04x} ' + f'{opcode:02x}      \t\t{mnemonic} \n'
+    if size == 2:
+        return '{0:04x} ' + f'{opcode:02x} ' + '{1:02x}   \t\t' + mnemonic + ' {1:02x}h\n'
+    return '{0:04x} ' + f'{opcode:02x} ' + '{1:02x} {2:02x}\t\t' + mnemonic + ' {3}\n'
+
+
+# Listing line format strings indexed by opcode.
+TEMPLATES = [listing_template(opcode) for opcode in range(len(instructions))]
+# Listing line format string of data bytes.
+DATA_TEMPLATE = '{0:04x} {1:02x}      \t\tdb {1:02x}h\n'
+
 program = b''
 
+# Symbol table indexed by address: {<address1>: 'label1', <address2>: 'label2', ...}
+#
+# This is the reverse of the asm80 symbol table, as the disassembler looks up
+# labels by the addresses it finds in the program. A dict keeps each lookup a
+# single hash probe, so symbolizing costs about the same as plain disassembly.
+symbol_table = {}
+
+# Number of disassembled lines joined into a single write to the output file.
+BATCH_SIZE = 4096
+
+# Opcodes that transfer control, used when following the program flow. All the
+# 3-byte instructions with a mnemonic starting with j or c are jumps or calls.
+BRANCHES = {opcode for opcode, (mnemonic, size) in enumerate(instructions)
+            if size == 3 and mnemonic[0] in 'jc'}
+RESTARTS = {opcode for opcode, (mnemonic, size) in enumerate(instructions)
+            if mnemonic.startswith('rst')}
+# jmp, ret, pchl, and hlt don't continue with the next instruction.
+STOPS = {0xc3, 0xcb, 0xc9, 0xd9, 0xe9, 0x76}
+
+# Entry point of CP/M .com programs.
+CPM_ENTRY = 0x0100
+# Addresses the rst instructions call.
+RST_VECTORS = range(0x00, 0x40, 0x08)
+
+# Flags marking the bytes reached when following the program flow.
+DATA = 0
+CODE = 1
+OPERAND = 2
+
+# Undocumented opcodes that duplicate the mnemonic of an earlier opcode, e.g.
+# 0x08 is an alternate nop. As assembling the mnemonic would generate the
+# earlier opcode, the source output gives them as data bytes.
+ALIASES = {opcode for opcode, (mnemonic, size) in enumerate(instructions)
+           if (mnemonic, size) in instructions[:opcode]}
+
+# Maximum number of data bytes in a db directive of the source output.
+DB_BYTES = 8
+
+# Output file name extensions of batch mode by output format.
+OUTPUT_SUFFIXES = {'text': '.lst', 'jsonl': '.jsonl', 'csv': '.csv', 'source': '.asm'}
+
+# Default index file name of batch mode.
+INDEX_FILE = 'dis80-index.json'
+
+# Runs of at least 4 printable ASCII characters are string-like data.
+STRING_PATTERN = re.compile(rb'[\x20-\x7e]{4,}')
+
+# Fields of the structured output records.
+RECORD_FIELDS = ('address', 'opcode', 'bytes', 'mnemonic', 'operand', 'size', 'target')
+
+# Returns executed only if a condition holds, e.g. rnz.
+CONDITIONAL_RETURNS = {opcode for opcode, (mnemonic, size) in enumerate(instructions)
+                       if mnemonic[0] == 'r' and size == 1 and mnemonic not in
+                       ('rlc', 'rrc', 'ral', 'rar', 'ret') and not mnemonic.startswith('rst')}
+
+# Kinds of cross-references, indexed by the codes in XREF_KIND_CODES.
+XREF_KINDS = ('call', 'jump', 'load', 'store', 'pointer')
+
+# Cross-reference kind codes indexed by opcode, NO_XREF for opcodes that
+# reference no address.
+NO_XREF = 0xff
+XREF_KIND_CODES = bytes(
+    0 if (opcode in BRANCHES and mnemonic[0] == 'c') or mnemonic.startswith('rst') else
+    1 if opcode in BRANCHES else
+    2 if mnemonic in ('lda', 'lhld') else
+    3 if mnemonic in ('sta', 'shld') else
+    4 if mnemonic.startswith('lxi') else
+    NO_XREF
+    for opcode, (mnemonic, size) in enumerate(instructions))
+
+# Extension of the cross-reference cache files.
+XREF_CACHE_SUFFIX = '.xrc'
+
+# Flag marking the first instruction of a basic block.
+LEADER = 1
 
-def disassemble():
-    address = 0
-    mnemonic = ''
-    program_length = len(program)
+# Flags marking the addresses where a decoded instruction starts and the ones
+# 16-bit operands reference, used for generating labels.
+START = 1
+TARGET = 2
+
+
+def decode_operand(address, size):
+    """Return the argument of the size-byte instruction at address, None if it has none."""
+    if size == 1:
+        return None
+    if size == 2:
+        return program[address + 1]
+    return program[address + 2] << 8 | program[address + 1]
+
+
+def disassemble(start=0, end=None, org=None):
+    """Decode the program and yield an (address, opcode, operand) tuple per instruction.
+
+    Only the bytes from offset start up to but not including offset end are
+    decoded. Addresses are reported relative to org, which defaults to start so
+    that the addresses are program offsets. The operand is the value of the 8-bit
+    or 16-bit argument of the instruction, or None if the instruction takes no
+    argument. The trailing bytes too few for the operands of the last instruction
+    are yielded as data with an opcode of None and the byte value as the operand."""
+    address = start
+    program_length = len(program) if end is None else min(end, len(program))
+    # Difference between the reported addresses and the program offsets.
+    relocation = 0 if org is None else org - start
 
     while address < program_length:
         opcode = program[address]
-        instruction = instructions[opcode]
-        mnemonic = instruction[MNEMONIC]
-        size = instruction[SIZE]
+        size = SIZES[opcode]
 
         # If there's a data section at the end of a program, some code may be
         # disassembled as an instruction requiring nonexistent operands referenced
         # past the end of the program, which causes an ouf of bounds situation. We
-        # silently end the disassembly rather than aborting with an error because
-        # it's a common case and reporting an error may be misleading.
+        # yield the remaining bytes as data rather than aborting with an error
+        # because it's a common case and reporting an error may be misleading.
         if address + size > program_length:
+            for address in range(address, program_length):
+                yield address + relocation, None, program[address]
             break
 
-        # Opcode argument bytes dumped to the output.
-        arg1 = arg2 = '  '
-        # Least (lsb) and most (most) significant byte of a 16-bit address operand.
-        lsb = msb = ''
-
-        # After the opcode we dump the arguments in the same little-endian byte
-        # order they're in the program. But we print msb of an address first (if
-        # size > 3 we have a 16-bit addres) as it's easier to read 16-bit hex
-        # numbers.
-        if size > 1:
-            if size == 3:
-                arg2 = f'{program[address + 2]:02x}'
-                msb = f'{program[address + 2]:02x}'
-            arg1 = f'{program[address + 1]:02x}'
-            lsb = f'{program[address + 1]:02x}h'
-        output = f'{address:04x} {opcode:02x} {arg1} {arg2}\t\t{mnemonic} {msb}{lsb}'
-        print(output)
+        # Same as decode_operand() but inlined, as this is the hottest loop.
+        if size == 1:
+            operand = None
+        elif size == 2:
+            operand = program[address + 1]
+        else:
+            operand = program[address + 2] << 8 | program[address + 1]
+        yield address + relocation, opcode, operand
 
         address += size
 
 
+def trace(start=0, end=None, org=None, entries=()):
+    """Decode the program following its flow and yield the same tuples as ``disassemble()``.
+
+    Decoding starts from the entry points, i.e. the origin, the CP/M entry point
+    if it lies within the window, the rst vectors if the window starts at
+    address 0, and the addresses in entries that lie within the window, and
+    follows the targets of jumps and calls. The bytes never reached are
+    data, which are yielded one at a time with an opcode of None and the byte
+    value as the operand."""
+    program_length = len(program) if end is None else min(end, len(program))
+    origin = start if org is None else org
+    relocation = origin - start
+
+    # Each byte of the window is visited at most once as the start of an
+    # instruction, so following the flow takes time linear in the window size.
+    flags = bytearray(max(program_length - start, 0))
+    # Elsewhere the CP/M entry point and the rst vectors may hold data, e.g.
+    # the bytes following 0100h in a .com file.
+    seeds = [origin]
+    if origin <= CPM_ENTRY < origin + len(flags):
+        seeds.append(CPM_ENTRY)
+    if origin == 0:
+        seeds.extend(RST_VECTORS)
+    worklist = [address - relocation for address in seeds + list(entries)]
+
+    while worklist:
+        address = worklist.pop()
+
+        while start <= address < program_length and flags[address - start] == DATA:
+            opcode = program[address]
+            size = SIZES[opcode]
+            offset = address - start
+
+            # Stop at instructions running past the end of the window or
+            # overlapping others already decoded, whose bytes are left as data.
+            if address + size > program_length or any(flags[offset + 1:offset + size]):
+                break
+
+            flags[offset] = CODE
+            flags[offset + 1:offset + size] = bytes([OPERAND]) * (size - 1)
+
+            if opcode in BRANCHES:
+                target = program[address + 2] << 8 | program[address + 1]
+                worklist.append(target - relocation)
+            elif opcode in RESTARTS:
+                worklist.append((opcode & 0x38) - relocation)
+
+            if opcode in STOPS:
+                break
+            address += size
+
+    address = start
+    while address < program_length:
+        if flags[address - start] == CODE:
+            opcode = program[address]
+            size = SIZES[opcode]
+            yield address + relocation, opcode, decode_operand(address, size)
+            address += size
+        else:
+            yield address + relocation, None, program[address]
+            address += 1
+
+
+def import_numpy():
+    """Return the numpy module.
+
+    NumPy is optional and only needed for bulk decoding. It's imported on first
+    use rather than with this module, as importing it would slow down the start
+    of all the tools."""
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('bulk decoding requires NumPy') from None
+    return numpy
+
+
+def bulk_decode(data, org=0):
+    """Decode data in vectorized NumPy passes and return arrays of addresses, opcodes, and operands.
+
+    The instructions are the same ``disassemble()`` yields for a program holding
+    data, but the opcodes of data bytes and the operands of the instructions
+    without one are -1. Intended for analyzing many programs at once, e.g. for
+    computing opcode histograms or extracting branch targets."""
+    numpy = import_numpy()
+    codes = numpy.frombuffer(bytes(data), dtype=numpy.uint8).astype(numpy.int64)
+    program_length = len(codes)
+    sizes = numpy.frombuffer(SIZES, dtype=numpy.uint8).astype(numpy.int64)[codes]
+
+    # Each offset leads to the one of the next instruction if an instruction
+    # starts there. An extra offset past the end leads to itself. The offsets
+    # reached from 0 are the instruction boundaries, which are found by pointer
+    # doubling: after round k, reached holds the offsets within 2**k steps and
+    # jump leads 2**k steps ahead. This takes log2(n) vectorized rounds rather
+    # than a Python iteration per instruction.
+    jump = numpy.minimum(numpy.arange(program_length) + sizes, program_length)
+    jump = numpy.append(jump, program_length)
+    reached = numpy.zeros(program_length + 1, dtype=bool)
+    reached[0] = True
+    steps = 1
+    while steps <= program_length:
+        reached[jump[reached]] = True
+        jump = jump[jump]
+        steps *= 2
+    starts = numpy.flatnonzero(reached[:program_length])
+
+    # As in disassemble(), the bytes of a last instruction running past the end
+    # are data.
+    tail = numpy.arange(0)
+    if len(starts) and starts[-1] + sizes[starts[-1]] > program_length:
+        tail = numpy.arange(starts[-1], program_length)
+        starts = starts[:-1]
+
+    padded = numpy.append(codes, [0, 0])
+    starts_sizes = sizes[starts]
+    low = padded[starts + 1]
+    high = padded[starts + 2]
+    operands = numpy.where(starts_sizes == 1, -1,
+                           numpy.where(starts_sizes == 2, low, low | high << 8))
+
+    addresses = numpy.concatenate((starts, tail)) + org
+    opcodes = numpy.concatenate((codes[starts], numpy.full(len(tail), -1)))
+    operands = numpy.concatenate((operands, codes[tail]))
+    return addresses, opcodes, operands
+
+
+def opcode_histogram(opcodes):
+    """Return an array with the number of occurrences of each opcode in the bulk-decoded opcodes."""
+    numpy = import_numpy()
+    return numpy.bincount(opcodes[opcodes >= 0], minlength=len(instructions))
+
+
+def branch_targets(opcodes, operands):
+    """Return the sorted unique targets of the jumps and calls in the bulk-decoded instructions."""
+    numpy = import_numpy()
+    branches = numpy.isin(opcodes, sorted(BRANCHES))
+    return numpy.unique(operands[branches])
+
+
+def generate_labels(decoded):
+    """Add labels to the symbol table for the targets of the decoded instructions.
+
+    A label such as L01A3 is generated for each address that is both the start
+    of a decoded instruction and the operand of a 3-byte instruction, unless the
+    symbol table already has a symbol for the address. Return the number of
+    labels generated."""
+    # The targets are 16-bit addresses, so a flag byte per address takes only
+    # 64 KB and, unlike a set, doesn't grow with the number of instructions.
+    marks = bytearray(0x10000)
+
+    for address, opcode, operand in decoded:
+        if address < 0x10000:
+            marks[address] |= START
+        if opcode is not None and SIZES[opcode] == 3:
+            marks[operand] |= TARGET
+
+    count = 0
+    address = marks.find(START | TARGET)
+    while address >= 0:
+        if address not in symbol_table:
+            symbol_table[address] = f'L{address:04X}'
+            count += 1
+        address = marks.find(START | TARGET, address + 1)
+
+    return count
+
+
+def format_instruction(address, opcode, operand):
+    """Return the text of a decoded instruction, preceded by its label if any.
+
+    An opcode of None denotes a data byte, whose value is the operand."""
+    # After the opcode we dump the arguments in the same little-endian byte
+    # order they're in the program. But we print the msb of a 16-bit argument
+    # first in symbolic form as it's easier to read 16-bit hex numbers.
+    if opcode is None:
+        line = DATA_TEMPLATE.format(address, operand)
+    else:
+        size = SIZES[opcode]
+        if size == 1:
+            line = TEMPLATES[opcode].format(address)
+        elif size == 2:
+            line = TEMPLATES[opcode].format(address, operand)
+        else:
+            # All the 3-byte instructions take a 16-bit operand, which may be the
+            # address of a label. If so, we print the label instead of the number.
+            argument = symbol_table.get(operand) or f'{operand:04x}h'
+            line = TEMPLATES[opcode].format(address, operand & 0xff, operand >> 8, argument)
+
+    if address in symbol_table:
+        line = f'{symbol_table[address]}:\n' + line
+    return line
+
+
+def records(decoded):
+    """Yield a tuple of ``RECORD_FIELDS`` values per decoded instruction.
+
+    The bytes are a hex string, the mnemonic is the instruction text without the
+    operand, e.g. mvi a, and the target is the address a jump, call, or rst
+    transfers control to, or None. Data bytes have the db mnemonic."""
+    for address, opcode, operand in decoded:
+        if opcode is None:
+            yield address, None, f'{operand:02x}', 'db', operand, 1, None
+            continue
+
+        mnemonic, size = instructions[opcode]
+        if size == 1:
+            code = f'{opcode:02x}'
+        elif size == 2:
+            code = f'{opcode:02x}{operand:02x}'
+        else:
+            code = f'{opcode:02x}{operand & 0xff:02x}{operand >> 8:02x}'
+
+        if opcode in BRANCHES:
+            target = operand
+        elif opcode in RESTARTS:
+            target = opcode & 0x38
+        else:
+            target = None
+        yield address, opcode, code, mnemonic.rstrip(','), operand, size, target
+
+
+def write_jsonl(file, decoded):
+    """Write a JSON object per decoded instruction to file and return their number.
+
+    The records are generated lazily and written in batches, so the program is
+    never held in memory as a whole."""
+    count = 0
+    batch = []
+
+    for record in records(decoded):
+        batch.append(json.dumps(dict(zip(RECORD_FIELDS, record))) + '\n')
+        if len(batch) == BATCH_SIZE:
+            file.write(''.join(batch))
+            count += len(batch)
+            batch.clear()
+
+    file.write(''.join(batch))
+    count += len(batch)
+    return count
+
+
+def write_csv(file, decoded):
+    """Write a header and a CSV row per decoded instruction to file and return their number."""
+    writer = csv.writer(file, lineterminator='\n')
+    writer.writerow(RECORD_FIELDS)
+    count = 0
+
+    for record in records(decoded):
+        writer.writerow(record)
+        count += 1
+    return count
+
+
+def write_disassembly(file, decoded):
+    """Write the decoded instructions to file and return the number of instructions.
+
+    The decoded instructions are tuples such as the ones ``disassemble()`` yields.
+    Lines are handed to the file in batches rather than printed one at a time, so
+    on large programs the cost is dominated by decoding rather than by I/O."""
+    count = 0
+    batch = []
+
+    for address, opcode, operand in decoded:
+        batch.append(format_instruction(address, opcode, operand))
+        if len(batch) == BATCH_SIZE:
+            file.write(''.join(batch))
+            count += len(batch)
+            batch.clear()
+
+    file.write(''.join(batch))
+    count += len(batch)
+    return count
+
+
+def hex_number(value, digits=2):
+    """Return value as a hex number in asm80 syntax, e.g. 0ffh."""
+    text = f'{value:0{digits}x}h'
+    # asm80 requires numbers to start with a digit.
+    return '0' + text if text[0].isalpha() else text
+
+
+def write_source(file, decoded, org=0):
+    """Write the decoded instructions to file as asm80 source and return the number of lines.
+
+    The source starts at address org and can be assembled back into the program.
+    Data bytes and the undocumented opcodes are given as db directives, and the
+    symbols not defined as labels are given as equ directives at the end."""
+    lines = [f'\torg {hex_number(org, 4)}']
+    labels = set()
+    data = []
+
+    def flush_data():
+        if data:
+            lines.append('\tdb ' + ', '.join(hex_number(byte) for byte in data))
+            data.clear()
+
+    for address, opcode, operand in decoded:
+        if address in symbol_table:
+            flush_data()
+            lines.append(f'{symbol_table[address]}:')
+            labels.add(address)
+
+        if opcode is None:
+            data.append(operand)
+        elif opcode in ALIASES:
+            size = SIZES[opcode]
+            data.append(opcode)
+            if size > 1:
+                data.append(operand & 0xff)
+            if size > 2:
+                data.append(operand >> 8)
+        else:
+            flush_data()
+            mnemonic, size = instructions[opcode]
+            if size == 1:
+                lines.append(f'\t{mnemonic}')
+            elif size == 2:
+                lines.append(f'\t{mnemonic} {hex_number(operand)}')
+            else:
+                argument = symbol_table.get(operand) or hex_number(operand, 4)
+                lines.append(f'\t{mnemonic} {argument}')
+
+        if len(data) >= DB_BYTES:
+            flush_data()
+
+    flush_data()
+    for address, symbol in symbol_table.items():
+        if address not in labels:
+            lines.append(f'{symbol}\tequ {hex_number(address, 4)}')
+    lines.append('\tend')
+
+    file.write('\n'.join(lines) + '\n')
+    return len(lines)
+
+
+def round_trip(filename, org=CPM_ENTRY):
+    """Disassemble filename to source, reassemble it, and compare the result.
+
+    Return None if the reassembled program matches the original, otherwise a
+    message describing the first mismatch."""
+    global program, symbol_table
+
+    with open(filename, 'rb') as file:
+        program = file.read()
+    symbol_table = {}
+    generate_labels(disassemble(org=org))
+    source = io.StringIO()
+    write_source(source, disassemble(org=org), org)
+
+    # asm80 reports errors by exiting.
+    try:
+        asm80.assemble(source.getvalue().splitlines())
+    except SystemExit:
+        return 'reassembly failed'
+
+    output = asm80.output
+    for offset, (expected, actual) in enumerate(zip(program, output)):
+        if expected != actual:
+            return (f'mismatch at {org + offset:04x}: '
+                    f'expected {expected:02x}, got {actual:02x}')
+    if len(output) != len(program):
+        return f'length mismatch: expected {len(program)} bytes, got {len(output)}'
+    return None
+
+
+def check_round_trip(filenames, jobs=None, org=CPM_ENTRY):
+    """Round-trip the files in parallel, report mismatches, and return their number.
+
+    The files are distributed among jobs processes, as many as the CPUs if jobs
+    is None. Each process has its own copy of the dis80 and asm80 global state."""
+    failures = 0
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(round_trip, filenames, [org] * len(filenames))
+        for filename, message in zip(filenames, results):
+            if message:
+                print(f'dis80> {filename}: {message}', file=sys.stderr)
+                failures += 1
+
+    return failures
+
+
+def control_flow_graph(decoded):
+    """Split the decoded instructions into basic blocks and return them with their edges.
+
+    The blocks are (start, end, instructions, exit) tuples, where end is the
+    address following the last instruction and exit the kind of the last one:
+    jump, branch, call, return, conditional return, indirect (pchl), halt,
+    fallthrough if the block ends because the next one starts, or end if data
+    or the end of the program follows. The edges are
+    (source, target, kind) tuples, where source is the start of a block and kind
+    is jump, branch, call, return (from a call to the following block), or
+    fallthrough. Call targets outside the program are edge targets too."""
+    # The instructions are stored in parallel arrays and the leaders in an
+    # address-indexed flag array, so a single decoding pass builds the graph
+    # without a dict or object per instruction.
+    addresses = array.array('l')
+    opcodes = array.array('h')
+    operands = array.array('l')
+    flags = bytearray(0x10000)
+    follows_exit = True
+
+    for address, opcode, operand in decoded:
+        if opcode is None:
+            follows_exit = True
+            continue
+        addresses.append(address)
+        opcodes.append(opcode)
+        operands.append(-1 if operand is None else operand)
+        if follows_exit and address < 0x10000:
+            flags[address] = LEADER
+        follows_exit = (opcode in BRANCHES or opcode in RESTARTS or opcode in STOPS
+                        or opcode in CONDITIONAL_RETURNS)
+        if opcode in BRANCHES:
+            flags[operand] = LEADER
+        elif opcode in RESTARTS:
+            flags[opcode & 0x38] = LEADER
+
+    blocks = []
+    edges = []
+    count = len(addresses)
+    first = 0
+    for index in range(count):
+        opcode = opcodes[index]
+        end = addresses[index] + SIZES[opcode]
+        # The next instruction follows this one only if no data is in between.
+        has_next = index + 1 < count and addresses[index + 1] == end
+        if has_next and not (end < 0x10000 and flags[end]):
+            continue
+
+        start = addresses[first]
+        operand = operands[index]
+        if opcode in (0xc3, 0xcb):
+            exit_kind = 'jump'
+            edges.append((start, operand, 'jump'))
+        elif opcode in BRANCHES:
+            if instructions[opcode][MNEMONIC][0] == 'j':
+                exit_kind = 'branch'
+                edges.append((start, operand, 'branch'))
+            else:
+                exit_kind = 'call'
+                edges.append((start, operand, 'call'))
+        elif opcode in RESTARTS:
+            exit_kind = 'call'
+            edges.append((start, opcode & 0x38, 'call'))
+        elif opcode in (0xc9, 0xd9):
+            exit_kind = 'return'
+        elif opcode in CONDITIONAL_RETURNS:
+            exit_kind = 'conditional return'
+        elif opcode == 0xe9:
+            exit_kind = 'indirect'
+        elif opcode == 0x76:
+            exit_kind = 'halt'
+        elif has_next:
+            exit_kind = 'fallthrough'
+        else:
+            exit_kind = 'end'
+
+        if has_next and opcode not in STOPS:
+            edges.append((start, end, 'return' if exit_kind == 'call' else 'fallthrough'))
+        blocks.append((start, end, index + 1 - first, exit_kind))
+        first = index + 1
+
+    return blocks, edges
+
+
+def write_dot(file, blocks, edges):
+    """Write the control flow graph to file in Graphviz DOT format and return the number of blocks."""
+    lines = ['digraph cfg {', '  node [shape=box, fontname="monospace"];']
+    for start, end, count, exit_kind in blocks:
+        label = symbol_table.get(start, f'{start:04x}')
+        # The label holds the symbol or address of the block, its number of
+        # instructions, and its exit kind.
+        lines.append(f'  "{start:04x}" [label="{label} ({count})\\n{exit_kind}"];')
+    for source, target, kind in edges:
+        style = ', style=dashed' if kind in ('call', 'return') else ''
+        lines.append(f'  "{source:04x}" -> "{target:04x}" [label="{kind}"{style}];')
+    lines.append('}')
+    file.write('\n'.join(lines) + '\n')
+    return len(blocks)
+
+
+def write_cfg_json(file, blocks, edges):
+    """Write the control flow graph to file in JSON format and return the number of blocks."""
+    graph = {
+        'blocks': [{'start': start, 'end': end, 'instructions': count, 'exit': exit_kind}
+                   for start, end, count, exit_kind in blocks],
+        'edges': [{'source': source, 'target': target, 'kind': kind}
+                  for source, target, kind in edges],
+    }
+    json.dump(graph, file)
+    file.write('\n')
+    return len(blocks)
+
+
+def cross_references(decoded):
+    """Return the cross-reference index of the decoded instructions.
+
+    The index is a (targets, sources, kinds) tuple of parallel arrays sorted by
+    target and source address. Each entry records that the instruction at the
+    source address references the target address, and the kind is an index
+    into ``XREF_KINDS``. The sorted arrays are compact and can be searched with
+    ``references()`` in O(log n) time."""
+    entries = []
+    for address, opcode, operand in decoded:
+        if opcode is None:
+            continue
+        kind = XREF_KIND_CODES[opcode]
+        if kind != NO_XREF:
+            target = opcode & 0x38 if opcode in RESTARTS else operand
+            entries.append((target, address, kind))
+    entries.sort()
+
+    targets = array.array('L', (target for target, source, kind in entries))
+    sources = array.array('L', (source for target, source, kind in entries))
+    kinds = bytes(kind for target, source, kind in entries)
+    return targets, sources, kinds
+
+
+def references(xrefs, target):
+    """Return the (source, kind) pairs of the instructions referencing target."""
+    targets, sources, kinds = xrefs
+    low = bisect.bisect_left(targets, target)
+    high = bisect.bisect_right(targets, target, low)
+    return [(sources[index], XREF_KINDS[kinds[index]]) for index in range(low, high)]
+
+
+def write_xrefs(file, xrefs):
+    """Write the cross-reference listing to file and return the number of targets.
+
+    Each line holds a target address, or its symbol, followed by the addresses
+    and kinds of the instructions referencing it."""
+    targets, sources, kinds = xrefs
+    lines = []
+    index = 0
+
+    while index < len(targets):
+        target = targets[index]
+        end = bisect.bisect_right(targets, target, index)
+        name = symbol_table.get(target, f'{target:04x}')
+        refs = ' '.join(f'{sources[i]:04x}:{XREF_KINDS[kinds[i]]}' for i in range(index, end))
+        lines.append(f'{name}\t{refs}\n')
+        index = end
+
+    file.write(''.join(lines))
+    return len(lines)
+
+
+def xref_cache_key(filename, org, follow, entries=()):
+    """Return the key identifying the cross-reference index of a program file.
+
+    The key changes when the file or the options affecting the decoding do,
+    including the additional entry points when following the program flow."""
+    status = Path(filename).stat()
+    entries = sorted(set(entries)) if follow else []
+    return array.array('q', [status.st_size, status.st_mtime_ns, org, int(follow), len(entries)]
+                       + entries)
+
+
+def save_xrefs(cache_file, key, xrefs):
+    """Save the cross-reference index and its key to cache_file.
+
+    Return whether the index was saved. As the cache is optional, a file that
+    can't be written, e.g. in a read-only directory, isn't an error."""
+    targets, sources, kinds = xrefs
+    try:
+        with open(cache_file, 'wb') as file:
+            key.tofile(file)
+            array.array('q', [len(targets)]).tofile(file)
+            targets.tofile(file)
+            sources.tofile(file)
+            file.write(kinds)
+    except OSError:
+        return False
+    return True
+
+
+def load_xrefs(cache_file, key):
+    """Return the cross-reference index saved to cache_file, None if missing or stale."""
+    try:
+        with open(cache_file, 'rb') as file:
+            saved_key = array.array('q')
+            saved_key.fromfile(file, len(key))
+            if saved_key != key:
+                return None
+            count = array.array('q')
+            count.fromfile(file, 1)
+            targets = array.array('L')
+            targets.fromfile(file, count[0])
+            sources = array.array('L')
+            sources.fromfile(file, count[0])
+            kinds = file.read(count[0])
+    except (OSError, EOFError):
+        return None
+    if len(kinds) != count[0]:
+        return None
+    return targets, sources, kinds
+
+
+# The symbol table is read from the .sym CP/M file format asm80 writes, which is
+# described in section "1.1 SID Startup" on page 4 of "SID Users Guide" by
+# Digital Research: http://www.cpm.z80.de/randyfiles/DRI/SID_ZSID.pdf
+
+def read_symbol_table(filename):
+    """Load a CP/M ``.sym`` file and return a symbol table indexed by address.
+
+    Each entry is a 4-digit hex address followed by a symbol, and a line may hold
+    more than one entry. If several symbols share an address, the first wins."""
+    table = {}
+
+    with open(filename, 'r', encoding='utf-8') as file:
+        # CP/M text files may be padded with ^Z (ASCII 26) characters at the end.
+        fields = file.read().replace('\x1a', ' ').split()
+
+    if len(fields) % 2:
+        print(f'dis80> malformed symbol file {filename}', file=sys.stderr)
+        sys.exit(1)
+
+    for i in range(0, len(fields), 2):
+        try:
+            address = int(fields[i], 16)
+        except ValueError:
+            print(f'dis80> invalid address "{fields[i]}" in symbol file {filename}',
+                  file=sys.stderr)
+            sys.exit(1)
+        table.setdefault(address, fields[i + 1].lower())
+
+    return table
+
+
+def select_writer(source, output_format, origin):
+    """Return the function writing decoded instructions in the output format.
+
+    The function takes a file and the decoded instructions as arguments."""
+    if source:
+        return lambda file, decoded: write_source(file, decoded, origin)
+    if output_format == 'jsonl':
+        return write_jsonl
+    if output_format == 'csv':
+        return write_csv
+    return write_disassembly
+
+
+def tally(decoded, histogram, calls):
+    """Pass the decoded instructions through, counting opcodes and collecting call targets.
+
+    The count of each opcode is added to the histogram list and the targets of
+    calls and rst instructions to the calls set."""
+    for address, opcode, operand in decoded:
+        if opcode is not None:
+            histogram[opcode] += 1
+            if opcode in BRANCHES and instructions[opcode][MNEMONIC][0] == 'c':
+                calls.add(operand)
+            elif opcode in RESTARTS:
+                calls.add(opcode & 0x38)
+        yield address, opcode, operand
+
+
+def disassemble_file(filename, options):
+    """Disassemble filename to a file alongside it and return its index entry.
+
+    The options are the parsed dis80 command line arguments. The output file has
+    the name of the input file with the extension of the output format. The index
+    entry is a dict holding the size of the program, the number of instructions,
+    the histogram of the opcodes, the call targets, and the string-like data."""
+    global program, symbol_table
+
+    program = Path(filename).read_bytes()
+    symbol_table = {}
+    org = CPM_ENTRY if options.org is None else options.org
+
+    def decode():
+        if options.follow:
+            return trace(org=org, entries=options.entry)
+        return disassemble(org=org)
+
+    if options.labels:
+        generate_labels(decode())
+
+    histogram = [0] * len(instructions)
+    calls = set()
+    suffix = OUTPUT_SUFFIXES['source' if options.source else options.format]
+    writer = select_writer(options.source, options.format, org)
+    with open(Path(filename).with_suffix(suffix), 'w', encoding='utf-8', newline='') as file:
+        writer(file, tally(decode(), histogram, calls))
+
+    return {
+        'size': len(program),
+        'instructions': sum(histogram),
+        'opcodes': {f'{opcode:02x}': count
+                    for opcode, count in enumerate(histogram) if count},
+        'calls': sorted(calls),
+        'strings': [[org + match.start(), match.group().decode('ascii')]
+                    for match in STRING_PATTERN.finditer(program)],
+    }
+
+
+def batch_files(paths):
+    """Return the files in paths, replacing directories with the .com files they contain."""
+    filenames = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            filenames.extend(sorted(str(child) for child in path.rglob('*')
+                                    if child.suffix.lower() == '.com' and child.is_file()))
+        else:
+            filenames.append(str(path))
+    return filenames
+
+
+def disassemble_batch(filenames, options, index_file=INDEX_FILE, jobs=None):
+    """Disassemble the files in parallel, write the index, and return the number of files.
+
+    The files are distributed among jobs processes, as many as the CPUs if jobs
+    is None. The index is a JSON file mapping each file name to the entry
+    ``disassemble_file()`` returns."""
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        entries = executor.map(disassemble_file, filenames, [options] * len(filenames))
+        index = dict(zip(filenames, entries))
+
+    with open(index_file, 'w', encoding='utf-8') as file:
+        json.dump({'files': index}, file)
+
+    return len(index)
+
+
+def read_index(index_file=INDEX_FILE):
+    """Return the dict mapping file names to entries from a batch mode index file."""
+    with open(index_file, 'r', encoding='utf-8') as file:
+        return json.load(file)['files']
+
+
+def number(string):
+    """Convert a command line number in asm80 syntax, e.g. 100h, to its value."""
+    value = asm80.get_number(string)
+    if value < 0:
+        raise ValueError(string)
+    return value
+
+
 def main():
-    global program
+    global program, symbol_table
     dis80_description = f'Intel 8080 disassembler / Suite8080'
 
     parser = argparse.ArgumentParser(description=dis80_description)
-    parser.add_argument('filename', type=str, help=' A file name')
+    parser.add_argument('filename', type=str, nargs='+',
+                        help='input file, more than one or directories with --check or --batch')
+    parser.add_argument('-o', '--outfile',
+                        help='output file, standard output if not supplied')
+    parser.add_argument('-s', '--symbols',
+                        help='symbol table file in .sym format for symbolic operands')
+    parser.add_argument('--start', type=number, default=0,
+                        help='file offset to start disassembling at, 0 if not supplied')
+    window = parser.add_mutually_exclusive_group()
+    window.add_argument('--end', type=number,
+                        help='file offset to stop disassembling before, end of file if not supplied')
+    window.add_argument('--length', type=number,
+                        help='number of bytes to disassemble from the start offset')
+    parser.add_argument('--org', type=number,
+                        help='address of the start offset, the start offset itself if not supplied, '
+                             'or 0100h past it with --follow as for CP/M programs')
+    parser.add_argument('-f', '--follow', action='store_true',
+                        help='follow jumps and calls from the entry points, showing unreached bytes as data')
+    parser.add_argument('-l', '--labels', action='store_true',
+                        help='generate labels for the targets of jumps, calls, and 16-bit operands')
+    parser.add_argument('-e', '--entry', type=number, action='append', default=[],
+                        help='additional entry point address for --follow, may be repeated')
+    parser.add_argument('-S', '--source', action='store_true',
+                        help='output asm80 source that can be assembled back into the program')
+    parser.add_argument('-F', '--format', choices=('text', 'jsonl', 'csv'), default='text',
+                        help='output format of the listing, text if not supplied')
+    parser.add_argument('-g', '--cfg', choices=('dot', 'json'),
+                        help='output the basic blocks and control flow graph in DOT or JSON format')
+    parser.add_argument('-x', '--xref', action='store_true',
+                        help='output the cross-references of the addresses, cached alongside the input file')
+    parser.add_argument('-c', '--check', action='store_true',
+                        help='check that the input files survive a round trip through --source and asm80')
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help='disassemble each input file to a file alongside it and index them')
+    parser.add_argument('-i', '--index', default=INDEX_FILE,
+                        help=f'index file for --batch, {INDEX_FILE} if not supplied')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of parallel processes for --check or --batch, the number of CPUs if not supplied')
     args = parser.parse_args()
-    filename = args.filename
 
+    if args.batch:
+        count = disassemble_batch(batch_files(args.filename), args, args.index, args.jobs)
+        print(f'{count} files disassembled')
+        return
+
+    if args.check:
+        org = CPM_ENTRY if args.org is None else args.org
+        failures = check_round_trip(args.filename, args.jobs, org)
+        print(f'{len(args.filename) - failures} of {len(args.filename)} files passed')
+        sys.exit(1 if failures else 0)
+
+    if len(args.filename) > 1:
+        parser.error('only one input file allowed without --check or --batch')
+    filename = args.filename[0]
+
+    start = args.start
+    end = start + args.length if args.length is not None else args.end
+    if end is not None and end < start:
+        parser.error('--end must not be less than --start')
+    # Following the flow of a CP/M program needs the addresses it runs at.
+    if args.follow and args.org is None:
+        args.org = start + CPM_ENTRY
+
+    if args.symbols:
+        symbol_table = read_symbol_table(args.symbols)
+
+    # The input is memory-mapped so that disassembling a small window of a large
+    # EPROM dump or disk image reads only the pages in the window.
     with open(filename, 'rb') as file:
-        program = file.read()
-        disassemble()
+        try:
+            program = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped.
+            program = b''
+
+    try:
+        if start > len(program):
+            parser.error(f'--start is past the end of the {len(program)}-byte file')
+        decoder = trace if args.follow else disassemble
+        decoder_args = (start, end, args.org, args.entry) if args.follow else (start, end, args.org)
+
+        # Generating labels takes an extra decoding pass over the program to
+        # collect the targets before the one that writes the output.
+        if args.labels:
+            generate_labels(decoder(*decoder_args))
+
+        origin = start if args.org is None else args.org
+        if args.xref:
+            # The cache is valid only for the whole file.
+            cache_file = filename + XREF_CACHE_SUFFIX
+            key = xref_cache_key(filename, origin, args.follow, args.entry)
+            if start == 0 and end is None:
+                xrefs = load_xrefs(cache_file, key)
+                if xrefs is None:
+                    xrefs = cross_references(decoder(*decoder_args))
+                    save_xrefs(cache_file, key, xrefs)
+            else:
+                xrefs = cross_references(decoder(*decoder_args))
+            writer = lambda file, decoded: write_xrefs(file, xrefs)
+        elif args.cfg:
+            write_graph = write_dot if args.cfg == 'dot' else write_cfg_json
+            writer = lambda file, decoded: write_graph(file, *control_flow_graph(decoded))
+        else:
+            writer = select_writer(args.source, args.format, origin)
+
+        if args.outfile:
+            # The csv module requires files opened with newline=''.
+            with open(args.outfile, 'w', encoding='utf-8', newline='') as file:
+                writer(file, decoder(*decoder_args))
+        else:
+            writer(sys.stdout, decoder(*decoder_args))
+    finally:
+        if isinstance(program, mmap.mmap):
+            program.close()
 
 
 if __name__ == '__main__':
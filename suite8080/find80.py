@@ -0,0 +1,120 @@
+"""An Intel 8080 instruction pattern finder."""
+
+import argparse
+import mmap
+import re
+import sys
+
+from suite8080 import asm80
+from suite8080 import dis80
+
+# Wildcard matching any operand in a pattern.
+WILDCARD = '??'
+
+# Separator of the instructions in a pattern.
+SEPARATOR = ';'
+
+
+def normalize(text):
+    """Return instruction text lowercase, with single spaces, and a space after commas."""
+    return ' '.join(text.lower().replace(',', ', ').split())
+
+
+# Opcodes indexed by normalized instruction text without the operand, e.g.
+# {'mvi c': 0x0e, 'call': 0xcd, 'mov b, c': 0x41, ...}. The undocumented opcodes
+# duplicating the mnemonic of an earlier one are left out, as the assembler
+# never generates them.
+opcodes = {}
+for opcode, (mnemonic, size) in enumerate(dis80.instructions):
+    if opcode not in dis80.ALIASES:
+        opcodes[normalize(mnemonic).rstrip(',')] = opcode
+
+
+def compile_instruction(text):
+    """Return the bytes regular expression matching the code of an instruction.
+
+    The operand may be the ``??`` wildcard matching any value, or a number in
+    asm80 syntax. Raise ValueError if the instruction is invalid."""
+    text = normalize(text)
+
+    # Instructions without operands, e.g. mov b, c or rst 1.
+    if text in opcodes and dis80.SIZES[opcodes[text]] == 1:
+        return re.escape(bytes([opcodes[text]]))
+
+    mnemonic, _, operand = text.rpartition(' ')
+    mnemonic = mnemonic.rstrip(',')
+    if mnemonic not in opcodes or dis80.SIZES[opcodes[mnemonic]] == 1:
+        raise ValueError(f'invalid instruction "{text}"')
+    opcode = opcodes[mnemonic]
+    operand_size = dis80.SIZES[opcode] - 1
+
+    if operand == WILDCARD:
+        return re.escape(bytes([opcode])) + b'.' * operand_size
+
+    try:
+        value = asm80.get_number(operand)
+    except ValueError:
+        raise ValueError(f'invalid operand "{operand}"') from None
+    if not 0 <= value < 1 << (8 * operand_size):
+        raise ValueError(f'operand "{operand}" out of range')
+    return re.escape(bytes([opcode]) + value.to_bytes(operand_size, byteorder='little'))
+
+
+def compile_pattern(pattern):
+    """Compile a pattern of instructions separated by ; to a regular expression.
+
+    The regular expression is a byte-level automaton matching the code of the
+    instructions in sequence. It matches with a lookahead so that overlapping
+    occurrences are found too. Raise ValueError if the pattern is invalid."""
+    instructions = [text for text in pattern.split(SEPARATOR) if text.strip()]
+    if not instructions:
+        raise ValueError('empty pattern')
+
+    code = b''.join(compile_instruction(text) for text in instructions)
+    return re.compile(b'(?=(' + code + b'))', re.DOTALL)
+
+
+def search(filename, regex, org=dis80.CPM_ENTRY):
+    """Return the addresses of the matches of regex in filename.
+
+    The file is memory-mapped and scanned in a single pass, and its first byte
+    is at address org."""
+    with open(filename, 'rb') as file:
+        try:
+            image = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped.
+            return []
+
+    with image:
+        return [org + match.start() for match in regex.finditer(image)]
+
+
+def main():
+    """Parse the command line and search the input files for the pattern."""
+    find80_description = f'Intel 8080 instruction pattern finder / Suite8080'
+    parser = argparse.ArgumentParser(description=find80_description)
+    parser.add_argument('pattern',
+                        help="instructions separated by ';', with ?? matching any operand")
+    parser.add_argument('filename', nargs='+',
+                        help='input file or directory of .com files')
+    parser.add_argument('--org', type=dis80.number, default=dis80.CPM_ENTRY,
+                        help=f'address of the first byte of the files, {dis80.CPM_ENTRY:04x}h if not supplied')
+    args = parser.parse_args()
+
+    try:
+        regex = compile_pattern(args.pattern)
+    except ValueError as error:
+        parser.error(str(error))
+
+    matches = 0
+    for filename in dis80.batch_files(args.filename):
+        for address in search(filename, regex, args.org):
+            print(f'{filename}:{address:04x}')
+            matches += 1
+
+    sys.exit(0 if matches else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""An instruction-level profiler for Intel 8080 programs running on the simulator."""
+
+import argparse
+from array import array
+import bisect
+from pathlib import Path
+import sys
+
+from suite8080 import cpm80
+from suite8080 import dis80
+from suite8080 import sim80
+
+# Opcodes that call a subroutine, i.e. call, the conditional calls, and rst.
+CALLS = ({opcode for opcode in dis80.BRANCHES
+          if dis80.instructions[opcode][dis80.MNEMONIC][0] == 'c'} | dis80.RESTARTS)
+
+# Maximum depth of the tracked call stack. Deeper calls are charged to the
+# deepest tracked subroutine, so that programs calling without returning don't
+# make the stack grow without limit.
+MAX_DEPTH = 256
+
+# Default number of hot spots reported.
+TOP = 20
+
+
+def profile(cpu, limit=None):
+    """Run cpu until hlt or limit instructions, and return its profile.
+
+    Return the number of executed instructions, the arrays of the executions
+    and the clock cycles of the instructions indexed by address, and a
+    dictionary of the cycles spent in each call stack. A call stack is a tuple
+    of the start address of the program followed by the addresses of the
+    subroutines called. Calls and returns are tracked as the instructions run,
+    and a subroutine returns when the program reaches its return address with
+    the stack pointer back to its value before the call.
+
+    The instructions run one at a time with CPU.step(), which services the
+    events and interrupts. An accepted interrupt counts as a call of its
+    vector, and the cycles a hlt waits for an interrupt are charged to it."""
+    memory = cpu.memory
+    counts = array('L', [0]) * sim80.MEMORY_SIZE
+    cycles = array('Q', [0]) * sim80.MEMORY_SIZE
+    stacks = {}
+    stack = (cpu.pc,)
+    # Frames of the subroutines called as (return address, stack pointer after
+    # the return) tuples.
+    frames = []
+    return_address = return_sp = -1
+    pending = 0
+    executed = 0
+    limit = sys.maxsize if limit is None else limit
+    if cpu.halted and not cpu.wake():
+        limit = 0
+    try:
+        while executed < limit and not cpu.halted:
+            pc = cpu.pc
+            if pc == return_address and cpu.sp == return_sp:
+                stacks[stack] = stacks.get(stack, 0) + pending
+                pending = 0
+                stack = stack[:-1]
+                frames.pop()
+                return_address, return_sp = frames[-1] if frames else (-1, -1)
+            opcode = memory[pc]
+            counts[pc] += 1
+            executed += 1
+            sp = cpu.sp
+            start = cpu.cycles
+            following = pc
+            try:
+                following = cpu.step()
+            finally:
+                # Conditional calls and returns add the cycles of the taken branch.
+                spent = cpu.cycles - start
+                interrupted = cpu.pc != following
+                if interrupted:
+                    spent -= sim80.CYCLES[sim80.RST]
+                cycles[pc] += spent
+                pending += spent
+            # The stack pointer after the instruction, before an interrupt pushed pc.
+            after = cpu.sp + 2 & 0xffff if interrupted else cpu.sp
+            if opcode in CALLS and after == sp - 2 & 0xffff and len(frames) < MAX_DEPTH:
+                stacks[stack] = stacks.get(stack, 0) + pending
+                pending = 0
+                stack += (following,)
+                return_address = memory[after] | memory[after + 1 & 0xffff] << 8
+                return_sp = sp
+                frames.append((return_address, return_sp))
+            if interrupted and len(frames) < MAX_DEPTH:
+                stacks[stack] = stacks.get(stack, 0) + pending
+                pending = sim80.CYCLES[sim80.RST]
+                stack += (cpu.pc,)
+                return_address, return_sp = following, after
+                frames.append((return_address, return_sp))
+            elif interrupted:
+                pending += sim80.CYCLES[sim80.RST]
+    finally:
+        if pending:
+            stacks[stack] = stacks.get(stack, 0) + pending
+    return executed, counts, cycles, stacks
+
+
+def symbol_locator(symbol_table, end=sim80.MEMORY_SIZE):
+    """Return a function naming an address after the closest symbol at or before it.
+
+    The names are symbol+offset, e.g. loop+3, or the hexadecimal address if no
+    symbol precedes it or the address is at or past end, e.g. outside of the
+    program. symbol_table is indexed by address, as the one
+    dis80.read_symbol_table() returns."""
+    addresses = sorted(symbol_table)
+
+    def locate(address, offsets=True):
+        index = bisect.bisect_right(addresses, address) - 1
+        if index < 0 or address >= end:
+            return f'{address:04x}'
+        symbol_address = addresses[index]
+        name = symbol_table[symbol_address]
+        if offsets and address != symbol_address:
+            return f'{name}+{address - symbol_address}'
+        return name
+
+    return locate
+
+
+def hot_spots(counts, cycles, locate, by_address=False):
+    """Return the hot spots sorted by cycles, most expensive first.
+
+    Each hot spot is a (name, executions, cycles) tuple. The instructions are
+    aggregated by symbol, unless by_address is true."""
+    spots = {}
+    for address in range(len(counts)):
+        if not counts[address]:
+            continue
+        name = locate(address, by_address)
+        executions, spent = spots.get(name, (0, 0))
+        spots[name] = (executions + counts[address], spent + cycles[address])
+    return sorted(((name, executions, spent) for name, (executions, spent) in spots.items()),
+                  key=lambda spot: (-spot[2], spot[0]))
+
+
+def folded_stacks(stacks, locate):
+    """Return the call stacks in folded format as a dictionary of cycles by stack.
+
+    A folded stack is the names of the subroutines separated by semicolons, e.g.
+    start;print;putchar, which flame graph tools such as flamegraph.pl read."""
+    folded = {}
+    for stack, spent in stacks.items():
+        key = ';'.join(locate(address, False) for address in stack)
+        folded[key] = folded.get(key, 0) + spent
+    return folded
+
+
+def write_report(file, spots, executed, total_cycles, top=TOP):
+    """Write the table of the top hot spots to file."""
+    print(f'{executed} instructions, {total_cycles} cycles', file=file)
+    print(f'{"cycles":>12} {"%":>6} {"executions":>12}  location', file=file)
+    for name, executions, spent in spots[:top]:
+        percent = 100 * spent / total_cycles if total_cycles else 0
+        print(f'{spent:12} {percent:6.2f} {executions:12}  {name}', file=file)
+
+
+def write_folded(file, folded):
+    """Write the folded stacks to file, one per line followed by its cycles."""
+    for key in sorted(folded):
+        print(f'{key} {folded[key]}', file=file)
+
+
+def main():
+    """Parse the command line, profile the program in the input file, and report the hot spots."""
+    prof80_description = f'Intel 8080 profiler / Suite8080'
+    parser = argparse.ArgumentParser(description=prof80_description)
+    parser.add_argument('filename', help='program file')
+    parser.add_argument('arguments', nargs='*', help='command line arguments of a CP/M program')
+    parser.add_argument('-s', '--symbols',
+                        help='symbol table file in .sym format for aggregating by symbol')
+    parser.add_argument('-o', '--outfile',
+                        help='report file, standard output if not supplied')
+    parser.add_argument('-f', '--folded',
+                        help='file for the call stacks in folded format for flame graphs')
+    parser.add_argument('-t', '--top', type=int, default=TOP,
+                        help=f'number of hot spots reported, {TOP} if not supplied')
+    parser.add_argument('-a', '--addresses', action='store_true',
+                        help='report the hot spots by address rather than by symbol')
+    parser.add_argument('--org', type=dis80.number, default=sim80.ORG,
+                        help=f'load and start address, {sim80.ORG:04x}h if not supplied')
+    parser.add_argument('-n', '--limit', type=int,
+                        help='maximum number of instructions to execute')
+    parser.add_argument('-c', '--cpm', action='store_true',
+                        help='run the program in the cpm80 CP/M environment')
+    parser.add_argument('-d', '--directory', default='.',
+                        help='host directory holding the files of drive A: with --cpm, the current directory if not supplied')
+    args = parser.parse_args()
+
+    symbol_table = dis80.read_symbol_table(args.symbols) if args.symbols else {}
+
+    cpu = cpm80.load_cpu(parser, args)
+    end = (cpm80.TPA if args.cpm else args.org) + Path(args.filename).stat().st_size
+
+    try:
+        executed, counts, cycles, stacks = profile(cpu, args.limit)
+    except ValueError as error:
+        print(f'prof80> {cpu.pc:04x}: {error}', file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if args.cpm:
+            cpu.flush()
+            cpu.close_files()
+
+    total_cycles = sum(cycles)
+    locate = symbol_locator(symbol_table, end)
+    spots = hot_spots(counts, cycles, locate, args.addresses or not symbol_table)
+    if args.outfile:
+        with open(args.outfile, 'w', encoding='utf-8') as file:
+            write_report(file, spots, executed, total_cycles, args.top)
+    else:
+        write_report(sys.stdout, spots, executed, total_cycles, args.top)
+    if args.folded:
+        with open(args.folded, 'w', encoding='utf-8') as file:
+            write_folded(file, folded_stacks(stacks, locate))
+
+
+if __name__ == '__main__':
+    main()
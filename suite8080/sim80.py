@@ -0,0 +1,1105 @@
+"""An Intel 8080 simulator."""
+
+import argparse
+import heapq
+import itertools
+import json
+from pathlib import Path
+import re
+import sys
+import time
+import zlib
+
+from suite8080 import alu80
+from suite8080 import dis80
+
+# Flag bits of the PSW (program status word) register F.
+SIGN = alu80.SIGN
+ZERO = alu80.ZERO
+AUX_CARRY = alu80.AUX_CARRY
+PARITY = alu80.PARITY
+CARRY = alu80.CARRY
+# Bit 1 of F is always set when F is pushed on the stack, and bits 3 and 5 clear.
+PSW_ALWAYS_SET = 0x02
+PSW_FLAGS = SIGN | ZERO | AUX_CARRY | PARITY | CARRY
+
+# Size of the address space.
+MEMORY_SIZE = 0x10000
+
+# Default load and start address, the same as CP/M .com programs.
+ORG = dis80.CPM_ENTRY
+
+# Number of clock cycles (T-states) of each opcode. Conditional calls and
+# returns take 6 more cycles if the condition holds.
+CYCLES = bytes([
+    4, 10,  7,  5,  5,  5,  7,  4,  4, 10,  7,  5,  5,  5,  7,  4,   # 00
+    4, 10,  7,  5,  5,  5,  7,  4,  4, 10,  7,  5,  5,  5,  7,  4,   # 10
+    4, 10, 16,  5,  5,  5,  7,  4,  4, 10, 16,  5,  5,  5,  7,  4,   # 20
+    4, 10, 13,  5, 10, 10, 10,  4,  4, 10, 13,  5,  5,  5,  7,  4,   # 30
+    5,  5,  5,  5,  5,  5,  7,  5,  5,  5,  5,  5,  5,  5,  7,  5,   # 40
+    5,  5,  5,  5,  5,  5,  7,  5,  5,  5,  5,  5,  5,  5,  7,  5,   # 50
+    5,  5,  5,  5,  5,  5,  7,  5,  5,  5,  5,  5,  5,  5,  7,  5,   # 60
+    7,  7,  7,  7,  7,  7,  7,  7,  5,  5,  5,  5,  5,  5,  7,  5,   # 70
+    4,  4,  4,  4,  4,  4,  7,  4,  4,  4,  4,  4,  4,  4,  7,  4,   # 80
+    4,  4,  4,  4,  4,  4,  7,  4,  4,  4,  4,  4,  4,  4,  7,  4,   # 90
+    4,  4,  4,  4,  4,  4,  7,  4,  4,  4,  4,  4,  4,  4,  7,  4,   # a0
+    4,  4,  4,  4,  4,  4,  7,  4,  4,  4,  4,  4,  4,  4,  7,  4,   # b0
+    5, 10, 10, 10, 11, 11,  7, 11,  5, 10, 10, 10, 11, 17,  7, 11,   # c0
+    5, 10, 10, 10, 11, 11,  7, 11,  5, 10, 10, 10, 11, 17,  7, 11,   # d0
+    5, 10, 10, 18, 11, 11,  7, 11,  5,  5, 10,  4, 11, 17,  7, 11,   # e0
+    5, 10, 10,  4, 11, 11,  7, 11,  5,  5, 10,  4, 11, 17,  7, 11,   # f0
+])
+
+# Extra cycles of conditional calls and returns whose condition holds.
+TAKEN_CYCLES = 6
+
+# Cycle count of the next event when none is scheduled.
+NEVER = sys.maxsize
+
+# Opcodes of ei, which enables interrupts only after the next instruction, and
+# of rst 0, to which the interrupt vector number is added.
+EI = 0xfb
+RST = 0xc7
+
+# Sizes of the memory areas CPU.restore() compares with a snapshot. It compares
+# regions first and then the pages of the regions that differ.
+REGION_SIZE = 0x1000
+PAGE_SIZE = 0x100
+
+# First line of snapshot files.
+SNAPSHOT_MAGIC = b'sim80 snapshot 1\n'
+
+
+# The opcode handlers are generated from the dis80 instruction table. For each
+# opcode, handler_lines() returns the lines of Python code of the handler body,
+# which are then compiled all at once. This way each handler runs straight-line
+# code specialized for its registers rather than dispatching on the operands at
+# run time. A handler takes the CPU, its memory, and the address following the
+# opcode, and returns the address of the next instruction. Keeping the program
+# counter in a local variable of the dispatch loop saves two attribute accesses
+# per instruction.
+
+# Python expressions of the 8-bit registers. Register m is the memory cell HL
+# points to.
+REGISTERS = {'b': 'cpu.b', 'c': 'cpu.c', 'd': 'cpu.d', 'e': 'cpu.e',
+             'h': 'cpu.h', 'l': 'cpu.l', 'a': 'cpu.a', 'm': 'memory[cpu.h << 8 | cpu.l]'}
+
+# Register pairs as (high, low) register names.
+PAIRS = {'b': ('b', 'c'), 'd': ('d', 'e'), 'h': ('h', 'l'), 'psw': ('a', 'f')}
+
+# Python expressions of the conditions of jumps, calls, and returns.
+CONDITIONS = {'nz': 'not cpu.f & ZERO', 'z': 'cpu.f & ZERO',
+              'nc': 'not cpu.f & CARRY', 'c': 'cpu.f & CARRY',
+              'po': 'not cpu.f & PARITY', 'pe': 'cpu.f & PARITY',
+              'p': 'not cpu.f & SIGN', 'm': 'cpu.f & SIGN'}
+
+# Lines of code of the register ALU instructions, with {0} standing for the
+# operand. They look the results and flags up in the alu80 tables rather than
+# calling functions, as the ALU instructions are among the most frequent.
+ALU_OPERATIONS = {
+    'add': ['entry = ADD[cpu.a << 8 | {0}]', 'cpu.a = entry >> 8', 'cpu.f = entry & 0xff'],
+    'adc': ['entry = ADD[(cpu.f & CARRY) << 16 | cpu.a << 8 | {0}]',
+            'cpu.a = entry >> 8', 'cpu.f = entry & 0xff'],
+    'sub': ['entry = SUB[cpu.a << 8 | {0}]', 'cpu.a = entry >> 8', 'cpu.f = entry & 0xff'],
+    'sbb': ['entry = SUB[(cpu.f & CARRY) << 16 | cpu.a << 8 | {0}]',
+            'cpu.a = entry >> 8', 'cpu.f = entry & 0xff'],
+    'ana': ['cpu.f = SZP[cpu.a & {0}] | ((cpu.a | {0}) & 0x08) << 1', 'cpu.a &= {0}'],
+    'xra': ['cpu.a ^= {0}', 'cpu.f = SZP[cpu.a]'],
+    'ora': ['cpu.a |= {0}', 'cpu.f = SZP[cpu.a]'],
+    'cmp': ['cpu.f = SUB[cpu.a << 8 | {0}] & 0xff'],
+}
+
+# Immediate ALU instructions and the register instructions they share the code of.
+ALU_IMMEDIATES = {'adi': 'add', 'aci': 'adc', 'sui': 'sub', 'sbi': 'sbb',
+                  'ani': 'ana', 'xri': 'xra', 'ori': 'ora', 'cpi': 'cmp'}
+ALU_OPERATIONS.update({immediate: ALU_OPERATIONS[name] for immediate, name in ALU_IMMEDIATES.items()})
+
+
+class Halt(Exception):
+    """Raised by the hlt instruction to stop the dispatch loop."""
+
+
+def store(address, value, translated=False):
+    """Return the lines of code storing value at address.
+
+    In translated blocks, a store to an address holding translated code also
+    invalidates the blocks holding the address and sets modified, so that the
+    block can end before running code that may be stale."""
+    if not translated:
+        return [f'memory[{address}] = {value}']
+    lines = [] if address == 'address' else [f'address = {address}']
+    return lines + ['memory[address] = ' + value,
+                    'if code_map[address]:', '    cpu.invalidate(address)', '    modified = True']
+
+
+def read8(operand=None):
+    """Return the lines fetching an 8-bit immediate operand and the expression of its value.
+
+    If the operand is known, as in translated blocks, there are no lines and
+    the expression is a constant."""
+    if operand is not None:
+        return [], f'{operand:#04x}'
+    return ['value = memory[pc]', 'pc = pc + 1 & 0xffff'], 'value'
+
+
+def read16(operand=None):
+    """Return the lines fetching a 16-bit immediate operand and the expression of its value.
+
+    If the operand is known, as in translated blocks, there are no lines and
+    the expression is a constant."""
+    if operand is not None:
+        return [], f'{operand:#06x}'
+    return ['value = memory[pc] | memory[pc + 1 & 0xffff] << 8', 'pc = pc + 2 & 0xffff'], 'value'
+
+
+def get_pair(pair):
+    """Return the expression of the value of a register pair."""
+    if pair == 'sp':
+        return 'cpu.sp'
+    high, low = PAIRS[pair]
+    return f'(cpu.{high} << 8 | cpu.{low})'
+
+
+def set_pair(pair, value):
+    """Return the lines setting a register pair to value, a variable or constant."""
+    if pair == 'sp':
+        return [f'cpu.sp = {value}']
+    high, low = PAIRS[pair]
+    return [f'cpu.{high} = {value} >> 8', f'cpu.{low} = {value} & 0xff']
+
+
+def step_pair(pair, step):
+    """Return the lines incrementing or decrementing a register pair, step being + or -.
+
+    The high register changes only when the low one wraps around."""
+    if pair == 'sp':
+        return [f'cpu.sp = cpu.sp {step} 1 & 0xffff']
+    high, low = PAIRS[pair]
+    if step == '+':
+        return [f'cpu.{low} = cpu.{low} + 1 & 0xff', f'if not cpu.{low}:',
+                f'    cpu.{high} = cpu.{high} + 1 & 0xff']
+    return [f'if not cpu.{low}:', f'    cpu.{high} = cpu.{high} - 1 & 0xff',
+            f'cpu.{low} = cpu.{low} - 1 & 0xff']
+
+
+def push(value, translated=False):
+    """Return the lines pushing a 16-bit value on the stack."""
+    return (['stack = cpu.sp - 2 & 0xffff', f'pushed = {value}']
+            + store('stack', 'pushed & 0xff', translated)
+            + store('stack + 1 & 0xffff', 'pushed >> 8', translated)
+            + ['cpu.sp = stack'])
+
+
+def pop(target):
+    """Return the lines popping a 16-bit value from the stack into target."""
+    return ['stack = cpu.sp', f'{target} = memory[stack] | memory[stack + 1 & 0xffff] << 8',
+            'cpu.sp = stack + 2 & 0xffff']
+
+
+def handler_lines(opcode, operand=None, translated=False):
+    """Return the lines of code of opcode, except the final return.
+
+    The lines of the handlers fetch the operand from memory. The lines of
+    translated blocks take the operand value and check stores into code."""
+    mnemonic = dis80.instructions[opcode][dis80.MNEMONIC]
+    name, *registers = mnemonic.replace(',', ' ').split()
+    register = registers[0] if registers else ''
+    condition = CONDITIONS.get(name[1:]) if name[0] in 'jcr' else None
+
+    if name == 'nop':
+        return []
+    if name == 'hlt':
+        return ['cpu.pc = pc', 'cpu.halted = True', 'raise Halt']
+    if name == 'mov':
+        source = REGISTERS[registers[1]]
+        if register == 'm':
+            return store('cpu.h << 8 | cpu.l', source, translated)
+        return [f'{REGISTERS[register]} = {source}']
+    if name == 'mvi':
+        lines, value = read8(operand)
+        if register == 'm':
+            return lines + store('cpu.h << 8 | cpu.l', value, translated)
+        return lines + [f'{REGISTERS[register]} = {value}']
+    if name in ('inr', 'dcr'):
+        step = '+' if name == 'inr' else '-'
+        flags = f'cpu.f = {name.upper()}_FLAGS[{{}}] | cpu.f & CARRY'
+        if register == 'm':
+            return (['address = cpu.h << 8 | cpu.l', f'value = memory[address] {step} 1 & 0xff',
+                     flags.format('value')] + store('address', 'value', translated))
+        target = REGISTERS[register]
+        return [f'{target} = {target} {step} 1 & 0xff', flags.format(target)]
+    if name in ALU_OPERATIONS:
+        if register == 'm':
+            lines = ['value = ' + REGISTERS[register]]
+            argument = 'value'
+        elif registers:
+            lines = []
+            argument = REGISTERS[register]
+        else:
+            lines, argument = read8(operand)
+        return lines + [line.format(argument) for line in ALU_OPERATIONS[name]]
+    if name == 'lxi':
+        lines, value = read16(operand)
+        return lines + set_pair(register, value)
+    if name == 'inx':
+        return step_pair(register, '+')
+    if name == 'dcx':
+        return step_pair(register, '-')
+    if name == 'dad':
+        return [f'result = (cpu.h << 8 | cpu.l) + {get_pair(register)}',
+                'cpu.f = cpu.f & ~CARRY | result >> 16',
+                'cpu.h = result >> 8 & 0xff', 'cpu.l = result & 0xff']
+    if name == 'stax':
+        return store(get_pair(register), 'cpu.a', translated)
+    if name == 'ldax':
+        return [f'cpu.a = memory[{get_pair(register)}]']
+    if name in ('sta', 'lda', 'shld', 'lhld', 'jmp', 'call') or condition and name[0] in 'jc':
+        lines, value = read16(operand)
+    if name == 'sta':
+        return lines + store(value, 'cpu.a', translated)
+    if name == 'lda':
+        return lines + [f'cpu.a = memory[{value}]']
+    if name == 'shld':
+        return (lines + store(value, 'cpu.l', translated)
+                + store(f'{value} + 1 & 0xffff', 'cpu.h', translated))
+    if name == 'lhld':
+        return lines + [f'cpu.l = memory[{value}]', f'cpu.h = memory[{value} + 1 & 0xffff]']
+    if name == 'rlc':
+        return ['old = cpu.a', 'cpu.a = (old << 1 | old >> 7) & 0xff',
+                'cpu.f = cpu.f & ~CARRY | old >> 7']
+    if name == 'rrc':
+        return ['old = cpu.a', 'cpu.a = (old >> 1 | old << 7) & 0xff',
+                'cpu.f = cpu.f & ~CARRY | old & CARRY']
+    if name == 'ral':
+        return ['old = cpu.a', 'cpu.a = (old << 1 | cpu.f & CARRY) & 0xff',
+                'cpu.f = cpu.f & ~CARRY | old >> 7']
+    if name == 'rar':
+        return ['old = cpu.a', 'cpu.a = old >> 1 | (cpu.f & CARRY) << 7',
+                'cpu.f = cpu.f & ~CARRY | old & CARRY']
+    if name == 'daa':
+        return ['entry = DAA[(cpu.f & (AUX_CARRY | CARRY)) << 8 | cpu.a]',
+                'cpu.a = entry >> 8', 'cpu.f = entry & 0xff']
+    if name == 'cma':
+        return ['cpu.a ^= 0xff']
+    if name == 'stc':
+        return ['cpu.f |= CARRY']
+    if name == 'cmc':
+        return ['cpu.f ^= CARRY']
+    if name == 'jmp':
+        return lines + [f'pc = {value}']
+    if name == 'call':
+        return lines + push('pc', translated) + [f'pc = {value}']
+    if name == 'ret':
+        return pop('pc')
+    if name == 'rst':
+        return push('pc', translated) + [f'pc = {int(register) * 8:#04x}']
+    if condition and name[0] == 'j':
+        return lines + [f'if {condition}:', f'    pc = {value}']
+    if condition and name[0] == 'c':
+        return (lines + [f'if {condition}:', '    cpu.cycles += TAKEN_CYCLES']
+                + ['    ' + line for line in push('pc', translated) + [f'pc = {value}']])
+    if condition and name[0] == 'r':
+        return ([f'if {condition}:', '    cpu.cycles += TAKEN_CYCLES']
+                + ['    ' + line for line in pop('pc')])
+    if name == 'push':
+        if register == 'psw':
+            return push('cpu.a << 8 | cpu.f & PSW_FLAGS | PSW_ALWAYS_SET', translated)
+        return push(get_pair(register), translated)
+    if name == 'pop':
+        if register == 'psw':
+            return pop('value') + ['cpu.a = value >> 8', 'cpu.f = value & PSW_FLAGS']
+        return pop('value') + set_pair(register, 'value')
+    if name == 'xthl':
+        return (['stack = cpu.sp', 'low = memory[stack]', 'high = memory[stack + 1 & 0xffff]']
+                + store('stack', 'cpu.l', translated)
+                + store('stack + 1 & 0xffff', 'cpu.h', translated)
+                + ['cpu.h = high', 'cpu.l = low'])
+    if name == 'xchg':
+        return ['cpu.d, cpu.e, cpu.h, cpu.l = cpu.h, cpu.l, cpu.d, cpu.e']
+    if name == 'sphl':
+        return ['cpu.sp = cpu.h << 8 | cpu.l']
+    if name == 'pchl':
+        return ['pc = cpu.h << 8 | cpu.l']
+    if name == 'di':
+        return ['cpu.interrupts_enabled = False']
+    if name == 'ei':
+        return ['cpu.interrupts_enabled = True']
+    if name in ('in', 'out'):
+        lines, value = read8(operand)
+    if name == 'in':
+        return lines + [f'cpu.a = cpu.port_in({value}) & 0xff']
+    if name == 'out':
+        return lines + [f'cpu.port_out({value}, cpu.a)']
+    raise ValueError(f'no handler for opcode {opcode:02x}')
+
+
+def code_namespace():
+    """Return the global namespace of the generated code, including the alu80 tables."""
+    namespace = {name: value for name, value in vars(alu80).items() if name.isupper()}
+    namespace.update((name, value) for name, value in globals().items()
+                     if name.isupper() or name == 'Halt')
+    return namespace
+
+
+def compile_handlers(translated=False):
+    """Return the list of the opcode handlers, indexed by opcode.
+
+    If translated is true, the handlers check stores into translated code like
+    the translated blocks do."""
+    source = []
+    for opcode in range(len(dis80.instructions)):
+        lines = handler_lines(opcode, translated=translated)
+        if any('code_map' in line for line in lines):
+            lines = ['code_map = cpu.code_map'] + lines
+        source.append(f'def op_{opcode:02x}(cpu, memory, pc):')
+        source.extend('    ' + line for line in lines + ['return pc'])
+
+    namespace = code_namespace()
+    exec(compile('\n'.join(source), '<sim80 handlers>', 'exec'), namespace)
+    return [namespace[f'op_{opcode:02x}'] for opcode in range(len(dis80.instructions))]
+
+
+# Opcode handlers indexed by opcode.
+HANDLERS = compile_handlers()
+
+# Opcode handlers checking stores into translated code, for stepping through
+# instructions without discarding the translated blocks.
+CHECKED_HANDLERS = compile_handlers(translated=True)
+
+# The block engine translates a block, i.e. a run of instructions up to a jump,
+# call, return, or restart, into a Python function executing the whole block.
+# The function is generated from the same lines of code as the handlers, but
+# with the operands as constants and the registers the block uses held in local
+# variables. The conditional jumps, calls, and returns leave the block only when
+# taken, a block goes on with the code a jmp targets, and a block ending with a
+# jump to its start loops within the function. A block function takes the CPU,
+# its memory, and the maximum number of instructions to execute, and returns
+# the address of the next instruction and the number of instructions executed.
+
+# Conditional jumps, calls, and returns, which leave a block when taken.
+SIDE_EXITS = {opcode for opcode in dis80.BRANCHES | dis80.CONDITIONAL_RETURNS
+              if dis80.instructions[opcode][dis80.MNEMONIC][1:] in CONDITIONS}
+
+# Opcodes ending a block.
+BLOCK_ENDS = (dis80.BRANCHES | dis80.RESTARTS | dis80.STOPS | dis80.CONDITIONAL_RETURNS) - SIDE_EXITS
+
+# Jumps, which make a block a loop when they target its start, and the
+# unconditional ones, whose targets the block goes on with.
+JUMPS = {opcode for opcode in dis80.BRANCHES if dis80.instructions[opcode][dis80.MNEMONIC][0] == 'j'}
+FOLLOWED = {opcode for opcode in JUMPS if opcode in BLOCK_ENDS}
+
+# Opcodes left to their handlers rather than translated. hlt stops the
+# dispatch loop, and the port methods of in and out may access the registers.
+UNTRANSLATED = {opcode for opcode, (mnemonic, size) in enumerate(dis80.instructions)
+                if mnemonic.split()[0] in ('hlt', 'in', 'out')}
+
+# Maximum number of instructions of a block.
+BLOCK_LIMIT = 64
+
+# Registers the block functions hold in local variables, in the order they're loaded.
+CACHED_REGISTERS = ('a', 'b', 'c', 'd', 'e', 'h', 'l', 'f', 'sp')
+REGISTER_PATTERN = re.compile(r'\bcpu\.(a|b|c|d|e|h|l|f|sp)\b')
+
+# Targets of an assignment, e.g. 'cpu.a, cpu.f' in 'cpu.a, cpu.f = ...'.
+ASSIGNMENT_PATTERN = re.compile(r'^\s*([\w., ]+?)\s*[-+|&^]?= ')
+
+# Placeholder for the lines of a block function storing the registers held in
+# local variables back into the CPU before returning.
+EPILOGUE = '# epilogue'
+
+
+def indented(lines):
+    """Return the lines indented by one level."""
+    return ['    ' + line for line in lines]
+
+
+def translate(memory, start, handlers):
+    """Translate the block at start into a Python function.
+
+    Return the function, the number of instructions, and the segments of the
+    block, i.e. the runs of consecutive instructions it executes in order, as
+    (address, instructions, size) tuples. A segment ends at a jmp the block
+    follows. An instruction not to be translated, or whose handler in handlers
+    has been replaced, ends the block. If it's the first of the block, the
+    function runs its handler.
+
+    A block doesn't end right after an ei, as the events are serviced between
+    blocks and ei takes effect after the following instruction. If that
+    instruction isn't translated, the function ends by running its handler.
+
+    A taken conditional jump, call, or return leaves the block, and so does
+    an instruction storing into translated code, which may be the code of the
+    block itself, as the code that follows may have changed. The function
+    then returns fewer instructions than the block holds. A block ending with
+    a jump to its start runs another pass of its instructions as long as they
+    fit the limit and no event is due, and may return more."""
+    instructions = []
+    segments = []
+    # The addresses of the bytes of the instructions so far.
+    covered = set()
+    segment = address = start
+    segment_count = 0
+    opcode = None
+    tail = None
+    while len(instructions) < BLOCK_LIMIT or opcode == EI:
+        previous = opcode
+        opcode = memory[address]
+        if address in covered and previous != EI:
+            break
+        if opcode in UNTRANSLATED or handlers[opcode] is not HANDLERS[opcode]:
+            if previous == EI:
+                tail = opcode
+            break
+        size = dis80.SIZES[opcode]
+        operand = None
+        if size > 1:
+            operand = memory[address + 1 & 0xffff]
+        if size > 2:
+            operand |= memory[address + 2 & 0xffff] << 8
+        covered.update(address + offset & 0xffff for offset in range(size))
+        address = address + size & 0xffff
+        instructions.append((opcode, operand, address))
+        segment_count += 1
+        if opcode in JUMPS and operand == start:
+            break
+        if opcode in FOLLOWED and operand not in covered:
+            segments.append((segment, segment_count, address - segment & 0xffff))
+            segment = address = operand
+            segment_count = 0
+        elif opcode in BLOCK_ENDS:
+            break
+
+    namespace = code_namespace()
+    if not instructions:
+        opcode = memory[start]
+        namespace['handler'] = handlers[opcode]
+        source = ['def block(cpu, memory, budget):',
+                  f'    cpu.cycles += {CYCLES[opcode]}',
+                  f'    return handler(cpu, memory, {start + 1 & 0xffff:#06x}), 1']
+        exec(compile('\n'.join(source), f'<sim80 block {start:04x}>', 'exec'), namespace)
+        return namespace['block'], 1, ((start, 1, 1),)
+
+    opcode, operand, following = instructions[-1]
+    loop = opcode in JUMPS and operand == start
+    ended = opcode in BLOCK_ENDS and not (opcode in FOLLOWED and following != address)
+    # Instructions and cycles of a whole pass of a loop.
+    pass_count = len(instructions)
+    pass_cycles = sum(CYCLES[opcode] for opcode, operand, following in instructions)
+    lines = []
+    cycles = 0
+    count = 0
+
+    def exit_lines(pc):
+        """Return the lines leaving the block after the instructions so far, with pc next."""
+        if loop:
+            # The passes run so far are passes - left.
+            return [f'cpu.cycles += (passes - left) * {pass_cycles} + {cycles}', EPILOGUE,
+                    f'return {pc}, (passes - left) * {pass_count} + {count}']
+        return [f'cpu.cycles += {cycles}', EPILOGUE, f'return {pc}, {count}']
+
+    for opcode, operand, following in instructions:
+        count += 1
+        cycles += CYCLES[opcode]
+        condition = None
+        if opcode in SIDE_EXITS:
+            condition = CONDITIONS[dis80.instructions[opcode][dis80.MNEMONIC][1:]]
+        if count == pass_count and loop:
+            if condition:
+                # The loop ends if the jump back isn't taken.
+                negated = condition[4:] if condition.startswith('not ') else 'not ' + condition
+                lines.append(f'if {negated}:')
+                lines.extend(indented(exit_lines(f'{following:#06x}')))
+        elif count == pass_count and ended:
+            # The jumps, calls, and returns set pc from the address following them.
+            lines.append(f'pc = {following:#06x}')
+            lines.extend(handler_lines(opcode, operand, translated=True))
+            lines.extend(exit_lines('pc'))
+        elif opcode in FOLLOWED:
+            pass
+        elif condition and opcode in JUMPS:
+            lines.append(f'if {condition}:')
+            lines.extend(indented(exit_lines(f'{operand:#06x}')))
+        elif condition:
+            # A conditional call or return leaves the block if it changes pc.
+            lines.append(f'pc = {following:#06x}')
+            lines.extend(handler_lines(opcode, operand, translated=True))
+            lines.append(f'if pc != {following:#06x}:')
+            lines.extend(indented(exit_lines('pc')))
+        else:
+            instruction = handler_lines(opcode, operand, translated=True)
+            stores = sum(line.strip() == 'modified = True' for line in instruction)
+            if stores == 1 and instruction[-1].strip() == 'modified = True':
+                # The store is the last line, so the block can leave right there.
+                lines.extend(instruction[:-1])
+                lines.extend(indented(exit_lines(f'{following:#06x}')))
+            else:
+                lines.extend(instruction)
+                if stores:
+                    lines.append('if modified:')
+                    lines.extend(indented(exit_lines(f'{following:#06x}')))
+
+    if loop:
+        lines.extend(['left -= 1', 'if not left:',
+                      f'    cpu.cycles += passes * {pass_cycles}', '    ' + EPILOGUE,
+                      f'    return {start:#06x}, passes * {pass_count}'])
+    elif tail is not None:
+        # The handler of the tail instruction accesses the registers in the CPU.
+        namespace['handler'] = handlers[tail]
+        cycles += CYCLES[tail]
+        count += 1
+        segment_count += 1
+        lines.extend([f'cpu.cycles += {cycles}', EPILOGUE,
+                      f'return handler(cpu, memory, {address + 1 & 0xffff:#06x}), {count}'])
+        address = address + dis80.SIZES[tail] & 0xffff
+    elif not ended:
+        lines.extend(exit_lines(f'{address:#06x}'))
+    if segment_count:
+        segments.append((segment, segment_count, address - segment & 0xffff or MEMORY_SIZE))
+
+    used = set()
+    for line in lines:
+        used.update(REGISTER_PATTERN.findall(line))
+    registers = [register for register in CACHED_REGISTERS if register in used]
+    prologue = [f'{register} = cpu.{register}' for register in registers]
+    if any('code_map' in line for line in lines):
+        prologue.append('code_map = cpu.code_map')
+    if any('modified' in line for line in lines):
+        prologue.append('modified = False')
+    # The registers stored back are the ones assigned before the return, or
+    # in any pass of a loop.
+    assigned = set()
+    for line in lines if loop else ():
+        match = ASSIGNMENT_PATTERN.match(line)
+        if match:
+            assigned.update(REGISTER_PATTERN.findall(match.group(1)))
+    body = []
+    for line in lines:
+        match = ASSIGNMENT_PATTERN.match(line)
+        if match:
+            assigned.update(REGISTER_PATTERN.findall(match.group(1)))
+        if line.strip() == EPILOGUE:
+            indent = line[:line.index(EPILOGUE)]
+            body.extend(f'{indent}cpu.{register} = {register}'
+                        for register in registers if register in assigned)
+        else:
+            body.append(REGISTER_PATTERN.sub(r'\1', line))
+    if loop:
+        # The passes that fit the limit, and run before an event is due, at least one.
+        prologue.extend([f'passes = budget // {pass_count}',
+                         f'events = (cpu.next_event - cpu.cycles + {pass_cycles - 1}) // {pass_cycles}',
+                         'if events < passes:', '    passes = events',
+                         'if passes < 1:', '    passes = 1',
+                         'left = passes', 'while True:'])
+        body = indented(body)
+    source = ['def block(cpu, memory, budget):'] + indented(prologue + body)
+
+    exec(compile('\n'.join(source), f'<sim80 block {start:04x}>', 'exec'), namespace)
+    return namespace['block'], count, tuple(segments)
+
+
+def block_addresses(block):
+    """Return the set of the addresses of the bytes of the segments of block."""
+    function, count, segments = block
+    return {address + offset & 0xffff for address, instructions, size in segments
+            for offset in range(size)}
+
+
+def dirty_pages(memory, saved):
+    """Return the start addresses of the pages of memory that differ from saved."""
+    if memory == saved:
+        return []
+    pages = []
+    for region in range(0, MEMORY_SIZE, REGION_SIZE):
+        end = region + REGION_SIZE
+        if memory[region:end] != saved[region:end]:
+            pages.extend(page for page in range(region, end, PAGE_SIZE)
+                         if memory[page:page + PAGE_SIZE] != saved[page:page + PAGE_SIZE])
+    return pages
+
+
+class Snapshot:
+    """The state of a CPU and a copy of its memory.
+
+    state is a dictionary of the values of the attributes listed in the
+    SNAPSHOT_FIELDS of the CPU class."""
+
+    __slots__ = ('state', 'memory')
+
+    def __init__(self, state, memory):
+        self.state = state
+        self.memory = memory
+
+
+def save_snapshot(snapshot, filename):
+    """Save snapshot to filename.
+
+    The file holds a magic line, a line with the state in JSON, and the
+    memory compressed with zlib."""
+    with open(filename, 'wb') as file:
+        file.write(SNAPSHOT_MAGIC)
+        file.write(json.dumps(snapshot.state).encode('ascii') + b'\n')
+        file.write(zlib.compress(snapshot.memory))
+
+
+def load_snapshot(filename):
+    """Load a snapshot from filename and return it."""
+    with open(filename, 'rb') as file:
+        if file.readline() != SNAPSHOT_MAGIC:
+            raise ValueError(f'{filename} isn\'t a sim80 snapshot')
+        try:
+            state = json.loads(file.readline())
+            memory = zlib.decompress(file.read())
+        except (ValueError, zlib.error) as error:
+            raise ValueError(f'corrupted snapshot {filename}: {error}')
+    if not isinstance(state, dict):
+        raise ValueError(f'corrupted snapshot {filename}: no CPU state')
+    if len(memory) != MEMORY_SIZE:
+        raise ValueError(f'corrupted snapshot {filename}: {len(memory)} bytes of memory')
+    return Snapshot(state, memory)
+
+
+class Device:
+    """An I/O device attached to ports of a CPU.
+
+    Subclasses override read() and write() for the ports they handle. A device
+    may keep the CPU to schedule events and request interrupts."""
+
+    def read(self, port):
+        """Return the value read from port. There's nothing to read by default."""
+        return 0xff
+
+    def write(self, port, value):
+        """Write value to port. Writes are ignored by default."""
+
+
+# Handler of the ports no device is attached to.
+NO_DEVICE = Device()
+
+
+class CPU:
+    """An Intel 8080 CPU with its memory."""
+
+    __slots__ = ('a', 'b', 'c', 'd', 'e', 'h', 'l', 'f', 'sp', 'pc',
+                 'memory', 'cycles', 'halted', 'interrupts_enabled', 'handlers',
+                 'blocks', 'code_map', 'block_map', 'input_ports', 'output_ports',
+                 'devices', 'events', 'event_sequence', 'next_event', 'interrupt_request')
+
+    # Attributes saved in snapshots along with the memory.
+    SNAPSHOT_FIELDS = ('a', 'b', 'c', 'd', 'e', 'h', 'l', 'f', 'sp', 'pc',
+                       'cycles', 'halted', 'interrupts_enabled')
+
+    def __init__(self):
+        self.a = self.b = self.c = self.d = self.e = self.h = self.l = 0
+        self.f = 0
+        self.sp = 0
+        self.pc = 0
+        self.memory = bytearray(MEMORY_SIZE)
+        self.cycles = 0
+        self.halted = False
+        self.interrupts_enabled = False
+        # The handler table may be replaced with a modified copy to trap
+        # instructions, e.g. calls to an operating system.
+        self.handlers = list(HANDLERS)
+        # Translated blocks as (function, instructions, segments) tuples
+        # indexed by start address.
+        self.blocks = {}
+        # The bytes of code_map are set at the addresses holding translated
+        # code, and block_map lists the start addresses of the blocks holding
+        # each of these addresses.
+        self.code_map = bytearray(MEMORY_SIZE)
+        self.block_map = {}
+        # The port maps hold the read and write methods of the devices by port.
+        self.input_ports = [NO_DEVICE.read] * 256
+        self.output_ports = [NO_DEVICE.write] * 256
+        self.devices = []
+        # Scheduled events as a heap of (cycle, sequence, callback) entries.
+        # The dispatch loops compare the cycle count with next_event only at
+        # block boundaries, and service the events when it's reached.
+        self.events = []
+        self.event_sequence = itertools.count()
+        self.next_event = NEVER
+        # Vector number of the pending interrupt, if any.
+        self.interrupt_request = None
+
+    def load(self, data, address=ORG):
+        """Copy data to memory starting at address."""
+        if address + len(data) > MEMORY_SIZE:
+            raise ValueError(f'{len(data)} bytes don\'t fit in memory at {address:04x}h')
+        self.memory[address:address + len(data)] = data
+        self.invalidate(address, len(data))
+
+    def snapshot(self):
+        """Return a snapshot of the CPU state and memory."""
+        return Snapshot({name: getattr(self, name) for name in self.SNAPSHOT_FIELDS},
+                        bytes(self.memory))
+
+    def restore(self, snapshot):
+        """Restore the CPU state and memory saved in snapshot.
+
+        Only the memory pages that differ from the snapshot are copied, and
+        only the translated blocks holding bytes that differ are discarded, so
+        that running a program again from a snapshot doesn't need translating
+        its code again.
+
+        Raise ValueError if the state holds attributes other than those of
+        SNAPSHOT_FIELDS, as snapshot files may be corrupted or crafted."""
+        unknown = sorted(set(snapshot.state) - set(self.SNAPSHOT_FIELDS))
+        if unknown:
+            raise ValueError(f'invalid snapshot fields {", ".join(unknown)}')
+        for name, value in snapshot.state.items():
+            setattr(self, name, value)
+        memory = self.memory
+        saved = snapshot.memory
+        code_map = self.code_map
+        for page in dirty_pages(memory, saved):
+            end = page + PAGE_SIZE
+            if code_map.find(1, page, end) != -1:
+                for address in range(page, end):
+                    if code_map[address] and memory[address] != saved[address]:
+                        self.invalidate(address)
+            memory[page:end] = saved[page:end]
+
+    def port_in(self, port):
+        """Return the value read from an input port by the device attached to it."""
+        return self.input_ports[port](port)
+
+    def port_out(self, port, value):
+        """Write value to an output port through the device attached to it."""
+        self.output_ports[port](port, value)
+
+    def attach(self, device, ports):
+        """Attach device to the ports, replacing the devices attached to them."""
+        for port in ports:
+            self.input_ports[port] = device.read
+            self.output_ports[port] = device.write
+        if device not in self.devices:
+            self.devices.append(device)
+
+    def schedule(self, delay, callback):
+        """Call callback with no arguments when delay more cycles have elapsed."""
+        cycle = self.cycles + delay
+        heapq.heappush(self.events, (cycle, next(self.event_sequence), callback))
+        self.next_event = min(self.next_event, cycle)
+
+    def interrupt(self, vector):
+        """Request an interrupt executing rst vector.
+
+        The request stays pending until interrupts are enabled, and a later
+        request replaces a pending one."""
+        if not 0 <= vector <= 7:
+            raise ValueError(f'invalid interrupt vector {vector}')
+        self.interrupt_request = vector
+        self.next_event = self.cycles
+
+    def service_events(self):
+        """Call the callbacks of the events due, and accept a pending interrupt if enabled."""
+        events = self.events
+        while events and events[0][0] <= self.cycles:
+            heapq.heappop(events)[2]()
+        if self.interrupt_request is not None and self.interrupts_enabled:
+            self.accept_interrupt()
+        self.next_event = events[0][0] if events else NEVER
+        if self.interrupt_request is not None:
+            # Check again at every boundary until an ei accepts the interrupt.
+            self.next_event = self.cycles
+
+    def accept_interrupt(self):
+        """Execute the rst instruction of the pending interrupt, disabling interrupts."""
+        opcode = RST | self.interrupt_request << 3
+        self.interrupt_request = None
+        self.interrupts_enabled = False
+        self.halted = False
+        self.cycles += CYCLES[opcode]
+        sp = self.sp - 2 & 0xffff
+        self.memory[sp] = self.pc & 0xff
+        self.memory[sp + 1 & 0xffff] = self.pc >> 8
+        self.invalidate(sp)
+        self.invalidate(sp + 1 & 0xffff)
+        self.sp = sp
+        self.pc = opcode & 0x38
+
+    def wake(self):
+        """Wait in the halted state for an interrupt, and return whether one woke the CPU.
+
+        The cycle count advances to each scheduled event in turn. The CPU stays
+        halted if interrupts are disabled, or no interrupt can come."""
+        events = self.events
+        while self.halted and self.interrupts_enabled:
+            if self.interrupt_request is None:
+                if not events:
+                    break
+                self.cycles = max(self.cycles, events[0][0])
+            self.service_events()
+        return not self.halted
+
+    def translate(self, start):
+        """Translate the block at start, add it to the blocks, and return it."""
+        block = translate(self.memory, start, self.handlers)
+        self.blocks[start] = block
+        code_map = self.code_map
+        block_map = self.block_map
+        for address in block_addresses(block):
+            code_map[address] = 1
+            block_map.setdefault(address, []).append(start)
+        return block
+
+    def invalidate(self, address, size=1):
+        """Discard the translated blocks holding any of the size bytes at address."""
+        code_map = self.code_map
+        if code_map.find(1, address, address + size) == -1:
+            return
+        blocks = self.blocks
+        block_map = self.block_map
+        for written in range(address, address + size):
+            for start in block_map.pop(written, ()):
+                for covered in block_addresses(blocks.pop(start)):
+                    starts = block_map.get(covered, ())
+                    if start in starts:
+                        starts.remove(start)
+                    if not starts:
+                        block_map.pop(covered, None)
+                        code_map[covered] = 0
+            code_map[written] = 0
+
+    def discard_blocks(self):
+        """Discard all the translated blocks."""
+        if self.blocks:
+            self.blocks.clear()
+            self.block_map.clear()
+            self.code_map[:] = bytes(MEMORY_SIZE)
+
+    def step(self):
+        """Execute one instruction, service the events due, and return the address following it.
+
+        Unlike run(), step() keeps the translated blocks, as the handlers it
+        runs check stores into translated code. Replaced handlers run as they
+        are. A hlt waits for an interrupt, as in run_events(). The address
+        returned differs from pc if an interrupt was accepted after the
+        instruction."""
+        memory = self.memory
+        opcode = memory[self.pc]
+        handler = self.handlers[opcode]
+        if handler is HANDLERS[opcode]:
+            handler = CHECKED_HANDLERS[opcode]
+        self.cycles += CYCLES[opcode]
+        try:
+            self.pc = handler(self, memory, self.pc + 1 & 0xffff)
+        except Halt:
+            following = self.pc
+            self.wake()
+            return following
+        following = self.pc
+        # An ei takes effect after the following instruction.
+        if self.cycles >= self.next_event and opcode != EI:
+            self.service_events()
+        return following
+
+    def run(self, limit=None):
+        """Execute instructions until hlt or limit instructions, and return their number."""
+        if self.halted and not self.wake():
+            return 0
+        if self.devices or self.events or self.interrupt_request is not None:
+            return self.run_events(limit)
+        # The handlers don't check stores into translated code.
+        self.discard_blocks()
+        memory = self.memory
+        handlers = self.handlers
+        pc = self.pc
+        cycles = 0
+        executed = -1
+        # This is the hottest loop of the simulator, so it inlines step() and
+        # keeps the program counter and cycle count in local variables.
+        try:
+            for executed in range(sys.maxsize if limit is None else limit):
+                opcode = memory[pc]
+                cycles += CYCLES[opcode]
+                pc = handlers[opcode](self, memory, pc + 1 & 0xffff)
+        except Halt:
+            pc = self.pc
+        except BaseException:
+            # Leave the program counter at the offending instruction.
+            executed -= 1
+            raise
+        finally:
+            self.pc = pc
+            self.cycles += cycles
+        return executed + 1
+
+    def run_events(self, limit=None):
+        """Execute instructions like run(), servicing the scheduled events and interrupts.
+
+        The cycle count is kept up to date for the devices, and the events are
+        checked after each instruction. A hlt waits for an interrupt."""
+        self.discard_blocks()
+        memory = self.memory
+        handlers = self.handlers
+        pc = self.pc
+        limit = sys.maxsize if limit is None else limit
+        executed = 0
+        try:
+            while executed < limit:
+                opcode = memory[pc]
+                self.cycles += CYCLES[opcode]
+                try:
+                    pc = handlers[opcode](self, memory, pc + 1 & 0xffff)
+                except Halt:
+                    executed += 1
+                    woken = self.wake()
+                    pc = self.pc
+                    if not woken:
+                        break
+                    continue
+                executed += 1
+                # An ei takes effect after the following instruction.
+                if self.cycles >= self.next_event and opcode != EI:
+                    self.pc = pc
+                    self.service_events()
+                    pc = self.pc
+        finally:
+            self.pc = pc
+        return executed
+
+    def run_blocks(self, limit=None, on_block=None):
+        """Execute instructions until hlt or limit instructions, and return their number.
+
+        The block engine translates blocks on first execution and runs each
+        translated block with one call. The blocks go past the conditional
+        jumps, calls, and returns not taken, follow the jmp instructions, and
+        loop when they jump back to their start. This is about 3 times as fast
+        as run(), which interprets the instructions one at a time. The
+        scheduled events are serviced between blocks and passes of loops.
+
+        If supplied, on_block(start, count) is called when the first count
+        instructions of a segment of a block, starting at start, have run,
+        each time a block runs more of its instructions than before since its
+        translation, e.g. for recording coverage."""
+        if self.halted and not self.wake():
+            return 0
+        memory = self.memory
+        blocks = self.blocks
+        # The number of instructions of each block whose runs were passed to on_block.
+        announced = {}
+
+        def announce(block, count):
+            """Pass to on_block the runs of the first count instructions of block not passed yet."""
+            seen = announced.get(block, 0)
+            if count <= seen:
+                return
+            announced[block] = count
+            offset = 0
+            for address, instructions, size in block[2]:
+                if offset >= count:
+                    break
+                if offset + instructions > seen:
+                    on_block(address, min(count - offset, instructions))
+                offset += instructions
+
+        block = None
+        count = 0
+        pc = self.pc
+        limit = sys.maxsize if limit is None else limit
+        executed = 0
+        try:
+            while True:
+                try:
+                    while True:
+                        block = blocks.get(pc)
+                        if block is None:
+                            block = self.translate(pc)
+                        function, count, segments = block
+                        if executed + count > limit:
+                            break
+                        pc, done = function(self, memory, limit - executed)
+                        executed += done
+                        if on_block is not None:
+                            announce(block, min(done, count))
+                        if self.cycles >= self.next_event:
+                            self.pc = pc
+                            self.service_events()
+                            pc = self.pc
+                except Halt:
+                    # The hlt is the last instruction of the block.
+                    executed += count
+                    if on_block is not None:
+                        announce(block, count)
+                    woken = self.wake()
+                    pc = self.pc
+                    if woken:
+                        continue
+                break
+        except BaseException:
+            # The instructions up to the one raising the exception ran.
+            if on_block is not None and block is not None:
+                announce(block, count)
+            raise
+        finally:
+            self.pc = pc
+        # Step through the instructions up to the limit that don't make a whole
+        # block, keeping the translated blocks for the next run.
+        while not self.halted and executed < limit:
+            if on_block is not None:
+                on_block(self.pc, 1)
+            self.step()
+            executed += 1
+        return executed
+
+
+def load_program(filename, org=ORG):
+    """Return a CPU with the program in filename loaded at org and ready to run.
+
+    The return address on the stack is 0000h, where a hlt instruction stops the
+    CPU. This way a program ending with a ret as CP/M ones do stops too."""
+    cpu = CPU()
+    cpu.load(Path(filename).read_bytes(), org)
+    cpu.memory[0x0000] = 0x76  # hlt
+    cpu.pc = org
+    # The stack starts at the top of memory and holds the return address 0000h.
+    cpu.sp = MEMORY_SIZE - 2
+    return cpu
+
+
+def main():
+    """Parse the command line and run the program in the input file."""
+    sim80_description = f'Intel 8080 simulator / Suite8080'
+    parser = argparse.ArgumentParser(description=sim80_description)
+    parser.add_argument('filename', help='program file, or snapshot file with --snapshot')
+    parser.add_argument('--org', type=dis80.number, default=ORG,
+                        help=f'load and start address, {ORG:04x}h if not supplied')
+    parser.add_argument('--snapshot', action='store_true',
+                        help='resume from the snapshot in the input file rather than loading a program')
+    parser.add_argument('--save',
+                        help='save a snapshot of the CPU and memory to SAVE when execution stops')
+    parser.add_argument('-n', '--limit', type=int,
+                        help='maximum number of instructions to execute')
+    parser.add_argument('-i', '--interpret', action='store_true',
+                        help='interpret one instruction at a time rather than translating blocks')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='print execution statistics')
+    args = parser.parse_args()
+
+    try:
+        if args.snapshot:
+            cpu = CPU()
+            cpu.restore(load_snapshot(args.filename))
+        else:
+            cpu = load_program(args.filename, args.org)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+    start = time.perf_counter()
+    if args.interpret:
+        executed = cpu.run(args.limit)
+    else:
+        executed = cpu.run_blocks(args.limit)
+    elapsed = time.perf_counter() - start
+
+    if args.save:
+        save_snapshot(cpu.snapshot(), args.save)
+
+    if args.verbose:
+        print(f'{executed} instructions, {cpu.cycles} cycles, {elapsed:.3f} s, '
+              f'{executed / elapsed if elapsed else 0:,.0f} instructions/s', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""A test runner checking the console output of Intel 8080 programs against golden files."""
+
+import argparse
+import concurrent.futures
+import contextlib
+import difflib
+import io
+from pathlib import Path
+import re
+import sys
+import time
+from xml.etree import ElementTree
+
+from suite8080 import asm80
+from suite8080 import cpm80
+
+# Suffixes of the files holding the expected console output and the console
+# input of a test, alongside its source.
+EXPECTED_SUFFIX = '.out'
+INPUT_SUFFIX = '.in'
+
+# Default instruction budget and timeout in seconds of each test.
+LIMIT = 10000000
+TIMEOUT = 60.0
+
+# Number of instructions run between checks of the timeout.
+TIMEOUT_SLICE = 100000
+
+# Test directives in source comments, e.g. "; test80: limit 500000".
+DIRECTIVE_PATTERN = re.compile(r'^\s*;\s*test80:\s*(\w+)\s*(.*?)\s*$', re.MULTILINE)
+
+# Outcomes of the tests. A test fails if it runs and its output doesn't match,
+# and it's an error if it can't run to the end.
+PASSED = 'passed'
+FAILED = 'failed'
+ERROR = 'error'
+
+# Control characters XML 1.0 doesn't allow, such as the ESC of terminal escape
+# sequences, which the JUnit reports give as \xhh escapes.
+XML_INVALID_PATTERN = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def source_files(paths):
+    """Return the files in paths, replacing directories with the .asm files they contain."""
+    filenames = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            filenames.extend(sorted(str(child) for child in path.rglob('*')
+                                    if child.suffix.lower() == '.asm' and child.is_file()))
+        else:
+            filenames.append(str(path))
+    return filenames
+
+
+def directives(source):
+    """Return the test directives in source as a dictionary of values by name.
+
+    The directives are limit, the instruction budget, and arguments, the
+    command line arguments of the program."""
+    found = {}
+    for name, value in DIRECTIVE_PATTERN.findall(source):
+        name = name.lower()
+        if name == 'limit':
+            found[name] = int(value)
+        elif name == 'arguments':
+            found[name] = value.split()
+        else:
+            raise ValueError(f'unknown test80 directive {name}')
+    return found
+
+
+def output_diff(expected, actual):
+    """Return the unified diff of the expected and actual console output."""
+    lines = difflib.unified_diff(expected.decode('latin-1').splitlines(keepends=True),
+                                 actual.decode('latin-1').splitlines(keepends=True),
+                                 'expected', 'actual')
+    return ''.join(lines)
+
+
+def run_test(filename, limit=LIMIT, timeout=TIMEOUT, update=False):
+    """Assemble the test source in filename, run it, and check its console output.
+
+    Return a (filename, outcome, message, output, elapsed) tuple. The program
+    runs in a cpm80 environment on the directory of the source, with the
+    console input read from the .in file if any. The limit directive of the
+    source, if any, replaces limit. If update is true, the console output is
+    saved as the expected one."""
+    start = time.perf_counter()
+    path = Path(filename)
+    output = b''
+
+    def result(outcome, message=''):
+        return filename, outcome, message, output, time.perf_counter() - start
+
+    try:
+        source = path.read_text()
+        options = directives(source)
+        console_input = path.with_suffix(INPUT_SUFFIX)
+        console_input = console_input.read_bytes() if console_input.exists() else b''
+    except (OSError, ValueError) as error:
+        return result(ERROR, str(error))
+    limit = options.get('limit', limit)
+
+    # asm80 reports errors by printing them and exiting.
+    errors = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(errors):
+            asm80.assemble(source.splitlines())
+    except SystemExit:
+        return result(ERROR, 'assembly failed: ' + errors.getvalue().strip())
+
+    console_out = io.BytesIO()
+    cpu = cpm80.CPM(path.parent, io.BytesIO(console_input), console_out)
+    deadline = start + timeout
+    executed = 0
+    failure = None
+    try:
+        cpu.load_command(asm80.output, options.get('arguments', ()))
+        while not cpu.halted and executed < limit and time.perf_counter() < deadline:
+            executed += cpu.run_blocks(min(TIMEOUT_SLICE, limit - executed))
+    except (OSError, ValueError) as error:
+        failure = f'{cpu.pc:04x}: {error}'
+    finally:
+        cpu.flush()
+        cpu.close_files()
+        output = console_out.getvalue()
+
+    if failure:
+        return result(ERROR, failure)
+    if not cpu.halted:
+        if executed >= limit:
+            return result(FAILED, f'instruction limit {limit} reached at {cpu.pc:04x}')
+        return result(FAILED, f'timed out after {timeout:g} s at {cpu.pc:04x}')
+
+    expected_file = path.with_suffix(EXPECTED_SUFFIX)
+    try:
+        if update:
+            expected_file.write_bytes(output)
+            return result(PASSED)
+        expected = expected_file.read_bytes()
+    except OSError as error:
+        return result(ERROR, str(error))
+    if output != expected:
+        return result(FAILED, 'console output mismatch\n' + output_diff(expected, output))
+    return result(PASSED)
+
+
+def run_tests(filenames, jobs=None, limit=LIMIT, timeout=TIMEOUT, update=False):
+    """Run the tests in parallel and return their results in order.
+
+    The tests are distributed among jobs processes, as many as the CPUs if jobs
+    is None. Each process has its own copy of the asm80 global state."""
+    count = len(filenames)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(run_test, filenames, [limit] * count, [timeout] * count,
+                                 [update] * count))
+
+
+def xml_text(text):
+    """Return text with the characters XML doesn't allow replaced by \\xhh escapes."""
+    return XML_INVALID_PATTERN.sub(lambda match: f'\\x{ord(match.group()):02x}', text)
+
+
+def write_junit(filename, results, elapsed):
+    """Write the results in JUnit XML format to filename."""
+    suite = ElementTree.Element('testsuite', {
+        'name': 'test80',
+        'tests': str(len(results)),
+        'failures': str(sum(1 for result in results if result[1] == FAILED)),
+        'errors': str(sum(1 for result in results if result[1] == ERROR)),
+        'time': f'{elapsed:.3f}',
+    })
+    for test, outcome, message, output, test_elapsed in results:
+        path = Path(test)
+        case = ElementTree.SubElement(suite, 'testcase', {
+            'classname': str(path.parent), 'name': path.stem, 'time': f'{test_elapsed:.3f}'})
+        if outcome != PASSED:
+            summary, _, details = message.partition('\n')
+            element = ElementTree.SubElement(case, 'failure' if outcome == FAILED else 'error',
+                                             {'message': xml_text(summary)})
+            element.text = xml_text(details or summary)
+        if output:
+            ElementTree.SubElement(case, 'system-out').text = xml_text(output.decode('latin-1'))
+    ElementTree.ElementTree(suite).write(filename, encoding='utf-8', xml_declaration=True)
+
+
+def main():
+    """Parse the command line, run the tests, and report the results."""
+    test80_description = f'Intel 8080 program test runner / Suite8080'
+    parser = argparse.ArgumentParser(description=test80_description)
+    parser.add_argument('filename', nargs='+',
+                        help='test source file, or directory holding .asm test sources')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of parallel processes, the number of CPUs if not supplied')
+    parser.add_argument('-n', '--limit', type=int, default=LIMIT,
+                        help=f'maximum number of instructions of each test, {LIMIT} if not supplied')
+    parser.add_argument('-t', '--timeout', type=float, default=TIMEOUT,
+                        help=f'maximum run time in seconds of each test, {TIMEOUT:g} if not supplied')
+    parser.add_argument('-x', '--junit',
+                        help='file for the results in JUnit XML format')
+    parser.add_argument('-u', '--update', action='store_true',
+                        help=f'save the console output of the tests as the expected {EXPECTED_SUFFIX} files')
+    args = parser.parse_args()
+
+    filenames = source_files(args.filename)
+    if not filenames:
+        parser.error('no test sources found')
+
+    start = time.perf_counter()
+    results = run_tests(filenames, args.jobs, args.limit, args.timeout, args.update)
+    elapsed = time.perf_counter() - start
+
+    failures = 0
+    for test, outcome, message, output, test_elapsed in results:
+        if outcome != PASSED:
+            print(f'test80> {test}: {outcome}: {message}', file=sys.stderr)
+            failures += 1
+    if args.junit:
+        write_junit(args.junit, results, elapsed)
+    print(f'{len(results) - failures} of {len(results)} tests passed in {elapsed:.2f} s')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
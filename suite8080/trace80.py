@@ -0,0 +1,263 @@
+"""A compact binary execution tracer for Intel 8080 programs running on the simulator."""
+
+import argparse
+import collections
+import struct
+import sys
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+from suite8080 import cpm80
+from suite8080 import dis80
+from suite8080 import sim80
+
+# A trace record holds the state before the execution of an instruction: the
+# program counter, the opcode and the two bytes following it, the 8-bit
+# registers, and the stack pointer.
+RECORD = struct.Struct('<H11BH')
+RECORD_SIZE = RECORD.size
+REGISTERS = ('a', 'f', 'b', 'c', 'd', 'e', 'h', 'l')
+
+# Default number of records of the ring buffer, about 1 MB.
+CAPACITY = 0x10000
+
+# Default number of records printed.
+LAST = 20
+
+# Trace files start with the magic followed by the compression and a newline.
+MAGIC = b'trace80 1 '
+COMPRESSIONS = ('zlib', 'lzma', 'none')
+
+# Number of bytes read at a time from trace files.
+CHUNK_SIZE = 0x100000
+
+
+def compressor(compression):
+    """Return the compressor object of compression, or None if uncompressed."""
+    if compression == 'zlib':
+        return zlib.compressobj()
+    if compression == 'lzma':
+        if lzma is None:
+            raise ValueError('lzma compression not available')
+        return lzma.LZMACompressor()
+    if compression == 'none':
+        return None
+    raise ValueError(f'unknown compression {compression}')
+
+
+def decompressor(compression):
+    """Return the decompressor object of compression, or None if uncompressed."""
+    if compression == 'zlib':
+        return zlib.decompressobj()
+    if compression == 'lzma':
+        if lzma is None:
+            raise ValueError('lzma compression not available')
+        return lzma.LZMADecompressor()
+    if compression == 'none':
+        return None
+    raise ValueError(f'unknown compression {compression}')
+
+
+class TraceBuffer:
+    """A ring buffer of fixed-size trace records, optionally streamed to a file.
+
+    The buffer holds the last capacity records. If file is supplied, all the
+    records are also written to it, compressed, a whole buffer at a time."""
+
+    __slots__ = ('buffer', 'capacity', 'position', 'total', 'file', 'compressor')
+
+    def __init__(self, capacity=CAPACITY, file=None, compression='zlib'):
+        self.buffer = bytearray(capacity * RECORD_SIZE)
+        self.capacity = capacity
+        # Index of the next record to write.
+        self.position = 0
+        # Number of records written since the start.
+        self.total = 0
+        self.file = file
+        self.compressor = None
+        if file is not None:
+            self.compressor = compressor(compression)
+            file.write(MAGIC + compression.encode('ascii') + b'\n')
+
+    def write(self, data):
+        """Write data to the trace file, compressed if requested."""
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.file.write(data)
+
+    def wrap(self):
+        """Stream the full buffer to the trace file, if any, before it's overwritten."""
+        if self.file is not None:
+            self.write(self.buffer)
+
+    def close(self):
+        """Stream the records not written yet, and finish the trace file."""
+        if self.file is None:
+            return
+        self.write(self.buffer[:self.position * RECORD_SIZE])
+        if self.compressor is not None:
+            self.file.write(self.compressor.flush())
+        self.file = None
+
+    def records(self):
+        """Return the records in the buffer, oldest first, as tuples."""
+        split = self.position * RECORD_SIZE
+        if self.total >= self.capacity:
+            data = self.buffer[split:] + self.buffer[:split]
+        else:
+            data = self.buffer[:split]
+        return list(RECORD.iter_unpack(data))
+
+
+def trace(cpu, trace_buffer, limit=None):
+    """Run cpu until hlt or limit instructions, recording each instruction in trace_buffer.
+
+    Return the number of executed instructions. If an instruction raises an
+    exception, its record is the last in the buffer. The instructions run one
+    at a time with CPU.step(), which services the events and interrupts, and
+    an accepted interrupt shows as a jump to its vector."""
+    memory = cpu.memory
+    pack_into = RECORD.pack_into
+    buffer = trace_buffer.buffer
+    end = len(buffer)
+    offset = trace_buffer.position * RECORD_SIZE
+    executed = 0
+    limit = sys.maxsize if limit is None else limit
+    if cpu.halted and not cpu.wake():
+        limit = 0
+    try:
+        while executed < limit and not cpu.halted:
+            pc = cpu.pc
+            pack_into(buffer, offset, pc, memory[pc], memory[pc + 1 & 0xffff], memory[pc + 2 & 0xffff],
+                      cpu.a, cpu.f, cpu.b, cpu.c, cpu.d, cpu.e, cpu.h, cpu.l, cpu.sp)
+            offset += RECORD_SIZE
+            executed += 1
+            if offset == end:
+                trace_buffer.wrap()
+                offset = 0
+            cpu.step()
+    finally:
+        trace_buffer.position = offset // RECORD_SIZE
+        trace_buffer.total += executed
+    return executed
+
+
+def read_trace(file):
+    """Yield the records of the binary trace file as tuples."""
+    header = file.readline()
+    if not header.startswith(MAGIC) or not header.endswith(b'\n'):
+        raise ValueError('not a trace80 file')
+    expander = decompressor(header[len(MAGIC):-1].decode('ascii', 'replace'))
+    pending = b''
+    while True:
+        data = file.read(CHUNK_SIZE)
+        if not data:
+            break
+        if expander is not None:
+            data = expander.decompress(data)
+        pending += data
+        usable = len(pending) - len(pending) % RECORD_SIZE
+        yield from RECORD.iter_unpack(pending[:usable])
+        pending = pending[usable:]
+    if pending:
+        raise ValueError('truncated trace file')
+
+
+def format_record(record):
+    """Return the text of a record: the instruction decoded by dis80 and the registers.
+
+    The label of a symbolized address goes on a line of its own, so that the
+    registers line up."""
+    pc, opcode, low, high, *registers, sp = record
+    size = dis80.SIZES[opcode]
+    operand = low if size == 2 else low | high << 8
+    *label, instruction = dis80.format_instruction(pc, opcode, operand).rstrip().split('\n')
+    values = ' '.join(f'{name}={value:02x}' for name, value in zip(REGISTERS, registers))
+    return '\n'.join(label + [f'{instruction:<32}{values} sp={sp:04x}'])
+
+
+def write_records(file, records):
+    """Write the text of the records to file."""
+    for record in records:
+        print(format_record(record), file=file)
+
+
+def main():
+    """Parse the command line, and trace the program or print the trace in the input file."""
+    trace80_description = f'Intel 8080 execution tracer / Suite8080'
+    parser = argparse.ArgumentParser(description=trace80_description)
+    parser.add_argument('filename', help='program file, or trace file with --read')
+    parser.add_argument('arguments', nargs='*', help='command line arguments of a CP/M program')
+    parser.add_argument('-o', '--outfile',
+                        help='binary trace file recording all the executed instructions')
+    parser.add_argument('-z', '--compression', choices=COMPRESSIONS, default='zlib',
+                        help='compression of the trace file, zlib if not supplied')
+    parser.add_argument('-r', '--read', action='store_true',
+                        help='print the records of the trace file in the input file')
+    parser.add_argument('-l', '--last', type=int, default=LAST,
+                        help=f'number of last records printed, {LAST} if not supplied, 0 for all with --read')
+    parser.add_argument('--capacity', type=int, default=CAPACITY,
+                        help=f'number of records of the ring buffer, {CAPACITY} if not supplied')
+    parser.add_argument('-s', '--symbols',
+                        help='symbol table file in .sym format for symbolic operands')
+    parser.add_argument('--org', type=dis80.number, default=sim80.ORG,
+                        help=f'load and start address, {sim80.ORG:04x}h if not supplied')
+    parser.add_argument('-n', '--limit', type=int,
+                        help='maximum number of instructions to execute')
+    parser.add_argument('-c', '--cpm', action='store_true',
+                        help='run the program in the cpm80 CP/M environment')
+    parser.add_argument('-d', '--directory', default='.',
+                        help='host directory holding the files of drive A: with --cpm, the current directory if not supplied')
+    args = parser.parse_args()
+
+    if args.symbols:
+        dis80.symbol_table = dis80.read_symbol_table(args.symbols)
+
+    if args.read:
+        try:
+            with open(args.filename, 'rb') as file:
+                records = read_trace(file)
+                if args.last:
+                    records = collections.deque(records, args.last)
+                write_records(sys.stdout, records)
+        except (OSError, ValueError, zlib.error) as error:
+            print(f'trace80> {args.filename}: {error}', file=sys.stderr)
+            sys.exit(1)
+        return
+
+    if args.capacity < 1:
+        parser.error('--capacity must be positive')
+    cpu = cpm80.load_cpu(parser, args)
+    try:
+        trace_file = open(args.outfile, 'wb') if args.outfile else None
+        trace_buffer = TraceBuffer(args.capacity, trace_file, args.compression)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+    failure = None
+    try:
+        trace(cpu, trace_buffer, args.limit)
+    except ValueError as error:
+        failure = f'{cpu.pc:04x}: {error}'
+    finally:
+        if args.cpm:
+            cpu.flush()
+            cpu.close_files()
+        trace_buffer.close()
+        if trace_file is not None:
+            trace_file.close()
+
+    # The last records tell how the program got where it stopped.
+    records = trace_buffer.records()
+    write_records(sys.stdout, records[-args.last:] if args.last else records)
+    if failure:
+        print(f'trace80> {failure}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
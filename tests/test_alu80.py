@@ -0,0 +1,88 @@
+"""Tests for the suite8080.alu80 module.
+
+The tables are checked against the reference functions for all the operand values."""
+
+import itertools
+
+import pytest
+
+from suite8080 import alu80
+
+
+BYTES = range(0x100)
+FLAG_BITS = (0, alu80.CARRY, alu80.AUX_CARRY, alu80.AUX_CARRY | alu80.CARRY)
+
+
+def test_table_sizes():
+    assert len(alu80.SZP) == len(alu80.INR_FLAGS) == len(alu80.DCR_FLAGS) == 0x100
+    assert len(alu80.ADD) == len(alu80.SUB) == 0x20000
+    assert len(alu80.DAA) == 0x1200
+
+
+@pytest.mark.parametrize('value, expected', [
+    (0x00, alu80.ZERO | alu80.PARITY),
+    (0x01, 0),
+    (0x03, alu80.PARITY),
+    (0x80, alu80.SIGN),
+    (0xff, alu80.SIGN | alu80.PARITY),
+])
+def test_reference_szp(value, expected):
+    assert alu80.reference_szp(value) == expected
+
+
+@pytest.mark.parametrize('a, value, carry, expected', [
+    (0x0f, 0x01, 0, (0x10, alu80.AUX_CARRY)),
+    (0xff, 0x01, 0, (0x00, alu80.ZERO | alu80.AUX_CARRY | alu80.PARITY | alu80.CARRY)),
+    (0x7f, 0x00, 1, (0x80, alu80.SIGN | alu80.AUX_CARRY)),
+])
+def test_reference_add(a, value, carry, expected):
+    assert alu80.reference_add(a, value, carry) == expected
+
+
+@pytest.mark.parametrize('a, value, borrow, expected', [
+    (0x05, 0x05, 0, (0x00, alu80.ZERO | alu80.AUX_CARRY | alu80.PARITY)),
+    (0x00, 0x01, 0, (0xff, alu80.SIGN | alu80.PARITY | alu80.CARRY)),
+    (0x10, 0x00, 1, (0x0f, alu80.PARITY)),
+])
+def test_reference_sub(a, value, borrow, expected):
+    assert alu80.reference_sub(a, value, borrow) == expected
+
+
+def test_reference_daa():
+    # 0x9b is 0x45 + 0x56, and the decimal result is 101.
+    assert alu80.reference_daa(0x9b, 0) == (0x01, alu80.AUX_CARRY | alu80.CARRY)
+
+
+def test_szp():
+    for value in BYTES:
+        assert alu80.SZP[value] == alu80.reference_szp(value)
+
+
+@pytest.mark.parametrize('carry', [0, 1])
+def test_add(carry):
+    for a, value in itertools.product(BYTES, BYTES):
+        assert alu80.add(a, value, carry) == alu80.reference_add(a, value, carry)
+
+
+@pytest.mark.parametrize('borrow', [0, 1])
+def test_sub(borrow):
+    for a, value in itertools.product(BYTES, BYTES):
+        assert alu80.sub(a, value, borrow) == alu80.reference_sub(a, value, borrow)
+
+
+def test_logic():
+    for a, value in itertools.product(BYTES, BYTES):
+        assert alu80.ana(a, value) == alu80.reference_and(a, value)
+        assert alu80.xra(a, value) == alu80.reference_xor(a, value)
+        assert alu80.ora(a, value) == alu80.reference_or(a, value)
+
+
+def test_inr_dcr():
+    for value, flags in itertools.product(BYTES, BYTES):
+        assert alu80.inr(value, flags) == alu80.reference_inr(value, flags)
+        assert alu80.dcr(value, flags) == alu80.reference_dcr(value, flags)
+
+
+def test_daa():
+    for a, flags in itertools.product(BYTES, FLAG_BITS):
+        assert alu80.daa(a, flags) == alu80.reference_daa(a, flags)
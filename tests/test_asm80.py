@@ -114,6 +114,10 @@ def test_parse_db_arguments(string, result):
     ('mov b, c', ('', '', '')),
     ('lxi d, message', ('', '', '')),
     ('nop', ('', '', '')),
+    # Operands and labels containing the letters db
+    ('mvi a, 0dbh', ('', '', '')),
+    ('jmp L0EDB', ('', '', '')),
+    ('dbuf: ds 10', ('', '', '')),
     # Multiple decimal args
     ('label: db 0, 1, 2', ('label', 'db', '0, 1, 2')),
     # Multiple hex args
@@ -122,6 +126,8 @@ def test_parse_db_arguments(string, result):
     ('db 3, 4, 5', ('', 'db', '3, 4, 5')),
     # Single arg
     ('db 1', ('', 'db', '1')),
+    # Label containing the letters db
+    ('dbuf:db 1', ('dbuf', 'db', '1')),
 ])
 def test_parse_db(source_line, expected):
     assert asm80.parse_db(source_line) == expected
@@ -324,4 +330,55 @@ def test_write_symbol_table_long_symbol(tmp_path):
     symbols = symbol_file.read_text()
     # Symbols are truncated to 16 characters when saving to the symbol table, so
     # the full symbol 'thisisaverylongsymbol' should be missing from symbols.
-    assert not('THISISAVERYLONGSYMBOL' in symbols)
\ No newline at end of file
+    assert not('THISISAVERYLONGSYMBOL' in symbols)
+
+
+def test_assemble_references():
+    lines = ['bdos equ 5',
+             'start: lxi d, message',
+             '\tcall bdos',
+             '\tjmp start',
+             "message: db 'Hi$'",
+             '\tend']
+    asm80.assemble(lines)
+    assert asm80.references == {'message': [(2, 'pointer')],
+                                'bdos': [(3, 'call')],
+                                'start': [(4, 'jump')]}
+
+
+def test_write_cross_references(tmp_path):
+    symbol_table = {'start': 0x100, 'bdos': 5, 'unused': 0x200}
+    references = {'start': [(4, 'jump')], 'bdos': [(3, 'call'), (7, 'call')]}
+    xref_file = tmp_path / 'program.xrf'
+    assert asm80.write_cross_references(symbol_table, references, xref_file) == 3
+    assert xref_file.read_text().splitlines() == ['BDOS             0005 3:call 7:call',
+                                                  'START            0100 4:jump',
+                                                  'UNUSED           0200']
+
+
+def test_write_cross_references_empty_table():
+    assert asm80.write_cross_references({}, {}, 'program.xrf') == 0
+
+
+def test_assemble_line_map():
+    lines = ['\torg 100h',
+             'start: lxi d, message',
+             '',
+             '\tcall 5',
+             "message: db 'Hi$'",
+             'buffer: ds 2',
+             '\torg 200h',
+             '\tret',
+             '\tend']
+    asm80.assemble(lines)
+    assert asm80.line_map == [(0x100, 3, 2), (0x103, 3, 4), (0x200, 1, 8)]
+
+
+def test_write_line_map(tmp_path):
+    map_file = tmp_path / 'program.map'
+    assert asm80.write_line_map([(0x100, 3, 2), (0xabcd, 1, 10)], map_file) == 2
+    assert map_file.read_text().splitlines() == ['0100 3 2', 'ABCD 1 10']
+
+
+def test_write_line_map_empty():
+    assert asm80.write_line_map([], 'program.map') == 0
@@ -0,0 +1,176 @@
+"""Tests for the suite8080.cov80 module."""
+
+import io
+import sys
+
+import pytest
+
+from suite8080 import asm80
+from suite8080 import cov80
+from suite8080 import sim80
+
+
+SOURCE = '''
+            org     100h
+            mvi     b, 3
+loop:       call    double
+            dcr     b
+            jnz     loop
+            ora     a
+            jz      skip
+            sta     result
+skip:       ret
+double:     add     a
+            inr     a
+            ret
+result:     db      0
+'''
+
+
+def assembled_cpu():
+    """Return a CPU with the assembled SOURCE loaded and ready to run."""
+    asm80.assemble(SOURCE.splitlines())
+    cpu = sim80.CPU()
+    cpu.load(asm80.output)
+    cpu.memory[0x0000] = 0x76  # hlt
+    cpu.pc = 0x0100
+    cpu.sp = 0xf000
+    return cpu
+
+
+@pytest.mark.parametrize('limit', [None, 4, 9, 1000])
+def test_run(limit):
+    cpu = assembled_cpu()
+    bitmap = bytearray(cov80.BITMAP_SIZE)
+    executed = cov80.run(cpu, bitmap, limit)
+
+    reference = assembled_cpu()
+    addresses = set()
+    for _ in range(executed):
+        addresses.add(reference.pc)
+        reference.step()
+    assert {address for address, value in enumerate(bitmap) if value} == addresses
+    assert (cpu.pc, cpu.a, cpu.cycles) == (reference.pc, reference.a, reference.cycles)
+
+
+def test_run_self_modifying_code():
+    # The nop is overwritten with an inr a after the first loop iteration.
+    source = '''
+            org     100h
+            mvi     b, 2
+loop:       nop
+            mvi     a, 3ch
+            sta     loop
+            dcr     b
+            jnz     loop
+            hlt
+'''
+    asm80.assemble(source.splitlines())
+    cpu = sim80.CPU()
+    cpu.load(asm80.output)
+    cpu.pc = 0x0100
+    bitmap = bytearray(cov80.BITMAP_SIZE)
+    cov80.run(cpu, bitmap)
+    assert cpu.memory[0x0102] == 0x3c
+    assert bitmap[0x0100:0x010d] == bytes([1, 0, 1, 1, 0, 1, 0, 0, 1, 1, 0, 0, 1])
+
+
+def test_run_ei_delay():
+    # lxi sp, f000h / ei / hlt / mvi a, 42h / hlt, with the pending rst 1 handler inr b / ei / ret.
+    cpu = sim80.CPU()
+    cpu.load(b'\x31\x00\xf0\xfb\x76\x3e\x42\x76')
+    cpu.load(b'\x04\xfb\xc9', 0x0008)
+    cpu.pc = 0x0100
+    cpu.interrupt(1)
+    bitmap = bytearray(cov80.BITMAP_SIZE)
+    cov80.run(cpu, bitmap)
+    assert (cpu.pc, cpu.a, cpu.b) == (0x0108, 0x42, 1)
+    assert [address for address, value in enumerate(bitmap) if value] == [
+        0x0008, 0x0009, 0x000a, 0x0100, 0x0103, 0x0104, 0x0105, 0x0107]
+
+
+def test_merge_bitmaps():
+    first = bytearray(cov80.BITMAP_SIZE)
+    second = bytearray(cov80.BITMAP_SIZE)
+    first[0x0000] = first[0x0100] = 1
+    second[0x0100] = second[0xffff] = 1
+    merged = cov80.merge_bitmaps([first, second])
+    assert len(merged) == cov80.BITMAP_SIZE
+    assert [address for address, value in enumerate(merged) if value] == [0x0000, 0x0100, 0xffff]
+    assert cov80.merge_bitmaps([]) == bytes(cov80.BITMAP_SIZE)
+
+
+def test_read_bitmap(tmp_path):
+    bitmap_file = tmp_path / 'program.cov'
+    bitmap_file.write_bytes(bytes(10))
+    with pytest.raises(ValueError):
+        cov80.read_bitmap(bitmap_file)
+
+
+def test_read_line_map(tmp_path):
+    map_file = tmp_path / 'program.map'
+    asm80.write_line_map([(0x100, 3, 2), (0xabcd, 1, 10)], map_file)
+    assert cov80.read_line_map(map_file) == [(0x100, 3, 2), (0xabcd, 1, 10)]
+    map_file.write_text('0100 3\n')
+    with pytest.raises(ValueError, match='line 1'):
+        cov80.read_line_map(map_file)
+
+
+def test_reports():
+    source_lines = ['start: nop', '', '\tjmp start', '\thlt']
+    coverage = cov80.line_coverage([(0x100, 1, 1), (0x101, 3, 3), (0x104, 1, 4)],
+                                   b'\x00' * 0x100 + b'\x01\x01' + b'\x00' * (0xfefe))
+    assert coverage == {1: True, 3: True, 4: False}
+
+    text = io.StringIO()
+    cov80.write_text(text, source_lines, coverage)
+    assert text.getvalue().splitlines() == [
+        '+     1  start: nop', '      2  ', '+     3  \tjmp start', '-     4  \thlt',
+        '2 of 3 lines covered (66.7%)']
+
+    lcov = io.StringIO()
+    cov80.write_lcov(lcov, 'program.asm', coverage)
+    assert lcov.getvalue().splitlines() == [
+        'TN:', 'SF:program.asm', 'DA:1,1', 'DA:3,1', 'DA:4,0', 'LF:3', 'LH:2', 'end_of_record']
+
+    page = io.StringIO()
+    cov80.write_html(page, 'a<b>.asm', source_lines, coverage)
+    page = page.getvalue()
+    assert 'Coverage of a&lt;b&gt;.asm' in page
+    assert '<pre class="missed">    4  \thlt</pre>' in page
+    assert '<pre>    2  </pre>' in page
+
+
+def test_main(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    source_file = tmp_path / 'program.asm'
+    source_file.write_text(SOURCE)
+    monkeypatch.setattr(sys, 'argv', ['asm80', '-m', str(source_file)])
+    asm80.main()
+
+    # A whole run and one stopping at the first return from double.
+    monkeypatch.setattr(sys, 'argv', ['cov80', 'program.com'])
+    cov80.main()
+    monkeypatch.setattr(sys, 'argv', ['cov80', '-n', '7', '-o', 'short.cov', 'program.com'])
+    cov80.main()
+
+    monkeypatch.setattr(sys, 'argv', ['cov80', '-r', 'program.asm', 'short.cov',
+                                      '--lcov', 'program.info'])
+    cov80.main()
+    assert capsys.readouterr().out.splitlines()[-1] == '7 of 11 lines covered (63.6%)'
+    monkeypatch.setattr(sys, 'argv', ['cov80', '-r', 'program.asm', 'program.cov', 'short.cov',
+                                      '-o', 'merged.cov', '--html', 'program.html'])
+    cov80.main()
+    assert capsys.readouterr().out.splitlines()[-1] == '11 of 11 lines covered (100.0%)'
+    assert (tmp_path / 'merged.cov').read_bytes() == (tmp_path / 'program.cov').read_bytes()
+    assert 'DA:9,0' in (tmp_path / 'program.info').read_text()
+    assert (tmp_path / 'program.html').exists()
+
+
+def test_main_errors(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'program.asm').write_text(SOURCE)
+    monkeypatch.setattr(sys, 'argv', ['cov80', '-r', 'program.asm', 'missing.cov'])
+    with pytest.raises(SystemExit):
+        cov80.main()
+    assert capsys.readouterr().err.startswith('cov80> ')
@@ -0,0 +1,453 @@
+"""Tests for the suite8080.cpm80 module."""
+
+import argparse
+import io
+from pathlib import Path
+
+import pytest
+
+from suite8080 import asm80
+from suite8080 import cpm80
+from suite8080 import sim80
+
+
+ASM_DIR = Path(__file__).parent.parent / 'asm'
+
+
+def run_cpm(tmp_path, source, arguments=(), console_input=b''):
+    """Assemble source, run it in a CP/M environment on tmp_path, and return the environment."""
+    asm80.assemble(source.splitlines())
+    program_file = tmp_path / 'program.com'
+    program_file.write_bytes(asm80.output)
+    cpu = cpm80.CPM(tmp_path, io.BytesIO(console_input), io.BytesIO())
+    cpu.load_program(program_file, arguments)
+    cpu.run_blocks(100000)
+    cpu.flush()
+    cpu.close_files()
+    return cpu
+
+
+def test_fcb_name():
+    assert cpm80.fcb_name('file.txt') == b'FILE    TXT'
+    assert cpm80.fcb_name('b:longfilename') == b'LONGFILE   '
+    assert cpm80.fcb_name('*.c') == b'????????C  '
+    assert cpm80.fcb_name('') == b' ' * 11
+
+
+def test_host_name():
+    assert cpm80.host_name(b'FILE    TXT') == 'FILE.TXT'
+    assert cpm80.host_name(b'FILE\xa0   ') == 'FILE'
+
+
+def test_greet(tmp_path):
+    cpu = run_cpm(tmp_path, (ASM_DIR / 'greet.asm').read_text())
+    assert cpu.halted
+    assert cpu.console_out.getvalue() == b'Greetings from Suite8080'
+
+
+def test_console_io(tmp_path):
+    source = '''
+            org     100h
+            mvi     a, 8                ; Buffer size
+            sta     200h
+            mvi     c, 10               ; Read console buffer
+            lxi     d, 200h
+            call    5
+            lda     201h
+            mov     e, a
+            mvi     c, 2                ; Console output
+            call    5
+            mvi     c, 1                ; Console input
+            call    5
+            ret
+'''
+    cpu = run_cpm(tmp_path, source, console_input=b'hello\rx')
+    assert cpu.memory[0x0200:0x0207] == b'\x08\x05hello'
+    assert cpu.console_out.getvalue() == b'hello\r\n\x05x'
+    assert cpu.a == ord('x')
+
+
+def test_command_tail(tmp_path):
+    cpu = run_cpm(tmp_path, ' org 100h\n ret', ['in.txt', 'b:out.*'])
+    assert cpu.memory[0x0080:0x0080 + 17] == b'\x0f IN.TXT B:OUT.*\x00'
+    assert cpu.memory[cpm80.FCB1:cpm80.FCB1 + 12] == b'\x00IN      TXT'
+    assert cpu.memory[cpm80.FCB2:cpm80.FCB2 + 12] == b'\x02OUT     ???'
+
+
+# Copy the file named in the argument to OUT.BIN, record by record.
+COPY = '''
+            org     100h
+            lxi     d, 5ch              ; Open source
+            mvi     c, 15
+            call    5
+            inr     a
+            jz      fail
+            lxi     d, dest             ; Make destination
+            mvi     c, 22
+            call    5
+copy:       lxi     d, 5ch              ; Read sequential
+            mvi     c, 20
+            call    5
+            ora     a
+            jnz     done
+            lxi     d, dest             ; Write sequential
+            mvi     c, 21
+            call    5
+            jmp     copy
+done:       lxi     d, dest             ; Close destination
+            mvi     c, 16
+            call    5
+            ret
+fail:       mvi     c, 9
+            lxi     d, message
+            call    5
+            ret
+message:    db      'No file$'
+dest:       db      0, 'OUT     BIN', 0, 0, 0, 0
+            ds      20
+'''
+
+
+def test_copy_file(tmp_path):
+    data = bytes(range(256)) * 3
+    (tmp_path / 'IN.BIN').write_bytes(data)
+    cpu = run_cpm(tmp_path, COPY, ['in.bin'])
+    assert cpu.halted
+    assert (tmp_path / 'out.bin').read_bytes() == data
+
+
+def test_copy_file_scans_directory_once(tmp_path, monkeypatch):
+    # 130 records span two extents, whose record counts come from the cached size.
+    data = bytes(range(256)) * 65
+    (tmp_path / 'IN.BIN').write_bytes(data)
+    for index in range(20):
+        (tmp_path / f'file{index}.txt').write_bytes(b'x')
+    scans = []
+    host_path = cpm80.CPM.host_path
+    monkeypatch.setattr(cpm80.CPM, 'host_path', lambda self, fcb: scans.append(fcb) or host_path(self, fcb))
+    cpu = run_cpm(tmp_path, COPY, ['in.bin'])
+    assert cpu.halted
+    assert (tmp_path / 'out.bin').read_bytes() == data
+    # Opening the source and making the destination.
+    assert len(scans) == 2
+    assert cpu.memory[0x5c + cpm80.FCB_RECORD_COUNT] == 2
+
+
+def test_copy_text_file_padding(tmp_path):
+    (tmp_path / 'in.txt').write_bytes(b'text')
+    run_cpm(tmp_path, COPY, ['in.txt'])
+    assert (tmp_path / 'out.bin').read_bytes() == b'text' + b'\x1a' * 124
+
+
+def test_open_missing_file(tmp_path):
+    cpu = run_cpm(tmp_path, COPY, ['missing.txt'])
+    assert cpu.console_out.getvalue() == b'No file'
+    assert not (tmp_path / 'out.bin').exists()
+
+
+def test_search(tmp_path):
+    for name in ('a.txt', 'b.txt', 'c.com', 'toolongname.txt'):
+        (tmp_path / name).write_bytes(b'x')
+    source = '''
+            org     100h
+            lxi     d, 5ch
+            mvi     c, 17               ; Search first
+            call    5
+            lhld    81h
+            shld    200h
+            mvi     c, 18               ; Search next
+            call    5
+            lhld    81h
+            shld    202h
+            mvi     c, 18
+            call    5
+            sta     204h
+            ret
+'''
+    cpu = run_cpm(tmp_path, source, ['*.txt'])
+    assert cpu.memory[0x0200:0x0205] == b'A B \xff'
+
+
+def test_random_access_and_file_size(tmp_path):
+    (tmp_path / 'DATA.BIN').write_bytes(bytes(128) + b'\x42' * 128)
+    source = '''
+            org     100h
+            lxi     d, 5ch
+            mvi     c, 15               ; Open
+            call    5
+            lxi     d, 5ch
+            mvi     c, 35               ; File size
+            call    5
+            lda     7dh
+            sta     200h
+            mvi     a, 1
+            sta     7dh
+            lxi     d, 5ch
+            mvi     c, 33               ; Read random
+            call    5
+            sta     201h
+            lda     80h
+            sta     202h
+            ret
+'''
+    cpu = run_cpm(tmp_path, source, ['data.bin'])
+    assert cpu.memory[0x0200:0x0203] == b'\x02\x00\x42'
+
+
+def test_write_random_and_file_size(tmp_path):
+    # The size of a file being written counts the records not yet flushed.
+    source = '''
+            org     100h
+            lxi     d, 5ch
+            mvi     c, 22               ; Make
+            call    5
+            mvi     a, 4
+            sta     7dh
+            lxi     d, 5ch
+            mvi     c, 34               ; Write random
+            call    5
+            lxi     d, 5ch
+            mvi     c, 35               ; File size
+            call    5
+            lda     7dh
+            sta     200h
+            ret
+'''
+    cpu = run_cpm(tmp_path, source, ['data.bin'])
+    assert cpu.memory[0x0200] == 5
+    assert (tmp_path / 'data.bin').stat().st_size == 5 * 128
+
+
+def test_version_and_warm_boot(tmp_path):
+    source = '''
+            org     100h
+            mvi     c, 12
+            call    5
+            jmp     0
+'''
+    cpu = run_cpm(tmp_path, source)
+    assert cpu.halted
+    assert (cpu.h, cpu.l) == (0x00, 0x22)
+
+
+def test_unsupported_function(tmp_path):
+    with pytest.raises(ValueError, match='BDOS function 99'):
+        run_cpm(tmp_path, ' org 100h\n mvi c, 99\n call 5\n ret')
+
+
+def test_hlt_outside_entry_points(tmp_path):
+    cpu = run_cpm(tmp_path, ' org 100h\n hlt')
+    assert cpu.halted
+    assert cpu.pc == 0x0101
+
+
+def test_restore(tmp_path):
+    (tmp_path / 'IN.BIN').write_bytes(bytes(128))
+    source = '''
+            org     100h
+            lxi     d, 200h             ; Set DMA address
+            mvi     c, 26
+            call    5
+            lxi     d, 5ch              ; Open
+            mvi     c, 15
+            call    5
+            mvi     e, '!'
+            mvi     c, 2                ; Console output
+            call    5
+            ret
+'''
+    asm80.assemble(source.splitlines())
+    program_file = tmp_path / 'program.com'
+    program_file.write_bytes(asm80.output)
+    cpu = cpm80.CPM(tmp_path, io.BytesIO(), io.BytesIO())
+    cpu.load_program(program_file, ['in.bin'])
+    snapshot = cpu.snapshot()
+    for run in range(3):
+        cpu.restore(snapshot)
+        assert cpu.dma == cpm80.DEFAULT_DMA
+        assert not cpu.files
+        cpu.run_blocks(1000)
+        assert cpu.halted
+        assert cpu.dma == 0x0200
+        assert cpu.files
+    cpu.restore(snapshot)
+    assert cpu.console_out.getvalue() == b'!!!'
+
+
+# Copy logical sector 1 of track 2 of drive B: to track 3 through the BIOS,
+# calling the entries at their offsets from the warm boot entry.
+COPY_SECTOR = '''
+            org     100h
+            mvi     c, 1
+            mvi     a, 24               ; seldsk
+            call    bios
+            shld    dph
+            lxi     b, 2
+            mvi     a, 27               ; settrk
+            call    bios
+            lhld    dph                 ; Sector translation table
+            mov     e, m
+            inx     h
+            mov     d, m
+            lxi     b, 1
+            mvi     a, 45               ; sectran
+            call    bios
+            mov     b, h
+            mov     c, l
+            mvi     a, 30               ; setsec
+            call    bios
+            lxi     b, 200h
+            mvi     a, 33               ; setdma
+            call    bios
+            mvi     a, 36               ; read
+            call    bios
+            sta     read
+            lxi     b, 3
+            mvi     a, 27               ; settrk
+            call    bios
+            mvi     c, 0
+            mvi     a, 39               ; write
+            call    bios
+            sta     written
+            ret
+bios:       lhld    1
+            add     l
+            mov     l, a
+            mvi     a, 0
+            adc     h
+            mov     h, a
+            pchl
+dph:        dw      0
+read:       db      0ffh
+written:    db      0ffh
+'''
+
+
+def test_geometry():
+    geometry = cpm80.GEOMETRIES['ibm-3740']
+    assert geometry.size() == 256256
+    assert geometry.translation_table() == bytes([
+        1, 7, 13, 19, 25, 5, 11, 17, 23, 3, 9, 15, 21,
+        2, 8, 14, 20, 26, 6, 12, 18, 24, 4, 10, 16, 22])
+    assert geometry.parameter_block() == bytes([
+        26, 0, 3, 7, 0, 242, 0, 63, 0, 0xc0, 0x00, 16, 0, 2, 0])
+    assert cpm80.Geometry(10, 8).translation_table() == bytes(range(1, 9))
+    assert cpm80.GEOMETRIES['hd-4mb'].parameter_block()[2:11] == bytes([
+        5, 31, 1, 0xfb, 0x03, 0xff, 0x01, 0xf0, 0x00])
+
+
+@pytest.mark.parametrize('parameters', [
+    (77, 26, 26), (77, 26, 6, 2, 1000), (1, 4), (2000, 26, 1, 0, 1024), (77, 26, 6, 2, 1024, 1024)])
+def test_geometry_invalid(parameters):
+    with pytest.raises(ValueError):
+        cpm80.Geometry(*parameters)
+
+
+def test_mount(tmp_path):
+    geometry = cpm80.GEOMETRIES['ibm-3740']
+    other_geometry = cpm80.Geometry(40, 18, 5)
+    cpm80.create_image(tmp_path / 'a.img', geometry)
+    cpm80.create_image(tmp_path / 'b.img', geometry)
+    cpm80.create_image(tmp_path / 'c.img', other_geometry)
+    cpu = cpm80.CPM(tmp_path, io.BytesIO(), io.BytesIO())
+    cpu.mount(0, tmp_path / 'a.img')
+    cpu.mount(1, tmp_path / 'b.img')
+    cpu.mount(2, tmp_path / 'c.img', other_geometry)
+    dphs = [cpu.disks[drive].dph for drive in range(3)]
+    assert dphs[0] == cpm80.DISK_TABLES
+    assert len(set(dphs)) == 3
+    memory = cpu.memory
+    tables = [memory[dph:dph + 2] + memory[dph + 10:dph + 12] for dph in dphs]
+    # Drives with the same geometry share the parameter block and translation table.
+    assert tables[0] == tables[1] != tables[2]
+    xlt = int.from_bytes(tables[0][:2], 'little')
+    assert memory[xlt:xlt + 26] == geometry.translation_table()
+    cpu.mount(1, tmp_path / 'b.img')
+    assert cpu.disks[1].dph == dphs[1]
+    cpu.close_disks()
+    assert not cpu.disks
+
+    with pytest.raises(ValueError, match='expected'):
+        cpu.mount(0, tmp_path / 'c.img')
+    with pytest.raises(ValueError, match='invalid drive'):
+        cpu.mount(16, tmp_path / 'a.img')
+
+
+def test_bios_read_write(tmp_path):
+    geometry = cpm80.GEOMETRIES['ibm-3740']
+    image_file = tmp_path / 'b.img'
+    cpm80.create_image(image_file, geometry)
+    image = bytearray(image_file.read_bytes())
+    # Logical sector 1 is physical sector 7.
+    source_offset = (2 * 26 + 6) * 128
+    target_offset = (3 * 26 + 6) * 128
+    image[source_offset:source_offset + 128] = bytes(range(128))
+    image_file.write_bytes(image)
+
+    asm80.assemble(COPY_SECTOR.splitlines())
+    cpu = cpm80.CPM(tmp_path, io.BytesIO(), io.BytesIO())
+    cpu.mount(1, image_file)
+    cpu.load_command(asm80.output)
+    cpu.run_blocks(10000)
+    cpu.close_disks()
+    assert cpu.halted
+    assert (cpu.disk, cpu.track, cpu.sector) == (1, 3, 7)
+    assert cpu.memory[0x0200:0x0280] == bytes(range(128))
+    result = asm80.symbol_table['read']
+    assert cpu.memory[result:result + 2] == bytes([cpm80.DISK_OK, cpm80.DISK_OK])
+    image = image_file.read_bytes()
+    assert image[target_offset:target_offset + 128] == bytes(range(128))
+    assert image.count(cpm80.EMPTY) == len(image) - 2 * 128
+
+
+def test_bios_errors(tmp_path):
+    image_file = tmp_path / 'b.img'
+    cpm80.create_image(image_file, cpm80.GEOMETRIES['ibm-3740'])
+    asm80.assemble(COPY_SECTOR.splitlines())
+    cpu = cpm80.CPM(tmp_path, io.BytesIO(), io.BytesIO())
+    cpu.load_command(asm80.output)
+    cpu.run_blocks(10000)
+    dph = asm80.symbol_table['dph']
+    result = asm80.symbol_table['read']
+    # No disk is mounted.
+    assert cpu.memory[dph:dph + 2] == bytes(2)
+    assert cpu.memory[result:result + 2] == bytes([cpm80.DISK_ERROR, cpm80.DISK_ERROR])
+
+    cpu = cpm80.CPM(tmp_path, io.BytesIO(), io.BytesIO())
+    cpu.mount(1, image_file, read_only=True)
+    cpu.load_command(asm80.output)
+    cpu.run_blocks(10000)
+    cpu.close_disks()
+    assert cpu.memory[result:result + 2] == bytes([cpm80.DISK_OK, cpm80.DISK_ERROR])
+
+    cpu.mount(1, image_file)
+    cpu.track = 77
+    cpu.c = 0
+    cpu.bios_read()
+    assert cpu.a == cpm80.DISK_ERROR
+    cpu.close_disks()
+
+
+def test_load_cpu(tmp_path):
+    program_file = tmp_path / 'program.com'
+    program_file.write_bytes(b'\xc9')  # ret
+    parser = argparse.ArgumentParser()
+    args = argparse.Namespace(filename=program_file, arguments=['file.txt'], cpm=True,
+                              directory=tmp_path, org=0x0200)
+    cpu = cpm80.load_cpu(parser, args)
+    assert isinstance(cpu, cpm80.CPM)
+    assert (cpu.pc, cpu.memory[0x005d:0x0065]) == (cpm80.TPA, b'FILE    ')
+
+    args.arguments = []
+    args.cpm = False
+    cpu = cpm80.load_cpu(parser, args)
+    assert type(cpu) is sim80.CPU and cpu.pc == 0x0200
+
+    # The errors exit like the ones of the command line.
+    args.arguments = ['file.txt']
+    with pytest.raises(SystemExit):
+        cpm80.load_cpu(parser, args)
+    args.arguments = []
+    args.filename = tmp_path / 'missing.com'
+    with pytest.raises(SystemExit):
+        cpm80.load_cpu(parser, args)
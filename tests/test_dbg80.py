@@ -0,0 +1,189 @@
+"""Tests for the suite8080.dbg80 module."""
+
+import io
+import sys
+
+import pytest
+
+from suite8080 import asm80
+from suite8080 import cpm80
+from suite8080 import dbg80
+from suite8080 import dis80
+from suite8080 import sim80
+
+
+SOURCE = '''
+            org     100h
+            mvi     b, 3
+loop:       call    double
+            dcr     b
+            jnz     loop
+            sta     result
+            ret
+double:     add     a
+            inr     a
+            ret
+result:     db      0
+'''
+
+
+@pytest.fixture
+def cpu(monkeypatch):
+    """Return a CPU with the assembled SOURCE loaded, and its symbols in the dis80 symbol table."""
+    asm80.assemble(SOURCE.splitlines())
+    monkeypatch.setattr(dis80, 'symbol_table',
+                        {address: name for name, address in asm80.symbol_table.items()})
+    cpu = sim80.CPU()
+    cpu.load(asm80.output)
+    cpu.memory[0x0000] = 0x76  # hlt
+    cpu.pc = 0x0100
+    cpu.sp = 0xf000
+    return cpu
+
+
+def session(cpu, commands):
+    """Run the debugger commands on cpu and return the output lines."""
+    output = io.StringIO()
+    debugger = dbg80.Debugger(cpu, io.StringIO('\n'.join(commands + ['quit']) + '\n'), output)
+    debugger.intro = ''
+    debugger.prompt = ''
+    debugger.cmdloop()
+    return output.getvalue().splitlines()
+
+
+@pytest.mark.parametrize('code, registers, expected', [
+    (b'\x00', {}, ()),                                        # nop
+    (b'\x77', {'h': 0x12, 'l': 0x34}, (0x1234,)),             # mov m, a
+    (b'\x34', {'h': 0x12, 'l': 0x34}, (0x1234,)),             # inr m
+    (b'\x12', {'d': 0x20, 'e': 0x00}, (0x2000,)),             # stax d
+    (b'\x32\x10\x01', {}, (0x0110,)),                         # sta 0110h
+    (b'\x22\xff\xff', {}, (0xffff, 0x0000)),                  # shld ffffh
+    (b'\xc5', {'sp': 0x0000}, (0xffff, 0xfffe)),              # push b
+    (b'\xcd\x00\x02', {'sp': 0xf000}, (0xefff, 0xeffe)),      # call 0200h
+    (b'\xff', {'sp': 0xf000}, (0xefff, 0xeffe)),              # rst 7
+    (b'\xe3', {'sp': 0xf000}, (0xf000, 0xf001)),              # xthl
+    (b'\xd3\x10', {}, None),                                  # out 10h
+])
+def test_written_addresses(code, registers, expected):
+    cpu = sim80.CPU()
+    cpu.load(code)
+    cpu.pc = 0x0100
+    for register, value in registers.items():
+        setattr(cpu, register, value)
+    assert dbg80.written_addresses(cpu, code[0]) == expected
+
+
+def test_written_addresses_traps():
+    cpu = cpm80.CPM(console_in=io.BytesIO(), console_out=io.BytesIO())
+    assert dbg80.written_addresses(cpu, 0x76) is None
+
+
+def test_format_memory():
+    memory = bytearray(sim80.MEMORY_SIZE)
+    memory[0xfff8:0x10000] = b'Hi there'
+    memory[0x0000:0x0002] = b'\x00\x7f'
+    assert dbg80.format_memory(memory, 0xfff8, 10) == [
+        'fff8  48 69 20 74 68 65 72 65 00 7f' + ' ' * 19 + ' Hi there..']
+
+
+def test_breakpoints(cpu):
+    lines = session(cpu, ['break double', 'break 0105h', 'break', 'continue', 'regs',
+                          'delete double', 'c', 'c'])
+    assert lines[:2] == ['breakpoint at 0105', 'breakpoint at 010d (double)']
+    assert lines[2:5] == ['breakpoint at 010d (double)', 'double:', '=> 010d 87      \t\tadd a']
+    assert lines[5].startswith('pc=010d sp=effe a=00 b=03')
+    assert lines[6:8] == ['breakpoint at 0105', '=> 0105 05      \t\tdcr b']
+    assert lines[8] == 'breakpoint at 0105'
+
+
+def test_step_next(cpu):
+    lines = session(cpu, ['step', 'next', 's 2', 'n', 'regs'])
+    assert lines == [
+        'loop:',
+        '=> 0102 cd 0d 01\t\tcall double',
+        '=> 0105 05      \t\tdcr b',
+        'loop:',
+        '=> 0102 cd 0d 01\t\tcall double',
+        '=> 0105 05      \t\tdcr b',
+        'pc=0105 sp=f000 a=03 b=02 c=00 d=00 e=00 h=00 l=00 f=04 [---p-] ie=0 cycles=94',
+    ]
+
+
+def test_next_stops_at_breakpoint(cpu):
+    lines = session(cpu, ['s', 'break 010eh', 'next', 'next'])
+    assert lines[2:4] == ['breakpoint at 010e', '=> 010e 3c      \t\tinr a']
+    assert lines[4] == '=> 010f c9      \t\tret'
+
+
+def test_watch(cpu):
+    lines = session(cpu, ['watch result', 'watch effeh 2', 'watch', 'c', 'delete effe', 'delete effeh',
+                          'c', 'mem result 2', 'c'])
+    assert lines[:3] == ['watchpoint at 0110 (result) = 00', 'watchpoint at effe = 00',
+                         'watchpoint at efff = 00']
+    assert lines[3] == 'watchpoint effe: 00 -> 05, efff: 00 -> 01'
+    assert lines[4:7] == ['double:', '=> 010d 87      \t\tadd a', '*** invalid address effe']
+    assert lines[7:9] == ['watchpoint 0110 (result): 00 -> 07', '=> 010c c9      \t\tret']
+    assert lines[9] == '0110  07 00' + ' ' * 43 + ' ..'
+    assert lines[10] == 'program halted'
+
+
+def test_watch_traps(tmp_path):
+    # Console input stored by the BDOS into the buffer.
+    source = '''
+            org     100h
+            mvi     c, 10
+            lxi     d, 200h
+            call    5
+            ret
+'''
+    asm80.assemble(source.splitlines())
+    cpu = cpm80.CPM(tmp_path, io.BytesIO(b'x\r'), io.BytesIO())
+    cpu.load_command(asm80.output)
+    cpu.memory[0x0200] = 10
+    lines = session(cpu, ['watch 202h', 'c'])
+    assert lines[0] == 'watchpoint 0202: 00 -> 78'
+
+
+def test_unchecked_run(cpu, monkeypatch):
+    blocks = []
+    monkeypatch.setattr(sim80.CPU, 'run_blocks',
+                        lambda self, limit=None, run_blocks=sim80.CPU.run_blocks:
+                        blocks.append(limit) or run_blocks(self, limit))
+    lines = session(cpu, ['c 5', 'c'])
+    assert blocks == [5, None]
+    assert lines == ['instruction limit reached', '=> 0105 05      \t\tdcr b',
+                     'program halted', '=> 0001 00      \t\tnop']
+    assert cpu.memory[0x0110] == 7
+
+
+def test_disassemble_and_mem(cpu):
+    lines = session(cpu, ['disassemble loop 2', 'mem 100h 20', 'mem 0 4',
+                          'symbols', 'disassemble x', 'mem 1 2 3'])
+    assert lines[:3] == ['loop:', '   0102 cd 0d 01\t\tcall double', '   0105 05      \t\tdcr b']
+    assert lines[3].startswith('0100  06 03 cd 0d 01')
+    assert lines[4].startswith('0110  00 00 00 00    ')
+    assert lines[5].startswith('0000  76 00 00 00')
+    assert lines[6:9] == ['0102 loop', '010d double', '0110 result']
+    assert lines[9:] == ['*** invalid address x', '*** too many arguments']
+
+
+def test_symbols_command(cpu, tmp_path):
+    symbol_file = tmp_path / 'program.sym'
+    symbol_file.write_text('0105 after\n')
+    lines = session(cpu, [f'symbols {symbol_file}', 'break after', 'break',
+                          f'symbols {tmp_path / "missing.sym"}'])
+    assert lines[0] == 'breakpoint at 0105 (after)'
+    assert lines[1].startswith('*** ')
+
+
+def test_main(tmp_path, monkeypatch, capsys):
+    asm80.assemble(SOURCE.splitlines())
+    program_file = tmp_path / 'program.com'
+    program_file.write_bytes(asm80.output)
+    monkeypatch.setattr(dis80, 'symbol_table', {})
+    monkeypatch.setattr(sys, 'argv', ['dbg80', str(program_file)])
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('break 109h\nc\nregs\nquit\n'))
+    dbg80.main()
+    output = capsys.readouterr().out
+    assert 'breakpoint at 0109' in output
+    assert 'a=07 b=00' in output
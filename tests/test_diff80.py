@@ -0,0 +1,123 @@
+"""Tests for the suite8080.diff80 module."""
+
+import difflib
+import io
+import random
+import time
+
+import pytest
+
+from suite8080 import diff80
+
+
+# mvi c, 09h / lxi d, 010bh / call 0005h / jmp 0100h / db '$'
+PROGRAM = b'\x0e\x09\x11\x0b\x01\xcd\x05\x00\xc3\x00\x01\x24'
+
+
+def decoded_file(tmp_path, name, data):
+    program_file = tmp_path / name
+    program_file.write_bytes(data)
+    return diff80.decode_file(program_file)
+
+
+def test_normalize():
+    decoded = [(0x0100, 0xc3, 0x0103), (0x0103, 0xcd, 0x0005), (0x0106, 0x3e, 0x01)]
+    assert diff80.normalize(decoded) == [(0xc3, diff80.LOCAL), (0xcd, 0x0005), (0x3e, 0x01)]
+
+
+@pytest.mark.parametrize('pairs, expected', [
+    ([], []),
+    ([(0, 0), (1, 1)], [(0, 0), (1, 1)]),
+    ([(0, 3), (1, 0), (2, 1), (3, 2)], [(1, 0), (2, 1), (3, 2)]),
+])
+def test_longest_increasing(pairs, expected):
+    assert diff80.longest_increasing(pairs) == expected
+
+
+def test_diff_identical(tmp_path):
+    decoded1 = decoded_file(tmp_path, 'program1.com', PROGRAM)
+    decoded2 = decoded_file(tmp_path, 'program2.com', PROGRAM)
+    assert diff80.diff(decoded1, decoded2) == []
+
+
+def test_diff_inserted_instruction(tmp_path):
+    decoded1 = decoded_file(tmp_path, 'program1.com', PROGRAM)
+    # An inserted nop shifts the addresses the lxi and jmp reference, but only
+    # the nop is reported.
+    decoded2 = decoded_file(tmp_path, 'program2.com',
+                            b'\x0e\x09\x00\x11\x0c\x01\xcd\x05\x00\xc3\x00\x01\x24')
+    assert diff80.diff(decoded1, decoded2) == [('insert', 1, 1, 1, 2)]
+
+
+@pytest.mark.parametrize('data1, data2, expected', [
+    # jmp 0106h / mvi a, 1 / inr a / inr b / ret, with the target changed to the inr a.
+    (b'\xc3\x06\x01\x3e\x01\x3c\x04\xc9', b'\xc3\x05\x01\x3e\x01\x3c\x04\xc9',
+     [('replace', 0, 1, 0, 1)]),
+    # The target shifted by an inserted nop.
+    (b'\xc3\x06\x01\x3e\x01\x3c\x04\xc9', b'\xc3\x07\x01\x3e\x01\x00\x3c\x04\xc9',
+     [('insert', 2, 2, 2, 3)]),
+    # jmp 0106h / mvi a, 1 / nop / nop / ret, with a nop inserted in the run
+    # holding the target, which may be aligned with any shift.
+    (b'\xc3\x06\x01\x3e\x01\x00\x00\xc9', b'\xc3\x07\x01\x3e\x01\x00\x00\x00\xc9',
+     [('insert', 4, 4, 4, 5)]),
+])
+def test_diff_changed_target(tmp_path, data1, data2, expected):
+    decoded1 = decoded_file(tmp_path, 'program1.com', data1)
+    decoded2 = decoded_file(tmp_path, 'program2.com', data2)
+    assert diff80.diff(decoded1, decoded2) == expected
+
+
+def test_diff_changed_operand(tmp_path):
+    decoded1 = decoded_file(tmp_path, 'program1.com', PROGRAM)
+    decoded2 = decoded_file(tmp_path, 'program2.com', PROGRAM.replace(b'\x0e\x09', b'\x0e\x02'))
+    differences = diff80.diff(decoded1, decoded2)
+    assert differences == [('replace', 0, 1, 0, 1)]
+
+    file = io.StringIO()
+    assert diff80.write_diff(file, decoded1, decoded2, differences) == 1
+    assert file.getvalue().splitlines() == ['@@ -0100,1 +0100,1 @@',
+                                            '-0100 0e 09   \t\tmvi c, 09h',
+                                            '+0100 0e 02   \t\tmvi c, 02h']
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_myers(seed):
+    generator = random.Random(seed)
+    keys1 = [generator.randrange(4) for _ in range(60)]
+    keys2 = [generator.randrange(4) for _ in range(50)]
+    pairs = diff80.myers(keys1, 0, len(keys1), keys2, 0, len(keys2))
+    assert all(keys1[i] == keys2[j] for i, j in pairs)
+    assert pairs == sorted(pairs) and sorted(j for i, j in pairs) == [j for i, j in pairs]
+    # The Myers diff matches the most keys.
+    matcher = difflib.SequenceMatcher(None, keys1, keys2, autojunk=False)
+    assert len(pairs) >= sum(size for i, j, size in matcher.get_matching_blocks())
+
+
+def test_myers_too_many_edits():
+    assert diff80.myers([1] * 10, 0, 10, [2] * 10, 0, 10, max_edits=19) is None
+    assert len(diff80.myers([1] * 10, 0, 10, [2] * 10, 0, 10, max_edits=20)) == 0
+
+
+@pytest.mark.parametrize('image', ['padded', 'repetitive'])
+def test_diff_large_image(tmp_path, image):
+    generator = random.Random(0)
+    if image == 'padded':
+        # Code followed by zeros, changed within the zeros where no key is unique.
+        data1 = bytes(generator.randrange(256) for _ in range(0x2000)) + bytes(0xe000)
+        changes = (0x5000, 0xa000)
+    else:
+        data1 = bytes(generator.choice(b'\x00\x3c\x47\x80\x04') for _ in range(0xea60))
+        changes = (0x01f4, 0x9c40)
+    data2 = bytearray(data1)
+    for address in changes:
+        data2[address] = 0x05
+    (tmp_path / 'program1.com').write_bytes(data1)
+    (tmp_path / 'program2.com').write_bytes(data2)
+    decoded1 = diff80.decode_file(tmp_path / 'program1.com', 0)
+    decoded2 = diff80.decode_file(tmp_path / 'program2.com', 0)
+
+    start = time.perf_counter()
+    differences = diff80.diff(decoded1, decoded2, 0, 0)
+    assert time.perf_counter() - start < 5
+    changed = {decoded2[j][0] for tag, i1, i2, j1, j2 in differences for j in range(j1, j2)}
+    assert changed == set(changes)
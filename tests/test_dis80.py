@@ -0,0 +1,471 @@
+"""Tests for the suite8080.dis80 module."""
+
+import argparse
+import io
+import json
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+from suite8080 import dis80
+
+
+@pytest.fixture
+def symbols(tmp_path):
+    symbol_file = tmp_path / 'program.sym'
+    symbol_file.write_text('0000 START\n0003 LOOP\t0105 MESSAGE\n\x1a\x1a')
+    return symbol_file
+
+
+def test_read_symbol_table(symbols):
+    table = dis80.read_symbol_table(symbols)
+    assert table == {0x0000: 'start', 0x0003: 'loop', 0x0105: 'message'}
+
+
+def test_read_symbol_table_duplicate_address(tmp_path):
+    symbol_file = tmp_path / 'program.sym'
+    symbol_file.write_text('0100 FIRST\n0100 SECOND\n')
+    assert dis80.read_symbol_table(symbol_file) == {0x0100: 'first'}
+
+
+def test_read_symbol_table_invalid_address(tmp_path, capsys):
+    symbol_file = tmp_path / 'program.sym'
+    symbol_file.write_text('01G0 START\n')
+    with pytest.raises(SystemExit):
+        dis80.read_symbol_table(symbol_file)
+    captured = capsys.readouterr()
+    assert 'invalid address "01G0"' in captured.err
+
+
+def test_disassemble(monkeypatch):
+    # nop / mvi a, 2ah / jmp 0100h / lxi b (operand past the end)
+    monkeypatch.setattr(dis80, 'program', b'\x00\x3e\x2a\xc3\x00\x01\x01\x00')
+    assert list(dis80.disassemble()) == [(0, 0x00, None),
+                                         (1, 0x3e, 0x2a),
+                                         (3, 0xc3, 0x0100),
+                                         (6, None, 0x01),
+                                         (7, None, 0x00)]
+
+
+@pytest.mark.parametrize('start, end, org, expected', [
+    (1, None, None, [(1, 0x3e, 0x2a), (3, 0xc3, 0x0100), (6, None, 0x01), (7, None, 0x00)]),
+    (1, 3, None, [(1, 0x3e, 0x2a)]),
+    (1, 5, None, [(1, 0x3e, 0x2a), (3, None, 0xc3), (4, None, 0x00)]),
+    (3, 6, 0x0100, [(0x0100, 0xc3, 0x0100)]),
+])
+def test_disassemble_window(monkeypatch, start, end, org, expected):
+    monkeypatch.setattr(dis80, 'program', b'\x00\x3e\x2a\xc3\x00\x01\x01\x00')
+    assert list(dis80.disassemble(start, end, org)) == expected
+
+
+@pytest.mark.parametrize('address, opcode, operand, line', [
+    (0x0000, 0x00, None, '0000 00      \t\tnop \n'),
+    (0x0001, 0x3e, 0x2a, '0001 3e 2a   \t\tmvi a, 2ah\n'),
+    (0x0103, 0xc3, 0x0100, '0103 c3 00 01\t\tjmp 0100h\n'),
+])
+def test_format_instruction(address, opcode, operand, line):
+    assert dis80.format_instruction(address, opcode, operand) == line
+
+
+@pytest.mark.parametrize('org, entries, expected', [
+    # nop / call 0008h / jmp 0000h / db 0ffh / ret
+    (None, (), [(0, 0x00, None), (1, 0xcd, 0x0008), (4, 0xc3, 0x0000),
+                (7, None, 0xff), (8, 0xc9, None)]),
+    # An additional entry point decodes the byte as an instruction.
+    (None, (7,), [(0, 0x00, None), (1, 0xcd, 0x0008), (4, 0xc3, 0x0000),
+                  (7, 0xff, None), (8, 0xc9, None)]),
+])
+def test_trace(monkeypatch, org, entries, expected):
+    monkeypatch.setattr(dis80, 'program', b'\x00\xcd\x08\x00\xc3\x00\x00\xff\xc9')
+    assert list(dis80.trace(0, None, org, entries)) == expected
+
+
+def test_trace_com_entry(monkeypatch):
+    # A .com program whose data would decode as a jump past the end.
+    monkeypatch.setattr(dis80, 'program', b'\xc9\x1a\x2a\x30\xc3')
+    decoded = list(dis80.trace(0, None, 0x0100))
+    assert decoded[0] == (0x0100, 0xc9, None)
+    assert all(opcode is None for address, opcode, operand in decoded[1:])
+    assert len(decoded) == 5
+
+
+def test_main_follow_com(tmp_path, monkeypatch, capsys):
+    # mvi c, 09h / lxi d, message / call 0005h / ret / message: db 'Greetings from Suite8080$'
+    program_file = tmp_path / 'greet.com'
+    program_file.write_bytes(b'\x0e\x09\x11\x09\x01\xcd\x05\x00\xc9Greetings from Suite8080$')
+    monkeypatch.setattr(sys, 'argv', ['dis80', str(program_file), '-f'])
+    dis80.main()
+    lines = capsys.readouterr().out.splitlines()
+    # The program is at 0100h, and the message bytes at offsets 0008h and
+    # 0010h aren't decoded from the rst vectors.
+    assert lines[0] == '0100 0e 09   \t\tmvi c, 09h'
+    assert lines[3] == '0108 c9      \t\tret '
+    assert len(lines) == 4 + 25
+    assert all('\t\tdb ' in line for line in lines[4:])
+
+
+def test_templates():
+    assert len(dis80.SIZES) == len(dis80.TEMPLATES) == 256
+    assert dis80.TEMPLATES[0xc3] == '{0:04x} c3 {1:02x} {2:02x}\t\tjmp {3}\n'
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'\x00',
+    b'\x00\x3e\x2a\xc3\x00\x01\x01\x00',
+    bytes(range(256)),
+])
+def test_bulk_decode(monkeypatch, data):
+    pytest.importorskip('numpy')
+    monkeypatch.setattr(dis80, 'program', data)
+    addresses, opcodes, operands = dis80.bulk_decode(data, org=0x0100)
+    decoded = [(address, None if opcode < 0 else opcode, None if operand < 0 else operand)
+               for address, opcode, operand in zip(addresses.tolist(), opcodes.tolist(),
+                                                   operands.tolist())]
+    assert decoded == list(dis80.disassemble(org=0x0100))
+
+
+def test_bulk_analytics():
+    pytest.importorskip('numpy')
+    # call 0005h / jz 0100h / call 0005h / ret
+    data = b'\xcd\x05\x00\xca\x00\x01\xcd\x05\x00\xc9'
+    addresses, opcodes, operands = dis80.bulk_decode(data)
+    histogram = dis80.opcode_histogram(opcodes)
+    assert histogram[0xcd] == 2 and histogram[0xc9] == 1 and histogram.sum() == 4
+    assert dis80.branch_targets(opcodes, operands).tolist() == [0x0005, 0x0100]
+
+
+def test_numpy_imported_lazily(monkeypatch):
+    result = subprocess.run([sys.executable, '-c', 'import sys; import suite8080.dis80; '
+                             'print("numpy" in sys.modules)'],
+                            cwd=Path(__file__).parent.parent, stdout=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    assert result.stdout == 'False\n'
+    # Without NumPy, the functions using it raise ImportError.
+    monkeypatch.setitem(sys.modules, 'numpy', None)
+    with pytest.raises(ImportError):
+        dis80.bulk_decode(b'\x00')
+
+
+def test_generate_labels(monkeypatch):
+    # jmp 0006h / lxi h, 1234h / nop / lda 0000h / call 0004h
+    decoded = [(0, 0xc3, 0x0006), (3, 0x21, 0x1234), (6, 0x00, None),
+               (7, 0x3a, 0x0000), (10, 0xcd, 0x0004)]
+    monkeypatch.setattr(dis80, 'symbol_table', {0x0000: 'start'})
+    # 0004h is in the middle of an instruction and 1234h isn't decoded.
+    assert dis80.generate_labels(decoded) == 1
+    assert dis80.symbol_table == {0x0000: 'start', 0x0006: 'L0006'}
+
+
+def test_format_instruction_data():
+    assert dis80.format_instruction(0x0107, None, 0xff) == '0107 ff      \t\tdb ffh\n'
+
+
+def test_aliases():
+    assert dis80.ALIASES == {0x08, 0x10, 0x18, 0x20, 0x28, 0x30, 0x38,
+                             0xcb, 0xd9, 0xdd, 0xed, 0xfd}
+
+
+@pytest.mark.parametrize('value, digits, text', [
+    (0x09, 2, '09h'),
+    (0xdb, 2, '0dbh'),
+    (0x0100, 4, '0100h'),
+    (0xf000, 4, '0f000h'),
+])
+def test_hex_number(value, digits, text):
+    assert dis80.hex_number(value, digits) == text
+
+
+def test_write_source(monkeypatch):
+    monkeypatch.setattr(dis80, 'symbol_table', {0x0100: 'start', 0x0005: 'bdos'})
+    decoded = [(0x0100, 0x0e, 0x09), (0x0102, 0xcd, 0x0005), (0x0105, 0xc3, 0x0100),
+               (0x0108, 0x08, None), (0x0109, None, 0x24)]
+    source = io.StringIO()
+    dis80.write_source(source, decoded, 0x0100)
+    assert source.getvalue().splitlines() == ['\torg 0100h',
+                                              'start:',
+                                              '\tmvi c, 09h',
+                                              '\tcall bdos',
+                                              '\tjmp start',
+                                              '\tdb 08h, 24h',
+                                              'bdos\tequ 0005h',
+                                              '\tend']
+
+
+def test_round_trip(tmp_path):
+    program_file = tmp_path / 'all.com'
+    # Every opcode with its operands, and labels containing the letters db.
+    program_file.write_bytes(b''.join(bytes([opcode, 0xdb, 0x01]) for opcode in range(256)))
+    assert dis80.round_trip(program_file) is None
+
+
+def test_round_trip_mismatch(tmp_path, monkeypatch):
+    program_file = tmp_path / 'program.com'
+    program_file.write_bytes(b'\x00\xc9')
+    # Simulate a disassembler bug that swaps the instructions.
+    monkeypatch.setattr(dis80, 'instructions', [('ret', 1)] + dis80.instructions[1:])
+    assert dis80.round_trip(program_file) == 'mismatch at 0100: expected 00, got c9'
+
+
+def test_check_round_trip(tmp_path, capsys):
+    filenames = []
+    for name in ('greet.com', 'data.com'):
+        program_file = tmp_path / name
+        program_file.write_bytes(b'\x0e\x09\x11\x09\x01\xcd\x05\x00\xc9\x24')
+        filenames.append(str(program_file))
+    assert dis80.check_round_trip(filenames, jobs=2) == 0
+    assert capsys.readouterr().err == ''
+
+
+def test_records():
+    decoded = [(0x0100, 0x0e, 0x09), (0x0102, 0xcd, 0x0005), (0x0105, 0xff, None),
+               (0x0106, None, 0x24)]
+    assert list(dis80.records(decoded)) == [
+        (0x0100, 0x0e, '0e09', 'mvi c', 0x09, 2, None),
+        (0x0102, 0xcd, 'cd0500', 'call', 0x0005, 3, 0x0005),
+        (0x0105, 0xff, 'ff', 'rst 7', None, 1, 0x0038),
+        (0x0106, None, '24', 'db', 0x24, 1, None),
+    ]
+
+
+def test_write_jsonl(monkeypatch):
+    monkeypatch.setattr(dis80, 'program', b'\xc3\x00\x01\x76')
+    monkeypatch.setattr(dis80, 'BATCH_SIZE', 1)
+    file = io.StringIO()
+    assert dis80.write_jsonl(file, dis80.disassemble(org=0x0100)) == 2
+    records = [json.loads(line) for line in file.getvalue().splitlines()]
+    assert records[0] == {'address': 0x0100, 'opcode': 0xc3, 'bytes': 'c30001',
+                          'mnemonic': 'jmp', 'operand': 0x0100, 'size': 3,
+                          'target': 0x0100}
+    assert records[1]['mnemonic'] == 'hlt'
+
+
+def test_write_csv(monkeypatch):
+    monkeypatch.setattr(dis80, 'program', b'\x3e\x2a\x76')
+    file = io.StringIO()
+    assert dis80.write_csv(file, dis80.disassemble()) == 2
+    assert file.getvalue().splitlines() == ['address,opcode,bytes,mnemonic,operand,size,target',
+                                            '0,62,3e2a,mvi a,42,2,',
+                                            '2,118,76,hlt,,1,']
+
+
+@pytest.fixture
+def greet(tmp_path):
+    program_file = tmp_path / 'greet.com'
+    # mvi c, 09h / lxi d, 0109h / call 0005h / ret / db 'Hello$'
+    program_file.write_bytes(b'\x0e\x09\x11\x09\x01\xcd\x05\x00\xc9Hello$')
+    return program_file
+
+
+def test_disassemble_file(greet, monkeypatch):
+    monkeypatch.setattr(dis80, 'program', b'')
+    monkeypatch.setattr(dis80, 'symbol_table', {})
+    options = argparse.Namespace(org=None, follow=True, entry=[], labels=True,
+                                 source=False, format='text')
+    entry = dis80.disassemble_file(str(greet), options)
+    assert entry == {'size': 15, 'instructions': 4,
+                     'opcodes': {'0e': 1, '11': 1, 'c9': 1, 'cd': 1},
+                     'calls': [0x0005], 'strings': [[0x0109, 'Hello$']]}
+    listing = greet.with_suffix('.lst').read_text()
+    assert 'lxi d, L0109' in listing
+
+
+def test_batch_files(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    for name in ('b.com', 'sub/A.COM', 'notes.txt'):
+        (tmp_path / name).write_bytes(b'')
+    filenames = dis80.batch_files([str(tmp_path), 'other.bin'])
+    assert filenames == [str(tmp_path / 'b.com'), str(tmp_path / 'sub' / 'A.COM'), 'other.bin']
+
+
+def test_disassemble_batch(greet, tmp_path):
+    index_file = tmp_path / 'index.json'
+    options = argparse.Namespace(org=None, follow=False, entry=[], labels=False,
+                                 source=False, format='jsonl')
+    assert dis80.disassemble_batch([str(greet)], options, index_file, jobs=1) == 1
+    assert greet.with_suffix('.jsonl').exists()
+    index = dis80.read_index(index_file)
+    assert index[str(greet)]['calls'] == [0x0005]
+
+
+# mvi b, 08h / loop: call 0005h / dcr b / jnz loop / rz / pchl / db 0ffh / hlt
+CFG_PROGRAM = [(0x0100, 0x06, 0x08), (0x0102, 0xcd, 0x0005), (0x0105, 0x05, None),
+               (0x0106, 0xc2, 0x0102), (0x0109, 0xc8, None), (0x010a, 0xe9, None),
+               (0x010b, None, 0xff), (0x010c, 0x76, None)]
+
+
+def test_control_flow_graph():
+    blocks, edges = dis80.control_flow_graph(iter(CFG_PROGRAM))
+    assert blocks == [(0x0100, 0x0102, 1, 'fallthrough'),
+                      (0x0102, 0x0105, 1, 'call'),
+                      (0x0105, 0x0109, 2, 'branch'),
+                      (0x0109, 0x010a, 1, 'conditional return'),
+                      (0x010a, 0x010b, 1, 'indirect'),
+                      (0x010c, 0x010d, 1, 'halt')]
+    assert edges == [(0x0100, 0x0102, 'fallthrough'),
+                     (0x0102, 0x0005, 'call'),
+                     (0x0102, 0x0105, 'return'),
+                     (0x0105, 0x0102, 'branch'),
+                     (0x0105, 0x0109, 'fallthrough'),
+                     (0x0109, 0x010a, 'fallthrough')]
+
+
+def test_write_dot(monkeypatch):
+    monkeypatch.setattr(dis80, 'symbol_table', {0x0102: 'loop'})
+    file = io.StringIO()
+    assert dis80.write_dot(file, *dis80.control_flow_graph(CFG_PROGRAM)) == 6
+    dot = file.getvalue()
+    assert dot.startswith('digraph cfg {')
+    assert '"0102" [label="loop (1)\\ncall"];' in dot
+    assert '"0102" -> "0005" [label="call", style=dashed];' in dot
+
+
+def test_write_cfg_json():
+    file = io.StringIO()
+    dis80.write_cfg_json(file, *dis80.control_flow_graph(CFG_PROGRAM))
+    graph = json.loads(file.getvalue())
+    assert graph['blocks'][2] == {'start': 0x0105, 'end': 0x0109, 'instructions': 2,
+                                  'exit': 'branch'}
+    assert {'source': 0x0105, 'target': 0x0102, 'kind': 'branch'} in graph['edges']
+
+
+# lxi h, 0200h / call 0005h / shld 0200h / jnz 0100h / lhld 0200h / rst 1 / db 0c3h
+XREF_PROGRAM = [(0x0100, 0x21, 0x0200), (0x0103, 0xcd, 0x0005), (0x0106, 0x22, 0x0200),
+                (0x0109, 0xc2, 0x0100), (0x010c, 0x2a, 0x0200), (0x010f, 0xcf, None),
+                (0x0110, None, 0xc3)]
+
+
+def test_cross_references():
+    xrefs = dis80.cross_references(XREF_PROGRAM)
+    assert list(xrefs[0]) == [0x0005, 0x0008, 0x0100, 0x0200, 0x0200, 0x0200]
+    assert dis80.references(xrefs, 0x0200) == [(0x0100, 'pointer'), (0x0106, 'store'),
+                                               (0x010c, 'load')]
+    assert dis80.references(xrefs, 0x0008) == [(0x010f, 'call')]
+    assert dis80.references(xrefs, 0x0300) == []
+
+
+def test_write_xrefs(monkeypatch):
+    monkeypatch.setattr(dis80, 'symbol_table', {0x0005: 'bdos'})
+    file = io.StringIO()
+    assert dis80.write_xrefs(file, dis80.cross_references(XREF_PROGRAM)) == 4
+    lines = file.getvalue().splitlines()
+    assert lines[0] == 'bdos\t0103:call'
+    assert lines[3] == '0200\t0100:pointer 0106:store 010c:load'
+
+
+def test_xref_cache(tmp_path):
+    program_file = tmp_path / 'program.com'
+    program_file.write_bytes(b'\xc9')
+    cache_file = tmp_path / 'program.com.xrc'
+    xrefs = dis80.cross_references(XREF_PROGRAM)
+    key = dis80.xref_cache_key(program_file, 0x0100, False)
+
+    assert dis80.load_xrefs(cache_file, key) is None
+    dis80.save_xrefs(cache_file, key, xrefs)
+    assert dis80.load_xrefs(cache_file, key) == xrefs
+    # A different origin makes the cache stale.
+    assert dis80.load_xrefs(cache_file, dis80.xref_cache_key(program_file, 0, False)) is None
+
+
+def test_xref_cache_entries(tmp_path):
+    program_file = tmp_path / 'program.com'
+    program_file.write_bytes(b'\xc9')
+    cache_file = tmp_path / 'program.com.xrc'
+    xrefs = dis80.cross_references(XREF_PROGRAM)
+    key = dis80.xref_cache_key(program_file, 0x0100, True, [0x0105, 0x0101])
+    dis80.save_xrefs(cache_file, key, xrefs)
+    assert dis80.load_xrefs(cache_file, dis80.xref_cache_key(program_file, 0x0100, True,
+                                                             [0x0101, 0x0105])) == xrefs
+    for entries in ([], [0x0101], [0x0101, 0x0105, 0x0107]):
+        stale_key = dis80.xref_cache_key(program_file, 0x0100, True, entries)
+        assert dis80.load_xrefs(cache_file, stale_key) is None
+
+
+def test_xref_cache_unwritable(tmp_path):
+    xrefs = dis80.cross_references(XREF_PROGRAM)
+    key = dis80.xref_cache_key(tmp_path, 0x0100, False)
+    assert not dis80.save_xrefs(tmp_path / 'missing' / 'program.com.xrc', key, xrefs)
+
+
+def test_main_xref_entries(tmp_path, monkeypatch, capsys):
+    # jmp 0100h / call 1234h, reached only from the entry point 0103h.
+    program_file = tmp_path / 'program.com'
+    program_file.write_bytes(b'\xc3\x00\x01\xcd\x34\x12')
+    for entries, expected in (([], ['0100\t0100:jump']),
+                              (['-e', '103h'], ['0100\t0100:jump', '1234\t0103:call'])):
+        monkeypatch.setattr(sys, 'argv', ['dis80', str(program_file), '--org', '100h', '-f', '-x']
+                            + entries)
+        dis80.main()
+        assert capsys.readouterr().out.splitlines() == expected
+
+
+def test_write_disassembly_batches(monkeypatch):
+    monkeypatch.setattr(dis80, 'program', bytes(10))
+    monkeypatch.setattr(dis80, 'BATCH_SIZE', 4)
+    file = io.StringIO()
+    assert dis80.write_disassembly(file, dis80.disassemble()) == 10
+    assert file.getvalue().count('nop') == 10
+
+
+def test_main_outfile(tmp_path, monkeypatch):
+    program_file = tmp_path / 'program.com'
+    program_file.write_bytes(b'\x00\x76')
+    outfile = tmp_path / 'program.txt'
+    monkeypatch.setattr(dis80, 'program', b'')
+    monkeypatch.setattr(sys, 'argv', ['dis80', str(program_file), '-o', str(outfile)])
+    dis80.main()
+    lines = outfile.read_text().splitlines()
+    assert len(lines) == 2
+    assert lines[1].endswith('hlt ')
+
+
+def test_disassemble_symbols(symbols, monkeypatch):
+    # start: nop / jmp loop / lxi h, message / lda 1234h
+    monkeypatch.setattr(dis80, 'program', b'\x00\xc3\x03\x00\x21\x05\x01\x3a\x34\x12')
+    monkeypatch.setattr(dis80, 'symbol_table', dis80.read_symbol_table(symbols))
+    file = io.StringIO()
+    dis80.write_disassembly(file, dis80.disassemble())
+    lines = file.getvalue().splitlines()
+    assert lines[0] == 'start:'
+    assert lines[2].endswith('jmp loop')
+    assert lines[3].endswith('lxi h, message')
+    assert lines[4].endswith('lda 1234h')
+
+
+def test_main_window(tmp_path, monkeypatch):
+    program_file = tmp_path / 'image.bin'
+    program_file.write_bytes(bytes(1024) + b'\xc3\x00\xf0\x76' + bytes(1024))
+    outfile = tmp_path / 'image.txt'
+    monkeypatch.setattr(dis80, 'program', b'')
+    monkeypatch.setattr(sys, 'argv', ['dis80', str(program_file), '-o', str(outfile),
+                                      '--start', '400h', '--length', '4',
+                                      '--org', '0f000h'])
+    dis80.main()
+    lines = outfile.read_text().splitlines()
+    assert lines == ['f000 c3 00 f0\t\tjmp f000h', 'f003 76      \t\thlt ']
+
+
+def test_main_end_before_start(tmp_path, monkeypatch, capsys):
+    program_file = tmp_path / 'program.com'
+    program_file.write_bytes(bytes(16))
+    monkeypatch.setattr(sys, 'argv', ['dis80', str(program_file),
+                                      '--start', '8', '--end', '4'])
+    with pytest.raises(SystemExit):
+        dis80.main()
+    assert '--end must not be less than --start' in capsys.readouterr().err
+
+
+def test_main_labels(tmp_path, monkeypatch):
+    program_file = tmp_path / 'program.com'
+    # loop: jmp loop
+    program_file.write_bytes(b'\xc3\x00\x01')
+    outfile = tmp_path / 'program.txt'
+    monkeypatch.setattr(dis80, 'program', b'')
+    monkeypatch.setattr(dis80, 'symbol_table', {})
+    monkeypatch.setattr(sys, 'argv', ['dis80', str(program_file), '-o', str(outfile),
+                                      '--org', '100h', '--labels'])
+    dis80.main()
+    lines = outfile.read_text().splitlines()
+    assert lines == ['L0100:', '0100 c3 00 01\t\tjmp L0100']
@@ -0,0 +1,54 @@
+"""Tests for the suite8080.find80 module."""
+
+import pytest
+
+from suite8080 import find80
+
+
+@pytest.mark.parametrize('text, code', [
+    ('nop', b'\x00'),
+    ('MOV B,C', b'\x41'),
+    ('rst 1', b'\xcf'),
+    ('mvi c, 09h', b'\x0e\x09'),
+    ('call 0005h', b'\xcd\x05\x00'),
+    ('lxi sp, 1234h', b'\x31\x34\x12'),
+])
+def test_compile_instruction(text, code):
+    assert find80.compile_instruction(text) == find80.re.escape(code)
+
+
+@pytest.mark.parametrize('text, message', [
+    ('mov q, c', 'invalid instruction'),
+    ('nop 1', 'invalid instruction'),
+    ('mvi c, zz', 'invalid operand'),
+    ('mvi c, 100h', 'out of range'),
+])
+def test_compile_instruction_invalid(text, message):
+    with pytest.raises(ValueError, match=message):
+        find80.compile_instruction(text)
+
+
+def test_compile_pattern_wildcard():
+    regex = find80.compile_pattern('mvi c, ?? ; call 0005h')
+    # The wildcard matches any byte, including newlines.
+    assert regex.search(b'\x00\x0e\x0a\xcd\x05\x00').start() == 1
+    assert regex.search(b'\x0e\x09\xcd\x06\x00') is None
+
+
+def test_compile_pattern_empty():
+    with pytest.raises(ValueError, match='empty pattern'):
+        find80.compile_pattern(' ; ')
+
+
+def test_search(tmp_path):
+    program_file = tmp_path / 'program.com'
+    # Overlapping matches of mvi a, 3eh / mvi a, ??
+    program_file.write_bytes(b'\x00\x3e\x3e\x3e\x3e\x00')
+    regex = find80.compile_pattern('mvi a, 3eh; mvi a, ??')
+    assert find80.search(program_file, regex) == [0x0101, 0x0102]
+
+
+def test_search_empty_file(tmp_path):
+    program_file = tmp_path / 'empty.com'
+    program_file.write_bytes(b'')
+    assert find80.search(program_file, find80.compile_pattern('nop')) == []
@@ -0,0 +1,161 @@
+"""Tests for the suite8080.prof80 module."""
+
+import io
+import sys
+
+from suite8080 import asm80
+from suite8080 import prof80
+from suite8080 import sim80
+
+
+# Call a subroutine three times from a loop, and once more conditionally.
+SOURCE = '''
+            org     100h
+start:      mvi     b, 3
+loop:       call    sub
+            dcr     b
+            jnz     loop
+            cz      sub
+            hlt
+sub:        inr     a
+            ret
+'''
+
+
+def assemble(source=SOURCE):
+    """Assemble source and return the program and symbol table indexed by address."""
+    asm80.assemble(source.splitlines())
+    return bytes(asm80.output), {address: symbol for symbol, address in asm80.symbol_table.items()}
+
+
+def profiled(source=SOURCE):
+    """Return the CPU and profile of source run from 0100h."""
+    program, symbols = assemble(source)
+    cpu = sim80.CPU()
+    cpu.load(program)
+    cpu.pc = 0x0100
+    cpu.sp = 0xf000
+    return cpu, prof80.profile(cpu)
+
+
+def test_profile():
+    cpu, (executed, counts, cycles, stacks) = profiled()
+    assert cpu.halted
+    assert cpu.a == 4
+    assert executed == 1 + 3 * 3 + 1 + 1 + 4 * 2
+    assert counts[0x0102] == 3                  # call sub
+    assert counts[0x010d] == 4                  # inr a
+    assert cycles[0x0102] == 3 * 17
+    # The cz is taken, so it takes the extra cycles of the call.
+    assert cycles[0x0109] == 11 + sim80.TAKEN_CYCLES
+    assert sum(cycles) == cpu.cycles
+    assert stacks == {(0x0100,): cpu.cycles - 4 * (5 + 10), (0x0100, 0x010d): 4 * (5 + 10)}
+
+
+def test_profile_limit():
+    program, symbols = assemble()
+    cpu = sim80.CPU()
+    cpu.load(program)
+    cpu.pc = 0x0100
+    executed, counts, cycles, stacks = prof80.profile(cpu, 3)
+    assert executed == 3
+    assert cpu.pc == 0x010e
+    assert stacks == {(0x0100,): 7 + 17, (0x0100, 0x010d): 5}
+
+
+def test_profile_interrupt():
+    # The rst 1 handler inr a / ei / ret interrupts the hlt waiting for it.
+    source = '''
+            org     100h
+            ei
+            call    wait
+            di
+            hlt
+wait:       hlt
+            ret
+'''
+    program, symbols = assemble(source)
+    cpu = sim80.CPU()
+    cpu.load(program)
+    cpu.load(b'\x3c\xfb\xc9', 0x0008)
+    cpu.pc = 0x0100
+    cpu.sp = 0xf000
+    cpu.schedule(1000, lambda: cpu.interrupt(1))
+    executed, counts, cycles, stacks = prof80.profile(cpu)
+    assert cpu.halted
+    assert (executed, cpu.a, counts[0x0008]) == (9, 1, 1)
+    # The accepted interrupt counts as a call of its vector, and the wait for
+    # it is charged to the hlt.
+    assert stacks[(0x0100, 0x0106, 0x0008)] == 11 + 5 + 4 + 10
+    assert cycles[0x0106] == 1000 - 4 - 17
+    assert sum(cycles) + 11 == cpu.cycles == sum(stacks.values())
+
+
+def test_profile_unbalanced_stack():
+    # The subroutine drops its return address and jumps back, which counts as a
+    # return as the stack pointer is back to its value before the call.
+    source = '''
+            org     100h
+            call    sub
+back:       hlt
+sub:        pop     h
+            jmp     back
+'''
+    cpu, (executed, counts, cycles, stacks) = profiled(source)
+    assert cpu.halted
+    assert stacks == {(0x0100,): 17 + 7, (0x0100, 0x0104): 10 + 10}
+
+
+def test_symbol_locator():
+    locate = prof80.symbol_locator({0x0100: 'start', 0x0110: 'loop'}, 0x0120)
+    assert locate(0x0100) == 'start'
+    assert locate(0x0105) == 'start+5'
+    assert locate(0x0105, False) == 'start'
+    assert locate(0x0111) == 'loop+1'
+    assert locate(0x00ff) == '00ff'
+    assert locate(0x0120) == '0120'
+
+
+def test_hot_spots():
+    cpu, (executed, counts, cycles, stacks) = profiled()
+    program, symbols = assemble()
+    locate = prof80.symbol_locator(symbols)
+    spots = prof80.hot_spots(counts, cycles, locate)
+    assert [name for name, executions, spent in spots] == ['loop', 'sub', 'start']
+    assert spots[1] == ('sub', 8, 4 * (5 + 10))
+    by_address = prof80.hot_spots(counts, cycles, locate, by_address=True)
+    assert by_address[0] == ('loop', 3, 3 * 17)
+
+
+def test_folded_stacks():
+    cpu, (executed, counts, cycles, stacks) = profiled()
+    program, symbols = assemble()
+    folded = prof80.folded_stacks(stacks, prof80.symbol_locator(symbols))
+    assert folded == {'start': cpu.cycles - 60, 'start;sub': 60}
+    file = io.StringIO()
+    prof80.write_folded(file, folded)
+    assert file.getvalue() == f'start {cpu.cycles - 60}\nstart;sub 60\n'
+
+
+def test_write_report():
+    file = io.StringIO()
+    prof80.write_report(file, [('loop', 3, 75), ('sub', 8, 25)], 11, 100, top=1)
+    lines = file.getvalue().splitlines()
+    assert lines[0] == '11 instructions, 100 cycles'
+    assert lines[2].split() == ['75', '75.00', '3', 'loop']
+    assert len(lines) == 3
+
+
+def test_main(tmp_path, monkeypatch, capsys):
+    program, symbols = assemble()
+    program_file = tmp_path / 'program.com'
+    program_file.write_bytes(program)
+    symbol_file = tmp_path / 'program.sym'
+    asm80.write_symbol_table(asm80.symbol_table, symbol_file)
+    folded_file = tmp_path / 'program.folded'
+    monkeypatch.setattr(sys, 'argv', ['prof80', str(program_file), '-s', str(symbol_file),
+                                      '-f', str(folded_file)])
+    prof80.main()
+    report = capsys.readouterr().out.splitlines()
+    assert report[2].split()[-1] == 'loop'
+    assert folded_file.read_text().splitlines()[-1] == 'start;sub 60'
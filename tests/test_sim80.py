@@ -0,0 +1,627 @@
+"""Tests for the suite8080.sim80 module."""
+
+from pathlib import Path
+import sys
+import zlib
+
+import pytest
+
+from suite8080 import asm80
+from suite8080 import sim80
+
+
+ASM_DIR = Path(__file__).parent.parent / 'asm'
+
+
+def state(cpu):
+    """Return the registers, memory, and execution state of cpu."""
+    return tuple(getattr(cpu, name) for name in
+                 ('a', 'b', 'c', 'd', 'e', 'h', 'l', 'f', 'sp', 'pc', 'memory', 'cycles', 'halted',
+                  'interrupts_enabled'))
+
+
+def run(code, handler=None, interrupt=None, **registers):
+    """Return a CPU that ran code, followed by hlt, at 0100h with the registers set.
+
+    The code runs on both the interpreter and the block engine, which must
+    leave the CPU in the same state. If supplied, handler is loaded at 0008h
+    and the interrupt is requested before running."""
+    cpus = []
+    for engine in ('run', 'run_blocks'):
+        cpu = sim80.CPU()
+        cpu.load(code + b'\x76')
+        if handler is not None:
+            cpu.load(handler, 0x0008)
+        cpu.pc = 0x0100
+        cpu.sp = 0xf000
+        for register, value in registers.items():
+            setattr(cpu, register, value)
+        if interrupt is not None:
+            cpu.interrupt(interrupt)
+        getattr(cpu, engine)()
+        cpus.append(cpu)
+    assert state(cpus[0]) == state(cpus[1])
+    return cpus[1]
+
+
+def test_handlers():
+    assert len(sim80.HANDLERS) == 256
+    assert len(sim80.CYCLES) == 256
+
+
+@pytest.mark.parametrize('opcode, cycles', [
+    (0x00, 4), (0x41, 5), (0x46, 7), (0x36, 10), (0x22, 16), (0x32, 13), (0xc3, 10),
+    (0xcd, 17), (0xc9, 10), (0xc0, 5), (0xe3, 18), (0xeb, 4), (0xe9, 5), (0xf9, 5), (0xfb, 4),
+])
+def test_cycles(opcode, cycles):
+    assert sim80.CYCLES[opcode] == cycles
+
+
+def test_mov_mvi():
+    cpu = run(b'\x06\x12\x48\x26\x20\x2e\x00\x71\x7e')  # mvi b / mov c, b / mvi h / mvi l / mov m, c / mov a, m
+    assert (cpu.b, cpu.c, cpu.a) == (0x12, 0x12, 0x12)
+    assert cpu.memory[0x2000] == 0x12
+
+
+def test_lxi_sta_lda_shld_lhld():
+    # lxi h, 1234h / shld 2000h / mvi a, 56h / sta 2002h / lxi h, 0 / lhld 2000h / lda 2002h
+    code = b'\x21\x34\x12\x22\x00\x20\x3e\x56\x32\x02\x20\x21\x00\x00\x2a\x00\x20\x3a\x02\x20'
+    cpu = run(code)
+    assert cpu.memory[0x2000:0x2003] == b'\x34\x12\x56'
+    assert (cpu.h, cpu.l, cpu.a) == (0x12, 0x34, 0x56)
+
+
+@pytest.mark.parametrize('code, a, flags, expected_a, expected_flags', [
+    (b'\x80', 0x01, 0, 0x03, sim80.PARITY),                                       # add b
+    (b'\x80', 0xff, 0, 0x01, sim80.AUX_CARRY | sim80.CARRY),                      # add b
+    (b'\x88', 0xfd, sim80.CARRY, 0x00, sim80.ZERO | sim80.AUX_CARRY
+     | sim80.PARITY | sim80.CARRY),                                               # adc b
+    (b'\x90', 0x01, 0, 0xff, sim80.SIGN | sim80.PARITY | sim80.CARRY),            # sub b
+    (b'\x90', 0x05, 0, 0x03, sim80.AUX_CARRY | sim80.PARITY),                     # sub b
+    (b'\x98', 0x02, sim80.CARRY, 0xff, sim80.SIGN | sim80.PARITY | sim80.CARRY),  # sbb b
+    (b'\xa0', 0x0f, 0, 0x02, sim80.AUX_CARRY),                                    # ana b
+    (b'\xa8', 0x02, sim80.CARRY, 0x00, sim80.ZERO | sim80.PARITY),                # xra b
+    (b'\xb0', 0x80, sim80.CARRY, 0x82, sim80.SIGN | sim80.PARITY),                # ora b
+    (b'\xb8', 0x02, 0, 0x02, sim80.ZERO | sim80.AUX_CARRY | sim80.PARITY),        # cmp b
+])
+def test_alu(code, a, flags, expected_a, expected_flags):
+    cpu = run(code, a=a, b=0x02, f=flags)
+    assert cpu.a == expected_a
+    assert cpu.f == expected_flags
+
+
+@pytest.mark.parametrize('code, value, expected, expected_flags', [
+    (b'\x0c', 0x0f, 0x10, sim80.AUX_CARRY | sim80.CARRY),                         # inr c
+    (b'\x0c', 0xff, 0x00, sim80.ZERO | sim80.AUX_CARRY | sim80.PARITY
+     | sim80.CARRY),                                                              # inr c
+    (b'\x0d', 0x10, 0x0f, sim80.PARITY | sim80.CARRY),                            # dcr c
+    (b'\x0d', 0x01, 0x00, sim80.ZERO | sim80.AUX_CARRY | sim80.PARITY
+     | sim80.CARRY),                                                              # dcr c
+])
+def test_inr_dcr(code, value, expected, expected_flags):
+    cpu = run(code, c=value, f=sim80.CARRY)
+    assert cpu.c == expected
+    assert cpu.f == expected_flags
+
+
+def test_inr_m():
+    cpu = run(b'\x34', h=0x20, l=0x00)  # inr m
+    assert cpu.memory[0x2000] == 0x01
+
+
+def test_daa():
+    cpu = run(b'\x3e\x19\xc6\x28\x27')  # mvi a, 19h / adi 28h / daa
+    assert cpu.a == 0x47
+    assert not cpu.f & sim80.CARRY
+    cpu = run(b'\x3e\x99\xc6\x01\x27')  # mvi a, 99h / adi 01h / daa
+    assert cpu.a == 0x00
+    assert cpu.f & sim80.CARRY
+
+
+@pytest.mark.parametrize('code, flags, expected_a, expected_carry', [
+    (b'\x07', 0, 0x03, sim80.CARRY),            # rlc
+    (b'\x0f', 0, 0xc0, sim80.CARRY),            # rrc
+    (b'\x17', 0, 0x02, sim80.CARRY),            # ral
+    (b'\x1f', sim80.CARRY, 0xc0, sim80.CARRY),  # rar
+])
+def test_rotate(code, flags, expected_a, expected_carry):
+    cpu = run(code, a=0x81, f=flags)
+    assert cpu.a == expected_a
+    assert cpu.f & sim80.CARRY == expected_carry
+
+
+def test_dad():
+    cpu = run(b'\x09', b=0x80, c=0x01, h=0x80, l=0x02)  # dad b
+    assert (cpu.h, cpu.l) == (0x00, 0x03)
+    assert cpu.f & sim80.CARRY
+
+
+def test_inx_dcx_wrap():
+    cpu = run(b'\x13\x2b', d=0xff, e=0xff)  # inx d / dcx h
+    assert (cpu.d, cpu.e, cpu.h, cpu.l) == (0x00, 0x00, 0xff, 0xff)
+
+
+def test_push_pop_psw():
+    # push psw / pop b
+    cpu = run(b'\xf5\xc1', a=0x12, f=0xff)
+    assert (cpu.b, cpu.c) == (0x12, 0xd7)
+    assert cpu.sp == 0xf000
+    # lxi b, 12ffh / push b / pop psw
+    cpu = run(b'\x01\xff\x12\xc5\xf1')
+    assert (cpu.a, cpu.f) == (0x12, 0xd5)
+
+
+def test_xchg_xthl():
+    cpu = run(b'\xeb', d=1, e=2, h=3, l=4)  # xchg
+    assert (cpu.d, cpu.e, cpu.h, cpu.l) == (3, 4, 1, 2)
+    cpu = run(b'\x01\x34\x12\xc5\xe3', h=0x56, l=0x78)  # lxi b, 1234h / push b / xthl
+    assert (cpu.h, cpu.l) == (0x12, 0x34)
+    assert cpu.memory[0xeffe:0xf000] == b'\x78\x56'
+
+
+def test_call_ret():
+    # call 0106h / hlt / mvi a, 1 / ret
+    cpu = run(b'\xcd\x05\x01\x76\x00\x3e\x01\xc9')
+    assert cpu.a == 1
+    assert cpu.pc == 0x0104
+    assert cpu.sp == 0xf000
+
+
+@pytest.mark.parametrize('flags, expected_a, expected_cycles', [
+    (0, 0, 7 + 11 + 7),
+    (sim80.ZERO, 1, 7 + 17 + 7 + 11 + 7),
+])
+def test_conditional_call_return(flags, expected_a, expected_cycles):
+    # mvi a, 0 / cz 0107h / hlt / mvi a, 1 / rz
+    cpu = run(b'\x3e\x00\xcc\x07\x01\x76\x00\x3e\x01\xc8', f=flags)
+    assert cpu.a == expected_a
+    assert cpu.cycles == expected_cycles
+
+
+@pytest.mark.parametrize('opcode, flags, taken', [
+    (0xc2, 0, True),                # jnz
+    (0xc2, sim80.ZERO, False),      # jnz
+    (0xda, sim80.CARRY, True),      # jc
+    (0xe2, sim80.PARITY, False),    # jpo
+    (0xea, sim80.PARITY, True),     # jpe
+    (0xf2, sim80.SIGN, False),      # jp
+    (0xfa, sim80.SIGN, True),       # jm
+])
+def test_conditional_jump(opcode, flags, taken):
+    # j<condition> 0105h / hlt / hlt
+    cpu = run(bytes([opcode, 0x05, 0x01, 0x76, 0x00]), f=flags)
+    assert cpu.pc == (0x0106 if taken else 0x0104)
+
+
+def test_rst_pchl():
+    cpu = sim80.CPU()
+    cpu.load(b'\xef')  # rst 5
+    cpu.load(b'\x76', 0x0028)  # hlt
+    cpu.pc = 0x0100
+    cpu.sp = 0xf000
+    cpu.run()
+    assert cpu.pc == 0x0029
+    assert cpu.memory[0xeffe:0xf000] == b'\x01\x01'
+
+    cpu = run(b'\xe9\x00\x00\x00', h=0x01, l=0x04)  # pchl
+    assert cpu.pc == 0x0105
+
+
+def test_in_out():
+    class Ports(sim80.CPU):
+        __slots__ = ('written',)
+
+        def port_in(self, port):
+            return port + 1
+
+        def port_out(self, port, value):
+            self.written = (port, value)
+
+    cpu = Ports()
+    cpu.load(b'\xdb\x10\xd3\x20\x76')  # in 10h / out 20h / hlt
+    cpu.pc = 0x0100
+    cpu.run()
+    assert cpu.a == 0x11
+    assert cpu.written == (0x20, 0x11)
+
+
+class Timer(sim80.Device):
+    """A device requesting an rst 1 interrupt every period cycles once started.
+
+    Writing to its port starts it with a period of 100 times the value, and
+    reading returns the cycle count of the read."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.period = 0
+        self.ticks = 0
+        self.reads = []
+
+    def read(self, port):
+        self.reads.append(self.cpu.cycles)
+        return self.ticks
+
+    def write(self, port, value):
+        self.period = value * 100
+        self.cpu.schedule(self.period, self.tick)
+
+    def tick(self):
+        self.ticks += 1
+        self.cpu.interrupt(1)
+        self.cpu.schedule(self.period, self.tick)
+
+
+def interrupt_cpu(code, handler=b'\x0c\xfb\xc9'):
+    """Return a CPU with code at 0100h and the rst 1 handler, by default inr c / ei / ret."""
+    cpu = sim80.CPU()
+    cpu.load(handler, 0x0008)
+    cpu.load(code)
+    cpu.pc = 0x0100
+    cpu.sp = 0xf000
+    return cpu
+
+
+@pytest.mark.parametrize('engine', ['run', 'run_blocks'])
+def test_attach_device(engine):
+    cpu = interrupt_cpu(b'\x00\x00\xdb\x10\xd3\x11\x76')  # nop / nop / in 10h / out 11h / hlt
+    timer = Timer(cpu)
+    cpu.attach(timer, [0x10, 0x11])
+    timer.ticks = 0x42
+    getattr(cpu, engine)()
+    assert cpu.a == 0x42
+    assert timer.reads == [4 + 4 + 10]
+    assert timer.period == 0x42 * 100
+    assert cpu.input_ports[0x12] == sim80.NO_DEVICE.read
+    assert cpu.port_in(0x12) == 0xff
+
+
+@pytest.mark.parametrize('engine', ['run', 'run_blocks'])
+def test_schedule(engine):
+    cpu = interrupt_cpu(b'\xc3\x00\x01')  # jmp 0100h
+    fired = []
+    cpu.schedule(100, lambda: fired.append(('a', cpu.cycles)))
+    cpu.schedule(50, lambda: fired.append(('b', cpu.cycles)))
+    cpu.schedule(100, lambda: fired.append(('c', cpu.cycles)))
+    assert cpu.next_event == 50
+    getattr(cpu, engine)(30)
+    # The events are serviced after the instruction reaching their cycle.
+    assert fired == [('b', 50), ('a', 100), ('c', 100)]
+    assert cpu.next_event == sim80.NEVER
+
+
+@pytest.mark.parametrize('engine', ['run', 'run_blocks'])
+def test_timer_interrupts(engine):
+    # lxi sp, f000h / mvi a, 1 / out 10h / ei / loop: mov a, c / cpi 3 / jnz loop / di / hlt
+    cpu = interrupt_cpu(b'\x31\x00\xf0\x3e\x01\xd3\x10\xfb\x79\xfe\x03\xc2\x08\x01\xf3\x76')
+    timer = Timer(cpu)
+    cpu.attach(timer, [0x10])
+    getattr(cpu, engine)()
+    assert cpu.halted
+    assert (cpu.c, timer.ticks) == (3, 3)
+    assert cpu.sp == 0xf000
+    assert not cpu.interrupts_enabled
+    assert cpu.cycles > 3 * 100
+
+
+@pytest.mark.parametrize('engine', ['run', 'run_blocks'])
+def test_hlt_waits_for_interrupt(engine):
+    cpu = interrupt_cpu(b'\xfb\x76\xf3\x76')  # ei / hlt / di / hlt
+    cpu.schedule(1000, lambda: cpu.interrupt(1))
+    assert getattr(cpu, engine)() == 2 + 3 + 2
+    assert cpu.halted
+    assert cpu.c == 1
+    assert cpu.pc == 0x0104
+    assert cpu.cycles == 1000 + 11 + 5 + 4 + 10 + 4 + 7
+
+
+@pytest.mark.parametrize('engine', ['run', 'run_blocks'])
+def test_interrupt_pending_until_enabled(engine):
+    # mvi b, 1 / loop: dcr b / jnz loop / ei / loop2: mov a, c / ora a / jz loop2 / di / hlt
+    cpu = interrupt_cpu(b'\x06\x01\x05\xc2\x02\x01\xfb\x79\xb7\xca\x07\x01\xf3\x76')
+    cpu.interrupt(1)
+    getattr(cpu, engine)()
+    assert cpu.halted
+    assert cpu.c == 1
+    assert cpu.interrupt_request is None
+
+
+def test_ei_delay():
+    cpu = interrupt_cpu(b'\xfb\x00\x00')  # ei / nop / nop
+    cpu.interrupt(1)
+    cpu.step()
+    assert (cpu.pc, cpu.interrupts_enabled) == (0x0101, True)
+    cpu.step()
+    assert (cpu.pc, cpu.interrupts_enabled) == (0x0008, False)
+    assert cpu.memory[0xeffe:0xf000] == b'\x02\x01'
+    assert cpu.cycles == 4 + 4 + 11
+
+
+@pytest.mark.parametrize('nops', [0, sim80.BLOCK_LIMIT - 1])
+def test_ei_delay_blocks(nops):
+    # nop ... / ei / hlt / mvi a, 42h / hlt, with the rst 1 handler inr b / ei / ret.
+    # The pending interrupt is accepted after the hlt, and returns past it.
+    cpu = run(b'\x00' * nops + b'\xfb\x76\x3e\x42', handler=b'\x04\xfb\xc9', interrupt=1)
+    assert (cpu.pc, cpu.a, cpu.b) == (0x0100 + nops + 5, 0x42, 1)
+
+
+def test_interrupt_invalid_vector():
+    with pytest.raises(ValueError):
+        sim80.CPU().interrupt(8)
+
+
+def test_run_limit():
+    cpu = sim80.CPU()
+    cpu.load(b'\xc3\x00\x01')  # jmp 0100h
+    cpu.pc = 0x0100
+    assert cpu.run(1000) == 1000
+    assert cpu.cycles == 10000
+    assert cpu.pc == 0x0100
+    assert not cpu.halted
+
+
+def test_run_halted():
+    cpu = run(b'\x00')  # nop
+    assert cpu.halted
+    assert cpu.pc == 0x0102
+    assert cpu.run() == 0
+
+
+def test_step():
+    cpu = sim80.CPU()
+    cpu.load(b'\x3e\x42')  # mvi a, 42h
+    cpu.pc = 0x0100
+    cpu.step()
+    assert (cpu.a, cpu.pc, cpu.cycles) == (0x42, 0x0102, 7)
+
+
+def test_step_interrupt():
+    cpu = sim80.CPU()
+    cpu.load(b'\xfb\x76\x76')  # ei / hlt / hlt
+    cpu.pc = 0x0100
+    cpu.sp = 0xf000
+    cpu.schedule(1000, lambda: cpu.interrupt(1))
+    assert cpu.step() == 0x0101
+    # The hlt waits for the interrupt, which jumps to its vector.
+    assert cpu.step() == 0x0102
+    assert (cpu.pc, cpu.halted, cpu.memory[0xeffe]) == (0x0008, False, 0x02)
+    assert cpu.cycles == 1000 + 11
+
+
+def test_step_keeps_blocks():
+    cpu = sim80.CPU()
+    cpu.load(b'\x3e\x01\x32\x01\x02\x76')  # mvi a, 1 / sta 0201h / hlt
+    cpu.load(b'\x06\x00\x76', 0x0200)  # mvi b, 0 / hlt
+    cpu.translate(0x0200)
+    cpu.pc = 0x0100
+    cpu.step()
+    assert 0x0200 in cpu.blocks
+    # The store into the translated block discards it.
+    cpu.step()
+    assert 0x0200 not in cpu.blocks
+
+
+def test_load_too_large():
+    with pytest.raises(ValueError):
+        sim80.CPU().load(bytes(0x100), 0xff80)
+
+
+def test_memcpy(tmp_path):
+    asm80.assemble((ASM_DIR / 'memcpy.asm').read_text().splitlines())
+    program_file = tmp_path / 'memcpy.com'
+    program_file.write_bytes(asm80.output)
+    cpu = sim80.load_program(program_file)
+    cpu.run()
+    assert cpu.halted
+    source = asm80.symbol_table['source']
+    dest = asm80.symbol_table['dest']
+    assert cpu.memory[dest:dest + 10] == cpu.memory[source:source + 10] == bytes(range(1, 11))
+
+
+@pytest.mark.parametrize('limit', [0, 1, 5, 20, 1000])
+def test_run_blocks_limit(limit):
+    cpu = sim80.CPU()
+    cpu.load(b'\x3c\x3c\x3c\xc3\x00\x01')  # inr a / inr a / inr a / jmp 0100h
+    cpu.pc = 0x0100
+    assert cpu.run_blocks(limit) == limit
+    assert cpu.cycles == sum((5, 5, 5, 10)[i % 4] for i in range(limit))
+    assert cpu.a == sum(1 for i in range(limit) if i % 4 < 3) & 0xff
+
+
+def test_run_blocks_limit_keeps_blocks(monkeypatch):
+    translated = []
+    translate = sim80.CPU.translate
+    monkeypatch.setattr(sim80.CPU, 'translate',
+                        lambda cpu, start: translated.append(start) or translate(cpu, start))
+    cpu = sim80.CPU()
+    cpu.load(b'\x3c\x3c\x3c\xc3\x00\x01')  # inr a / inr a / inr a / jmp 0100h
+    cpu.pc = 0x0100
+    # The instructions past the last whole block of each run don't discard the blocks.
+    for _ in range(100):
+        assert cpu.run_blocks(5) == 5
+    assert 0x0100 in cpu.blocks
+    assert cpu.a == sum(1 for i in range(500) if i % 4 < 3) & 0xff
+    assert len(translated) <= 4
+
+
+def test_translate():
+    cpu = sim80.CPU()
+    cpu.load(b'\x3e\x01\x06\x02\xc2\x00\x01\x76')  # mvi a, 1 / mvi b, 2 / jnz 0100h / hlt
+    function, count, segments = cpu.translate(0x0100)
+    assert (count, segments) == (3, ((0x0100, 3, 7),))
+    assert cpu.blocks[0x0100] == (function, count, segments)
+    assert cpu.code_map[0x0100:0x0108] == b'\x01' * 7 + b'\x00'
+    # The hlt instruction isn't translated and runs its handler.
+    assert cpu.translate(0x0107)[1:] == (1, ((0x0107, 1, 1),))
+    # A block doesn't end between an ei and an untranslated instruction.
+    cpu.load(b'\x00\xfb\xdb\x10\x76', 0x0200)  # nop / ei / in 10h / hlt
+    assert cpu.translate(0x0200)[1:] == (3, ((0x0200, 3, 4),))
+
+
+def test_translate_jmp():
+    cpu = sim80.CPU()
+    # inr a / jmp 0200h, and at 0200h inr b / jz 0300h / cz 0300h / ret
+    cpu.load(b'\x3c\xc3\x00\x02')
+    cpu.load(b'\x04\xca\x00\x03\xcc\x00\x03\xc9', 0x0200)
+    # The block goes on with the code the jmp targets, and past the conditional jump and call.
+    function, count, segments = cpu.translate(0x0100)
+    assert (count, segments) == (6, ((0x0100, 2, 4), (0x0200, 4, 8)))
+    assert cpu.block_map[0x0203] == [0x0100]
+    cpu.memory[0x0202] = 0x03
+    cpu.invalidate(0x0202)
+    assert cpu.blocks == {} and not any(cpu.code_map)
+
+
+def test_run_blocks_on_block():
+    cpu = sim80.CPU()
+    cpu.load(b'\x06\x03\x05\xc2\x02\x01\x3c\x3c\x76')  # mvi b, 3 / loop: dcr b / jnz loop / inr a / inr a / hlt
+    cpu.pc = 0x0100
+    calls = []
+    assert cpu.run_blocks(8, lambda start, count: calls.append((start, count))) == 8
+    # The blocks are reported once, and the instructions past the last whole block one at a time.
+    assert calls == [(0x0100, 3), (0x0102, 2), (0x0106, 1)]
+    assert cpu.a == 1 and not cpu.halted
+
+
+@pytest.mark.parametrize('limit', [None, 1, 7, 12, 100])
+def test_run_blocks_loop(limit):
+    # mvi b, 10 / loop: dcr b / jz done / inr a / jmp loop / done: hlt
+    cpu = sim80.CPU()
+    cpu.load(b'\x06\x0a\x05\xca\x0a\x01\x3c\xc3\x02\x01\x76')
+    cpu.pc = 0x0100
+    calls = []
+    executed = cpu.run_blocks(limit, lambda start, count: calls.append((start, count)))
+    reference = sim80.CPU()
+    reference.load(cpu.memory[0x0100:0x010b])
+    reference.pc = 0x0100
+    assert executed == reference.run(limit)
+    assert state(cpu) == state(reference)
+    # The passes of the loop are counted once.
+    assert len(calls) == len(set(calls))
+
+
+def test_self_modifying_code():
+    # mvi b, 3 / loop: mvi a, 0 / inr a / sta loop + 1 / dcr b / jnz loop
+    code = b'\x06\x03\x3e\x00\x3c\x32\x03\x01\x05\xc2\x02\x01'
+    # Each iteration patches the operand of mvi a with the value of a, so the
+    # translated block of the loop must be discarded each time.
+    cpu = run(code)
+    assert cpu.a == 3
+    assert cpu.memory[0x0103] == 3
+
+
+def test_self_modifying_block():
+    # mvi a, 42h / sta 0106h / mvi b, 0, whose operand the sta patches.
+    cpu = run(b'\x3e\x42\x32\x06\x01\x06\x00')
+    assert cpu.b == 0x42
+
+
+def test_load_invalidates_blocks():
+    cpu = sim80.CPU()
+    cpu.load(b'\x3e\x01\x76')  # mvi a, 1 / hlt
+    cpu.pc = 0x0100
+    cpu.run_blocks()
+    assert 0x0100 in cpu.blocks
+    cpu.load(b'\x3e\x02', 0x0100)  # mvi a, 2
+    assert 0x0100 not in cpu.blocks
+    cpu.pc = 0x0100
+    cpu.halted = False
+    cpu.run_blocks()
+    assert cpu.a == 2
+
+
+def test_run_blocks_bench(tmp_path):
+    source = (ASM_DIR / 'bench.asm').read_text().replace('10000', '20')
+    asm80.assemble(source.splitlines())
+    program_file = tmp_path / 'bench.com'
+    program_file.write_bytes(asm80.output)
+    interpreted = sim80.load_program(program_file)
+    translated = sim80.load_program(program_file)
+    assert interpreted.run() == translated.run_blocks()
+    assert state(interpreted) == state(translated)
+
+
+def test_dirty_pages():
+    memory = bytearray(sim80.MEMORY_SIZE)
+    saved = bytes(memory)
+    assert sim80.dirty_pages(memory, saved) == []
+    memory[0x0105] = memory[0x20ff] = memory[0x2100] = 1
+    assert sim80.dirty_pages(memory, saved) == [0x0100, 0x2000, 0x2100]
+
+
+def test_snapshot_restore(tmp_path):
+    asm80.assemble((ASM_DIR / 'memcpy.asm').read_text().splitlines())
+    program_file = tmp_path / 'memcpy.com'
+    program_file.write_bytes(asm80.output)
+    cpu = sim80.load_program(program_file)
+    snapshot = cpu.snapshot()
+    cpu.run_blocks()
+    ran = state(cpu)
+    blocks = dict(cpu.blocks)
+    cpu.restore(snapshot)
+    assert not cpu.halted
+    assert cpu.memory == snapshot.memory
+    assert (cpu.pc, cpu.sp, cpu.cycles) == (0x0100, 0xfffe, 0)
+    # The program doesn't modify its code, so the translated blocks are kept.
+    assert cpu.blocks == blocks
+    cpu.run_blocks()
+    assert state(cpu) == ran
+
+
+def test_restore_discards_modified_code():
+    cpu = sim80.CPU()
+    cpu.load(b'\x3e\x01\x76')  # mvi a, 1 / hlt
+    cpu.pc = 0x0100
+    snapshot = cpu.snapshot()
+    cpu.run_blocks()
+    cpu.load(b'\x3e\x02', 0x0100)  # mvi a, 2
+    cpu.pc = 0x0100
+    cpu.halted = False
+    cpu.run_blocks()
+    assert cpu.a == 2
+    cpu.restore(snapshot)
+    assert 0x0100 not in cpu.blocks
+    cpu.run_blocks()
+    assert cpu.a == 1
+
+
+def test_save_load_snapshot(tmp_path):
+    cpu = run(b'\x3e\x42\x32\x00\x20')  # mvi a, 42h / sta 2000h
+    snapshot_file = tmp_path / 'cpu.snapshot'
+    sim80.save_snapshot(cpu.snapshot(), snapshot_file)
+    snapshot = sim80.load_snapshot(snapshot_file)
+    restored = sim80.CPU()
+    restored.restore(snapshot)
+    assert state(restored) == state(cpu)
+
+
+@pytest.mark.parametrize('data', [b'not a snapshot', sim80.SNAPSHOT_MAGIC + b'{}\nxx',
+                                  sim80.SNAPSHOT_MAGIC + b'{}\n' + zlib.compress(b'x'),
+                                  sim80.SNAPSHOT_MAGIC + b'[]\n' + zlib.compress(bytes(sim80.MEMORY_SIZE))])
+def test_load_snapshot_invalid(tmp_path, data):
+    snapshot_file = tmp_path / 'cpu.snapshot'
+    snapshot_file.write_bytes(data)
+    with pytest.raises(ValueError):
+        sim80.load_snapshot(snapshot_file)
+
+
+@pytest.mark.parametrize('state', [{'run': None}, {'a': 1, 'memory': None}])
+def test_restore_invalid(state):
+    cpu = sim80.CPU()
+    with pytest.raises(ValueError):
+        cpu.restore(sim80.Snapshot(state, bytes(sim80.MEMORY_SIZE)))
+    assert cpu.a == 0
+
+
+def test_main_snapshot(tmp_path, monkeypatch):
+    program_file = tmp_path / 'program.com'
+    program_file.write_bytes(b'\x3c\xc3\x00\x01')  # inr a / jmp 0100h
+    snapshot_file = tmp_path / 'program.snapshot'
+    monkeypatch.setattr(sys, 'argv', ['sim80', str(program_file), '-n', '10',
+                                      '--save', str(snapshot_file)])
+    sim80.main()
+    monkeypatch.setattr(sys, 'argv', ['sim80', str(snapshot_file), '--snapshot', '-n', '10',
+                                      '--save', str(snapshot_file)])
+    sim80.main()
+    snapshot = sim80.load_snapshot(snapshot_file)
+    assert snapshot.state['a'] == 10
+    assert snapshot.state['cycles'] == 10 * (5 + 10)
@@ -0,0 +1,169 @@
+"""Tests for the suite8080.test80 module."""
+
+import sys
+from xml.etree import ElementTree
+
+import pytest
+
+from suite8080 import test80
+
+
+# Read a line of console input, which the BDOS echoes.
+ECHO = '''
+            org     100h
+            mvi     a, 16
+            sta     buffer
+            mvi     c, 10               ; Read console buffer
+            lxi     d, buffer
+            call    5
+            ret
+buffer:     ds      20
+'''
+
+# Print a message, with a command line argument directive.
+PRINT = '''
+; test80: arguments hello
+            org     100h
+            mvi     c, 9
+            lxi     d, message
+            call    5
+            ret
+message:    db      'hello$'
+'''
+
+# Make a file, which fails if a directory has its name.
+MAKE = '''
+            org     100h
+            mvi     c, 22               ; Make file
+            lxi     d, fcb
+            call    5
+            ret
+fcb:        db      0, 'X       DAT'
+            ds      24
+'''
+
+LOOP = '''
+; test80: limit 1000
+            org     100h
+loop:       jmp     loop
+'''
+
+
+def write_test(directory, name, source, expected=None, console_input=None):
+    """Write the source and the expected output and console input of a test, and return its file."""
+    source_file = directory / (name + '.asm')
+    source_file.write_text(source)
+    if expected is not None:
+        source_file.with_suffix('.out').write_bytes(expected)
+    if console_input is not None:
+        source_file.with_suffix('.in').write_bytes(console_input)
+    return str(source_file)
+
+
+def test_directives():
+    assert test80.directives(PRINT) == {'arguments': ['hello']}
+    assert test80.directives(LOOP) == {'limit': 1000}
+    with pytest.raises(ValueError):
+        test80.directives('; test80: unknown 1')
+
+
+def test_source_files(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    for name in ('b.asm', 'a.asm', 'sub/c.ASM', 'd.out'):
+        (tmp_path / name).write_text('')
+    assert test80.source_files([tmp_path]) == [str(tmp_path / name)
+                                               for name in ('a.asm', 'b.asm', 'sub/c.ASM')]
+
+
+def test_run_test_passed(tmp_path):
+    filename = write_test(tmp_path, 'print', PRINT, b'hello')
+    test, outcome, message, output, elapsed = test80.run_test(filename)
+    assert (test, outcome, message, output) == (filename, test80.PASSED, '', b'hello')
+
+
+def test_run_test_console_input(tmp_path):
+    filename = write_test(tmp_path, 'echo', ECHO, b'abc\r\n', b'abc\r')
+    assert test80.run_test(filename)[1] == test80.PASSED
+
+
+def test_run_test_mismatch(tmp_path):
+    filename = write_test(tmp_path, 'print', PRINT, b'goodbye')
+    test, outcome, message, output, elapsed = test80.run_test(filename)
+    assert outcome == test80.FAILED
+    assert message.splitlines()[0] == 'console output mismatch'
+    assert '-goodbye' in message and '+hello' in message
+
+
+def test_run_test_limit(tmp_path):
+    filename = write_test(tmp_path, 'loop', LOOP, b'')
+    test, outcome, message, output, elapsed = test80.run_test(filename, limit=10 ** 9)
+    assert outcome == test80.FAILED
+    assert message == 'instruction limit 1000 reached at 0100'
+
+
+def test_run_test_timeout(tmp_path):
+    filename = write_test(tmp_path, 'loop', LOOP.replace('limit 1000', 'limit 1000000000'), b'')
+    test, outcome, message, output, elapsed = test80.run_test(filename, timeout=0.05)
+    assert outcome == test80.FAILED
+    assert message.startswith('timed out after 0.05 s')
+
+
+def test_run_test_errors(tmp_path):
+    filename = write_test(tmp_path, 'bad', ' org 100h\n bogus a', b'')
+    test, outcome, message, output, elapsed = test80.run_test(filename)
+    assert outcome == test80.ERROR
+    assert message.startswith('assembly failed: asm80> line 2')
+
+    filename = write_test(tmp_path, 'bdos', ' org 100h\n mvi c, 99\n call 5\n ret', b'')
+    assert test80.run_test(filename)[1:3] == (test80.ERROR, 'fe00: unsupported BDOS function 99')
+
+    filename = write_test(tmp_path, 'missing', PRINT)
+    assert test80.run_test(filename)[1] == test80.ERROR
+
+
+def test_run_tests_host_error(tmp_path):
+    make = write_test(tmp_path, 'make', MAKE, b'')
+    (tmp_path / 'x.dat').mkdir()
+    print_test = write_test(tmp_path, 'print', PRINT, b'hello')
+    # The host error of a test doesn't stop the others.
+    results = test80.run_tests([make, print_test], jobs=1)
+    assert results[0][1] == test80.ERROR and results[0][2].startswith('fe00: ')
+    assert results[1][1] == test80.PASSED
+
+
+def test_run_test_update(tmp_path):
+    filename = write_test(tmp_path, 'print', PRINT)
+    assert test80.run_test(filename, update=True)[1] == test80.PASSED
+    assert (tmp_path / 'print.out').read_bytes() == b'hello'
+
+
+def test_write_junit(tmp_path):
+    results = [('t/a.asm', test80.PASSED, '', b'\x1b[2Jout\x00\r\n', 0.5),
+               ('t/b.asm', test80.FAILED, 'console output mismatch\n-x\n+y\n', b'', 0.25),
+               ('t/c.asm', test80.ERROR, 'assembly failed', b'', 0.0)]
+    junit_file = tmp_path / 'junit.xml'
+    test80.write_junit(junit_file, results, 1.0)
+    suite = ElementTree.parse(str(junit_file)).getroot()
+    assert suite.attrib['tests'] == '3'
+    assert suite.attrib['failures'] == suite.attrib['errors'] == '1'
+    cases = suite.findall('testcase')
+    assert [case.attrib['name'] for case in cases] == ['a', 'b', 'c']
+    # The control characters XML doesn't allow are escaped.
+    assert cases[0].find('system-out').text == '\\x1b[2Jout\\x00\n'
+    assert cases[1].find('failure').attrib['message'] == 'console output mismatch'
+    assert cases[1].find('failure').text == '-x\n+y\n'
+    assert cases[2].find('error').text == 'assembly failed'
+
+
+def test_main(tmp_path, monkeypatch, capsys):
+    write_test(tmp_path, 'print', PRINT, b'hello')
+    write_test(tmp_path, 'loop', LOOP, b'')
+    junit_file = tmp_path / 'junit.xml'
+    monkeypatch.setattr(sys, 'argv', ['test80', str(tmp_path), '-j', '2', '-x', str(junit_file)])
+    with pytest.raises(SystemExit) as exit_info:
+        test80.main()
+    assert exit_info.value.code == 1
+    captured = capsys.readouterr()
+    assert captured.out.startswith('1 of 2 tests passed')
+    assert 'loop.asm: failed: instruction limit 1000' in captured.err
+    assert ElementTree.parse(str(junit_file)).getroot().attrib['failures'] == '1'
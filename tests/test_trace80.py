@@ -0,0 +1,125 @@
+"""Tests for the suite8080.trace80 module."""
+
+import io
+import sys
+
+import pytest
+
+from suite8080 import dis80
+from suite8080 import sim80
+from suite8080 import trace80
+
+
+# mvi b, 5 / loop: dcr b / jnz loop / hlt
+LOOP = b'\x06\x05\x05\xc2\x02\x01\x76'
+LOOP_INSTRUCTIONS = 1 + 5 * 2 + 1
+
+COMPRESSIONS = [compression for compression in trace80.COMPRESSIONS
+                if compression != 'lzma' or trace80.lzma is not None]
+
+
+def loop_cpu():
+    """Return a CPU ready to run LOOP at 0100h."""
+    cpu = sim80.CPU()
+    cpu.load(LOOP)
+    cpu.pc = 0x0100
+    cpu.sp = 0xf000
+    return cpu
+
+
+def test_trace():
+    cpu = loop_cpu()
+    trace_buffer = trace80.TraceBuffer(100)
+    assert trace80.trace(cpu, trace_buffer) == LOOP_INSTRUCTIONS
+    assert cpu.halted
+    assert cpu.cycles == 7 + 5 * (5 + 10) + 7
+    records = trace_buffer.records()
+    assert len(records) == trace_buffer.total == LOOP_INSTRUCTIONS
+    assert records[0] == (0x0100, 0x06, 0x05, 0x05, 0, 0, 0, 0, 0, 0, 0, 0, 0xf000)
+    # The registers are the ones before the instruction runs.
+    assert records[1][:7] == (0x0102, 0x05, 0xc2, 0x02, 0, 0, 5)
+    assert records[-1][:2] == (0x0106, 0x76)
+
+
+@pytest.mark.parametrize('capacity', [1, 4, LOOP_INSTRUCTIONS])
+def test_trace_ring_buffer(capacity):
+    everything = trace80.TraceBuffer(100)
+    trace80.trace(loop_cpu(), everything)
+    trace_buffer = trace80.TraceBuffer(capacity)
+    trace80.trace(loop_cpu(), trace_buffer)
+    assert trace_buffer.records() == everything.records()[-capacity:]
+
+
+def test_trace_interrupt():
+    # ei / hlt / di / hlt, with the rst 1 handler inr c / ei / ret
+    cpu = loop_cpu()
+    cpu.load(b'\xfb\x76\xf3\x76')
+    cpu.load(b'\x0c\xfb\xc9', 0x0008)
+    cpu.schedule(1000, lambda: cpu.interrupt(1))
+    trace_buffer = trace80.TraceBuffer(100)
+    assert trace80.trace(cpu, trace_buffer) == 7
+    assert cpu.halted and cpu.c == 1
+    # The hlt waits for the interrupt, whose handler returns past it.
+    assert [record[0] for record in trace_buffer.records()] == [
+        0x0100, 0x0101, 0x0008, 0x0009, 0x000a, 0x0102, 0x0103]
+
+
+def test_trace_limit():
+    cpu = loop_cpu()
+    trace_buffer = trace80.TraceBuffer(4)
+    assert trace80.trace(cpu, trace_buffer, 3) == 3
+    assert trace80.trace(cpu, trace_buffer, 3) == 3
+    assert trace_buffer.total == 6
+    assert [record[0] for record in trace_buffer.records()] == [0x0103, 0x0102, 0x0103, 0x0102]
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_trace_file(compression):
+    file = io.BytesIO()
+    trace_buffer = trace80.TraceBuffer(5, file, compression)
+    trace80.trace(loop_cpu(), trace_buffer)
+    trace_buffer.close()
+    everything = trace80.TraceBuffer(100)
+    trace80.trace(loop_cpu(), everything)
+    file.seek(0)
+    assert list(trace80.read_trace(file)) == everything.records()
+
+
+def test_read_trace_invalid():
+    with pytest.raises(ValueError, match='not a trace80 file'):
+        list(trace80.read_trace(io.BytesIO(b'something else\n')))
+    with pytest.raises(ValueError, match='unknown compression'):
+        list(trace80.read_trace(io.BytesIO(trace80.MAGIC + b'zip\n')))
+    with pytest.raises(ValueError, match='truncated'):
+        list(trace80.read_trace(io.BytesIO(trace80.MAGIC + b'none\n' + bytes(20))))
+
+
+def test_format_record(monkeypatch):
+    monkeypatch.setattr(dis80, 'symbol_table', {0x0102: 'loop'})
+    record = (0x0103, 0xc2, 0x02, 0x01, 0x12, 0x44, 0, 4, 0, 0, 0, 0, 0xf000)
+    assert trace80.format_record(record) == (
+        '0103 c2 02 01\t\tjnz loop         '
+        'a=12 f=44 b=00 c=04 d=00 e=00 h=00 l=00 sp=f000')
+    # The label of the instruction doesn't shift the registers.
+    record = (0x0102, 0x05, 0xc2, 0x02, 0x12, 0x44, 0, 4, 0, 0, 0, 0, 0xf000)
+    assert trace80.format_record(record).split('\n') == [
+        'loop:',
+        '0102 05      \t\tdcr b            '
+        'a=12 f=44 b=00 c=04 d=00 e=00 h=00 l=00 sp=f000']
+
+
+def test_main(tmp_path, monkeypatch, capsys):
+    program_file = tmp_path / 'loop.com'
+    program_file.write_bytes(LOOP)
+    trace_file = tmp_path / 'loop.trace'
+    monkeypatch.setattr(sys, 'argv', ['trace80', str(program_file), '-o', str(trace_file),
+                                      '-l', '2', '--capacity', '3'])
+    trace80.main()
+    lines = capsys.readouterr().out.splitlines()
+    assert [line[:4] for line in lines] == ['0103', '0106']
+
+    monkeypatch.setattr(sys, 'argv', ['trace80', '-r', str(trace_file), '-l', '0'])
+    trace80.main()
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == LOOP_INSTRUCTIONS
+    assert lines[0].startswith('0100 06 05')